@@ -1,9 +1,26 @@
-from utils import call_openai_api
+from utils import call_openai_api, config
+from index.retrieval import retrieve_context
+from llm.prompts import PromptTemplate, register
+
+CODE_PROMPT = register(PromptTemplate(
+    "developer.code", 1,
+    system="You are a senior software engineer. You write complete, idiomatic, well-structured code "
+           "that implements user stories and their acceptance criteria.",
+    instructions="Generate code for the user story below. Write it in the language given, follow any "
+                 "additional context, and make sure the code passes the tests if any are given.",
+    slots=[("language", "Language"), ("prompt", "Additional context"), ("tests", "The code must pass these tests"),
+           ("history", "Related project history"), ("user_story", "User story")]))
 
 def fetch_user_stories_from_rally(rally_endpoint, rally_api_key):
     # Simulated fetch logic
     return ["User Story 1", "User Story 2", "User Story 3"]
 
-def generate_code(user_story, language="python", prompt="", model="gpt-4"):
-    code_prompt = f"Generate {language} code for the following user story:\n\n{user_story}\n\nAdditional context:\n{prompt}"
-    return call_openai_api(code_prompt, config.get("openai_api_key"), model)
+def generate_code(user_story, language="python", prompt="", model="gpt-4", history=None, tests=None,
+                  story_id=None):
+    # history: an index.retrieval index; related stories, tests and defects are added to the prompt.
+    # story_id: the Rally FormattedID of user_story, kept out of its own history
+    rendered = CODE_PROMPT.render(language=language, prompt=prompt, tests=tests,
+                                  history=retrieve_context(history, user_story, exclude=[story_id])
+                                  if history is not None else None,
+                                  user_story=user_story)
+    return call_openai_api(rendered, config.get("openai_api_key"), model)
@@ -0,0 +1,259 @@
+"""
+Document → user stories → test cases and code, as one pipeline.
+
+The Product Owner agent turns an uploaded requirements document into user
+stories. ``split_user_stories`` separates them, and each story becomes a
+small DAG of nodes:
+
+- generate test cases
+- generate code, optionally after the tests (which then fill the code prompt's tests slot)
+- upload to Rally, when a project is given
+
+Stories that near-duplicate an earlier story in the document, or an
+existing story in the target Rally project (``index.dedup``), are reported
+and skipped before any of that work is spent on them.
+
+The nodes of every story run concurrently on a bounded pool, so a
+30-story document takes about as long as its slowest story as long as
+``max_workers`` covers its nodes. Rally uploads also share the process-wide
+``RALLY_BUDGET``. ``run_pipeline`` yields a ``PipelineEvent`` as each node
+finishes, so the UI can render results as they arrive.
+"""
+import contextvars
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Collection, Dict, Hashable, Iterator, List, NamedTuple, Optional, Sequence
+
+from agents.developer import generate_code
+from agents.product_owner import handle_file_upload
+from agents.test_manager import generate_test_cases
+from index.dedup import DEDUP_THRESHOLD, DedupIndex, Duplicate, project_story_index
+from index.retrieval import project_history_index
+from rally.portfolio import RALLY_BUDGET
+from utils import upload_user_story_to_rally
+
+# Concurrent agent calls per pipeline run; OpenAI rate limits are the real cap
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "32"))
+
+# Asks the Product Owner agent for stories that split_user_stories can separate
+STORY_FORMAT_PROMPT = (
+    "Write one user story per distinct feature in the document. Start each story "
+    "with a line of the form 'User Story <n>: <title>', followed by the story in "
+    "'As a ..., I want ..., so that ...' form and its acceptance criteria."
+)
+
+# Agent failures come back as text rather than exceptions
+_FAILURE_PREFIXES = ("Error:", "An error occurred:", "File uploaded successfully, but", "Failed to upload")
+
+_STORY_HEADING = re.compile(r"^[\s>#*_-]*(?:\d+[.)]\s*)?(?:user\s+)?story\s*#?\s*\d+\b", re.IGNORECASE)
+_AS_A = re.compile(r"^[\s>#*_-]*(?:\d+[.)]\s*)?\**as\s+an?\s", re.IGNORECASE)
+
+
+class Node(NamedTuple):
+    """One unit of work; runs once every node in ``deps`` has succeeded"""
+    key: Hashable
+    func: Callable[..., Any]
+    deps: Sequence[Hashable] = ()
+
+
+class NodeResult(NamedTuple):
+    key: Hashable
+    value: Any
+    error: Optional[str]
+    elapsed: float
+
+
+class PipelineEvent(NamedTuple):
+    """
+    A finished pipeline step.
+
+    ``kind`` is one of "document", "stories", "duplicate", "test_cases",
+    "code" or "upload". ``story`` is the story's index, or None for
+    document-level steps. ``error`` is set when the step failed or was
+    skipped. A "duplicate" event's value lists the ``Duplicate`` matches;
+    its story gets no further events.
+    """
+    kind: str
+    story: Optional[int]
+    value: Any
+    error: Optional[str]
+    elapsed: float
+
+
+def agent_failed(text: Any) -> bool:
+    return not text or (isinstance(text, str) and text.startswith(_FAILURE_PREFIXES))
+
+
+def split_user_stories(text: str) -> List[str]:
+    """
+    Split agent output into individual user stories.
+
+    Stories are separated at "User Story N" / "Story N" headings, falling back
+    to lines starting "As a ...". Text before the first story (e.g. "Here are
+    the stories:") is dropped. Output with no recognisable separators is
+    returned as a single story.
+    """
+    lines = (text or "").strip().splitlines()
+    for pattern in (_STORY_HEADING, _AS_A):
+        starts = [i for i, line in enumerate(lines) if pattern.match(line)]
+        if len(starts) > 1 or (starts and pattern is _STORY_HEADING):
+            bounds = starts + [len(lines)]
+            stories = ["\n".join(lines[a:b]).strip() for a, b in zip(bounds, bounds[1:])]
+            return [story for story in stories if story]
+    return [text.strip()] if text and text.strip() else []
+
+
+def run_dag(nodes: Sequence[Node], max_workers: int = PIPELINE_MAX_WORKERS) -> Iterator[NodeResult]:
+    """
+    Run ``nodes`` on at most ``max_workers`` threads, yielding each result as it finishes.
+
+    A node's ``func`` receives the values of its ``deps`` as positional
+    arguments. A node whose dependency failed is not run; its result carries
+    an error instead. A node fails when ``func`` raises or returns agent
+    failure text.
+    """
+    by_key = {node.key: node for node in nodes}
+    missing = {dep for node in nodes for dep in node.deps if dep not in by_key}
+    if missing:
+        raise ValueError(f"Unknown dependencies: {sorted(map(str, missing))}")
+    waiting = {node.key: set(node.deps) for node in nodes}
+    dependents: Dict[Hashable, List[Hashable]] = {}
+    for node in nodes:
+        for dep in node.deps:
+            dependents.setdefault(dep, []).append(node.key)
+    values: Dict[Hashable, Any] = {}
+
+    def call(node: Node) -> NodeResult:
+        started = time.perf_counter()
+        try:
+            value = node.func(*(values[dep] for dep in node.deps))
+            error = None
+            if agent_failed(value):
+                error = value if isinstance(value, str) and value else "no result"
+        except Exception as e:
+            value, error = None, str(e)
+        return NodeResult(node.key, value, error, time.perf_counter() - started)
+
+    def start(node: Node):
+        # Nodes run in the caller's context, so its LLM call scope (llm.client) covers them
+        return pool.submit(contextvars.copy_context().run, call, node)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(nodes) or 1))) as pool:
+        running = {start(by_key[key]) for key, deps in waiting.items() if not deps}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                yield result
+                # Skipped nodes settle immediately, and so do their own dependents
+                settled = [result]
+                while settled:
+                    finished = settled.pop()
+                    if finished.error is None:
+                        values[finished.key] = finished.value
+                    for key in dependents.get(finished.key, ()):
+                        if key not in waiting:
+                            continue
+                        if finished.error is not None:
+                            del waiting[key]
+                            skipped = NodeResult(key, None, f"skipped: {finished.key} failed", 0.0)
+                            yield skipped
+                            settled.append(skipped)
+                            continue
+                        waiting[key].discard(finished.key)
+                        if not waiting[key]:
+                            running.add(start(by_key[key]))
+    # Only nodes on a dependency cycle are still waiting
+    for key, deps in waiting.items():
+        if deps:
+            yield NodeResult(key, None, "skipped: dependency cycle", 0.0)
+
+
+def find_duplicates(stories: Sequence[str], existing: Optional[DedupIndex] = None,
+                    threshold: float = DEDUP_THRESHOLD) -> Dict[int, List[Duplicate]]:
+    """
+    Map the index of each story that duplicates another to its matches.
+
+    A story is compared with the stories before it and with ``existing``
+    (e.g. ``project_story_index``). The first of a group of duplicates is
+    kept.
+    """
+    seen = DedupIndex(threshold)
+    duplicates = {}
+    for i, story in enumerate(stories):
+        matches = existing.query(story, threshold) if existing is not None else []
+        matches += seen.query(story, threshold)
+        if matches:
+            duplicates[i] = sorted(matches, key=lambda d: -d.score)
+        else:
+            seen.add(("story", i), story, {"formatted_id": None, "name": story.splitlines()[0]})
+    return duplicates
+
+
+def story_nodes(stories: Sequence[str], project_id: Optional[str] = None, prompt: str = "",
+                model: str = "gpt-4", code_after_tests: bool = False,
+                language: str = "python", skip: Collection[int] = (), history=None) -> List[Node]:
+    """
+    The per-story DAG: test cases, code and (with ``project_id``) a Rally upload.
+
+    ``history`` is an ``index.retrieval`` index whose related snippets are
+    added to each agent prompt.
+    """
+    nodes = []
+    for i, story in enumerate(stories):
+        if i in skip:
+            continue
+        nodes.append(Node(("test_cases", i), lambda story=story: generate_test_cases(
+            story, prompt=prompt, model=model, history=history)))
+        if code_after_tests:
+            nodes.append(Node(("code", i), lambda tests, story=story: generate_code(
+                story, language=language, prompt=prompt, tests=tests, model=model, history=history),
+                deps=[("test_cases", i)]))
+        else:
+            nodes.append(Node(("code", i), lambda story=story: generate_code(
+                story, language=language, prompt=prompt, model=model, history=history)))
+        if project_id:
+            nodes.append(Node(("upload", i), lambda story=story: RALLY_BUDGET.run(
+                upload_user_story_to_rally, story, project_id)))
+    return nodes
+
+
+def run_pipeline(file, project_id: Optional[str] = None, prompt: str = "", model: str = "gpt-4",
+                 code_after_tests: bool = False, language: str = "python",
+                 max_workers: int = PIPELINE_MAX_WORKERS, workspace_id: Optional[str] = None,
+                 skip_duplicates: bool = True) -> Iterator[PipelineEvent]:
+    """
+    Run the whole pipeline on an uploaded document, yielding events as steps finish.
+
+    ``file`` is anything ``handle_file_upload`` accepts. Stories are uploaded
+    to Rally only when ``project_id`` is given. The "stories" event carries
+    the list of story texts; later events refer to stories by index. With
+    ``skip_duplicates``, duplicate stories are reported and skipped; they are
+    checked against the project's Rally stories when ``workspace_id`` and
+    ``project_id`` are given; with both, the agents are also given related
+    project history (``index.retrieval``).
+    """
+    started = time.perf_counter()
+    document = handle_file_upload(file, model=model, prompt=STORY_FORMAT_PROMPT)
+    elapsed = time.perf_counter() - started
+    if agent_failed(document):
+        yield PipelineEvent("document", None, None, document or "no result", elapsed)
+        return
+    yield PipelineEvent("document", None, document, None, elapsed)
+
+    stories = split_user_stories(document)
+    yield PipelineEvent("stories", None, stories, None if stories else "no user stories found", 0.0)
+    duplicates = {}
+    if skip_duplicates and stories:
+        existing = project_story_index(workspace_id, project_id) if workspace_id and project_id else None
+        duplicates = find_duplicates(stories, existing)
+        for i, matches in sorted(duplicates.items()):
+            yield PipelineEvent("duplicate", i, matches, None, 0.0)
+    history = project_history_index(workspace_id, project_id) if workspace_id and project_id else None
+    nodes = story_nodes(stories, project_id, prompt, model, code_after_tests, language, skip=duplicates,
+                        history=history)
+    for result in run_dag(nodes, max_workers):
+        kind, index = result.key
+        yield PipelineEvent(kind, index, result.value, result.error, result.elapsed)
@@ -1,9 +1,16 @@
 import PyPDF2
 from io import BytesIO
-from utils import call_openai_api
-import openai
+from utils import call_openai_api, config
+from llm.prompts import PromptTemplate, register
 
-def handle_file_upload(file, model="gpt-4"):
+USER_STORY_PROMPT = register(PromptTemplate(
+    "product_owner.user_stories", 1,
+    system="You are a product owner. You turn requirements documents into user stories with "
+           "acceptance criteria.",
+    instructions="Generate a user story based on the document below, following any additional context.",
+    slots=[("prompt", "Additional context"), ("document", "Document")]))
+
+def handle_file_upload(file, model="gpt-4", prompt=""):
     try:
         if file.type == "application/pdf":
             pdf_reader = PyPDF2.PdfReader(BytesIO(file.read()))
@@ -11,13 +18,8 @@ def handle_file_upload(file, model="gpt-4"):
         else:
             file_content = file.read().decode("utf-8")
 
-        prompt = f"Generate a user story based on the following document:\n\n{file_content}"
-        openai.api_key = config.get("openai_api_key")
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
+        rendered = USER_STORY_PROMPT.render(prompt=prompt, document=file_content)
+        return call_openai_api(rendered, config.get("openai_api_key"), model)
     except UnicodeDecodeError:
         return "File uploaded successfully, but it couldn't be decoded. Please ensure it is a valid text or PDF file."
     except Exception as e:
@@ -1,5 +1,175 @@
-from utils import call_openai_api
+import html
+import queue
+import re
+from concurrent.futures import CancelledError
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-def generate_test_cases(user_story, prompt, openai_api_key):
-    test_case_prompt = f"Generate test cases for the following user story:\n\n{user_story}\n\nAdditional context:\n{prompt}"
-    return call_openai_api(test_case_prompt, openai_api_key)
+from utils import call_openai_api, config
+from index.retrieval import retrieve_context
+from llm.client import StreamInterrupted, start_stream
+from llm.prompts import PromptTemplate, register
+from llm.structured import ItemScanner
+
+TEST_CASES_PROMPT = register(PromptTemplate(
+    "test_manager.test_cases", 1,
+    system="You are an experienced test manager. You write clear, thorough test cases that cover "
+           "the acceptance criteria, edge cases and error handling of a user story.",
+    instructions="Generate test cases for the user story below, following any additional context.",
+    slots=[("prompt", "Additional context"), ("history", "Related project history"), ("user_story", "User story")]))
+
+def generate_test_cases(user_story, prompt="", openai_api_key=None, model="gpt-4", history=None, story_id=None):
+    # history: an index.retrieval index; related stories, tests and defects are added to the prompt.
+    # story_id: the Rally FormattedID of user_story, kept out of its own history
+    rendered = TEST_CASES_PROMPT.render(
+        prompt=prompt, history=retrieve_context(history, user_story, exclude=[story_id])
+        if history is not None else None,
+        user_story=user_story)
+    return call_openai_api(rendered, openai_api_key or config.get("openai_api_key"), model)
+
+# Structured output: one JSON record per test case, parsed and validated as it streams
+
+TEST_CASES_JSON_PROMPT = register(PromptTemplate(
+    "test_manager.test_cases_json", 1,
+    system="You are an experienced test manager. You write clear, thorough test cases that cover "
+           "the acceptance criteria, edge cases and error handling of a user story. You answer with "
+           "JSON only.",
+    instructions='Generate test cases for the user story below, following any additional context. '
+                 'Answer with a JSON object of the form {"test_cases": [...]}, where each test case is '
+                 'an object with these keys:\n'
+                 '- "name": a short title\n'
+                 '- "steps": a list of strings, one action per step\n'
+                 '- "expected_result": what the tester should observe\n'
+                 '- "priority": "Critical", "Important" or "Useful"\n'
+                 '- "method": "Manual" or "Automated"',
+    slots=[("prompt", "Additional context"), ("history", "Related project history"), ("user_story", "User story")]))
+
+# Rally's TestCase Priority and Method values, and the spellings models use for them
+PRIORITIES = {"critical": "Critical", "blocker": "Critical", "highest": "Critical", "p0": "Critical",
+              "important": "Important", "high": "Important", "p1": "Important",
+              "useful": "Useful", "medium": "Useful", "normal": "Useful", "low": "Useful",
+              "p2": "Useful", "p3": "Useful"}
+METHODS = {"manual": "Manual", "automated": "Automated", "automation": "Automated", "auto": "Automated"}
+
+_STEP_NUMBER = re.compile(r"^\s*(?:step\s*)?\d+\s*[.):-]\s*", re.IGNORECASE)
+
+
+class TestCaseSpec(NamedTuple):
+    """A generated test case, validated against the structured-output schema"""
+    name: str
+    steps: Tuple[str, ...]
+    expected_result: str
+    priority: str = "Useful"
+    method: str = "Manual"
+
+    @classmethod
+    def from_json(cls, obj: Any) -> "TestCaseSpec":
+        """
+        Validate one JSON test case, coercing near misses.
+
+        Keys are matched ignoring case and punctuation ("expectedResult",
+        "Expected Result"), steps given as one string are split into lines,
+        and unknown priorities and methods fall back to the defaults. Raises
+        ``ValueError`` naming what is missing.
+        """
+        if not isinstance(obj, dict):
+            raise ValueError(f"expected an object, got {type(obj).__name__}")
+        fields = {re.sub(r"[^a-z]", "", str(k).lower()): v for k, v in obj.items()}
+        name = _text(fields.get("name") or fields.get("title"))
+        steps = _steps(fields.get("steps"))
+        expected = _text(fields.get("expectedresult") or fields.get("expected") or fields.get("expectedresults"))
+        missing = [label for label, value in (("name", name), ("steps", steps), ("expected_result", expected))
+                   if not value]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        return cls(name[:256], steps, expected,
+                   PRIORITIES.get(_text(fields.get("priority")).lower(), "Useful"),
+                   METHODS.get(_text(fields.get("method")).lower(), "Manual"))
+
+    def to_rally(self, work_product: str, project: str) -> Dict[str, Any]:
+        """Fields of a Rally TestCase create for this case; steps go in ``ValidationInput``"""
+        steps = "".join(f"<li>{html.escape(step)}</li>" for step in self.steps)
+        return {"Name": self.name, "WorkProduct": work_product, "Project": project,
+                "ValidationInput": f"<ol>{steps}</ol>",
+                "ValidationExpectedResult": html.escape(self.expected_result),
+                "Priority": self.priority, "Method": self.method}
+
+
+def _text(value: Any) -> str:
+    return value.strip() if isinstance(value, str) else "" if value is None else str(value).strip()
+
+
+def _steps(value: Any) -> Tuple[str, ...]:
+    if isinstance(value, str):
+        value = value.splitlines()
+    if not isinstance(value, list):
+        return ()
+    steps = []
+    for step in value:
+        if isinstance(step, dict):
+            # {"action": ..., "expected": ...} and similar
+            step = " ".join(_text(v) for v in step.values() if _text(v))
+        step = _STEP_NUMBER.sub("", _text(step))
+        if step:
+            steps.append(step)
+    return tuple(steps)
+
+
+class TestCaseStream:
+    """
+    Test cases for a user story, yielded one by one while the model is still writing.
+
+    Iterate it once. Each test case is validated as soon as its JSON object
+    closes (``llm.structured``); records that fail validation are kept in
+    ``rejected`` as (text, reason) instead of being yielded. After iteration,
+    ``truncated`` says the output stopped part way through a record, and
+    ``error`` holds the failure text if the call failed. Abandoning the
+    iteration cancels the call.
+    """
+
+    def __init__(self, user_story, prompt="", openai_api_key=None, model="gpt-4", history=None, story_id=None):
+        self.rendered = TEST_CASES_JSON_PROMPT.render(
+            prompt=prompt, history=retrieve_context(history, user_story, exclude=[story_id])
+            if history is not None else None,
+            user_story=user_story)
+        self.api_key = openai_api_key or config.get("openai_api_key")
+        self.model = model
+        self.cases: List[TestCaseSpec] = []
+        self.rejected: List[Tuple[str, str]] = []
+        self.truncated = False
+        self.error: Optional[str] = None
+
+    def __iter__(self) -> Iterator[TestCaseSpec]:
+        scanner, items = ItemScanner("test_cases"), queue.Queue()
+
+        def on_text(text):
+            # Runs on the completion loop; scanning a chunk is cheap, validation happens here
+            for item in scanner.feed(text):
+                items.put(item)
+
+        future = start_stream(self.rendered.messages, self.api_key, on_text, self.model, json_mode=True)
+        future.add_done_callback(lambda _: items.put(None))
+        try:
+            for item in iter(items.get, None):
+                if item.error is not None:
+                    self.rejected.append((item.text, f"invalid JSON: {item.error}"))
+                    continue
+                try:
+                    case = TestCaseSpec.from_json(item.value)
+                except ValueError as e:
+                    self.rejected.append((item.text, str(e)))
+                    continue
+                self.cases.append(case)
+                yield case
+        finally:
+            future.cancel()
+        try:
+            future.result()
+        except StreamInterrupted as e:
+            self.truncated, self.error = True, f"Error: the response stopped early ({e.__cause__})"
+        except CancelledError:
+            self.error = "Error: the request was cancelled"
+        except Exception as e:
+            self.error = f"Error: {e}"
+        self.truncated = self.truncated or scanner.partial
+        if self.error is None and not self.cases:
+            self.error = "Error: no valid test cases in the response"
@@ -0,0 +1,299 @@
+"""
+Headless JSON API over the SDLC agents and Rally aggregations.
+
+The same functions the Streamlit app calls are exposed as JSON endpoints so
+CI pipelines and other services can call them directly. Rally data comes
+from the shared process caches in ``rally.cache`` over pooled connections,
+and webhook invalidation (``rally.webhooks``) applies here too. Aggregation
+responses carry a weak ETag and answer ``If-None-Match`` with 304, and
+responses over ``GZIP_MIN_BYTES`` are gzip-compressed for clients that
+accept it. The code and test case endpoints take optional ``workspace_id``
+and ``project_id`` to ground the prompt in that project's Rally history
+(``index.retrieval``), ``"history_tests": true`` to include its test cases
+in that history, and ``story_id`` to keep the story itself out of it. With ``"structured": true`` the test case endpoint
+returns validated JSON records, and posting a user story to a story's
+``/test-cases`` creates those records in Rally as TestCases of the story.
+
+Credentials are read from ``config.json`` (see ``config.settings``) and
+then from the ``RALLY_ENDPOINT``, ``RALLY_API_KEY`` and ``OPENAI_API_KEY``
+environment variables. When ``SDLC_API_TOKEN`` is set, every request except
+``/api/health`` and the webhook receiver (``POST /rally/webhook``) needs
+``Authorization: Bearer <token>``.
+
+Run with ``python api.py [--port 8800]`` or any WSGI server (``api:app``).
+"""
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import os
+from typing import Any, Dict, Optional
+
+from flask import Flask, Response, jsonify, request
+
+import utils
+from agents.developer import generate_code
+from agents.product_owner import handle_file_upload
+from agents.test_manager import TestCaseStream, generate_test_cases
+from config.settings import load_config
+from index.fulltext import ensure_synced, get_search_index
+from index.retrieval import CONTEXT_INCLUDE_TESTS, project_history_index
+from rally import cache
+from rally.batch import create_test_cases
+from rally.rollup import DefectCube
+from rally.webhooks import create_app as create_webhook_app
+
+API_TOKEN = os.getenv("SDLC_API_TOKEN", "")
+DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+
+# Smaller bodies are sent uncompressed
+GZIP_MIN_BYTES = 1024
+
+# Compressed bodies by ETag, so repeated reads of unchanged data skip gzip
+_gzip_cache = cache.get_cache("api_gzip", max_entries=128, copy_on_read=False)
+
+
+def configure() -> None:
+    """Load credentials into ``utils.config`` from config.json and the environment"""
+    utils.config.update({k: v for k, v in load_config().items() if v})
+    for key, env in (("rally_endpoint", "RALLY_ENDPOINT"), ("rally_api_key", "RALLY_API_KEY"),
+                     ("openai_api_key", "OPENAI_API_KEY")):
+        if os.getenv(env):
+            utils.config[key] = os.getenv(env)
+
+
+def to_jsonable(value: Any) -> Any:
+    """Convert fetcher results to plain JSON types; rollup cubes are left out"""
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items() if not isinstance(v, DefectCube)}
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if hasattr(value, "_asdict"):
+        return value._asdict()
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    return value
+
+
+def etag_response(payload: Any) -> Response:
+    """JSON response with a content ETag, or 304 if the client already has it"""
+    body = json.dumps(to_jsonable(payload), sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    response = Response(body, mimetype="application/json")
+    # Weak, so the gzip and identity encodings of the same data share it
+    response.set_etag(hashlib.sha256(body).hexdigest()[:32], weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+class _Upload:
+    """Adapts a Werkzeug upload to the ``type``/``read`` interface of Streamlit's UploadedFile"""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.name = storage.filename
+        self.type = storage.mimetype
+
+    def read(self) -> bytes:
+        return self._storage.read()
+
+
+def _error(message: str, status: int) -> Response:
+    response = jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+def _json_body(*required: str) -> Dict[str, Any]:
+    body = request.get_json(silent=True) or {}
+    missing = [name for name in required if not body.get(name)]
+    if missing:
+        raise ValueError(f"Missing field(s): {', '.join(missing)}")
+    return body
+
+
+def create_app(token: Optional[str] = None) -> Flask:
+    token = API_TOKEN if token is None else token
+    app = Flask(__name__)
+
+    @app.before_request
+    def authenticate():
+        # Rally webhooks can't send headers; the receiver checks its own ?token=
+        receiver = request.path == "/rally/webhook" and request.method == "POST"
+        if token and request.path != "/api/health" and not receiver:
+            supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+            if not hmac.compare_digest(supplied, token):
+                return _error("invalid or missing bearer token", 401)
+
+    @app.after_request
+    def compress(response: Response) -> Response:
+        response.vary.add("Accept-Encoding")
+        if (response.status_code != 200 or response.direct_passthrough
+                or "Content-Encoding" in response.headers
+                or "gzip" not in request.headers.get("Accept-Encoding", "")):
+            return response
+        body = response.get_data()
+        if len(body) < GZIP_MIN_BYTES:
+            return response
+        etag, _ = response.get_etag()
+        compressed = _gzip_cache.get(etag) if etag else None
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=5)
+            if etag:
+                _gzip_cache.set(etag, compressed)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    @app.errorhandler(ValueError)
+    def bad_request(e):
+        return _error(str(e), 400)
+
+    @app.route("/api/health")
+    def health():
+        return jsonify({"status": "ok", "rally_configured": utils.check_rally_config(),
+                        "openai_configured": bool(utils.config.get("openai_api_key"))})
+
+    # -- agents -----------------------------------------------------------
+
+    def _agent_result(text: str) -> Response:
+        # The agents report failures as text rather than raising
+        if not text or text.startswith(("Error:", "An error occurred:")):
+            return _error(text or "empty response", 502)
+        return jsonify({"result": text})
+
+    def _history(body: Dict[str, Any]):
+        # Optional grounding in a Rally project's stories, tests and defects
+        if not (body.get("workspace_id") and body.get("project_id")):
+            return None
+        if not utils.check_rally_config():
+            raise ValueError("workspace_id/project_id given but Rally is not configured")
+        return project_history_index(body["workspace_id"], body["project_id"],
+                                     bool(body.get("history_tests", CONTEXT_INCLUDE_TESTS)))
+
+    @app.route("/api/code", methods=["POST"])
+    def code():
+        body = _json_body("user_story")
+        return _agent_result(generate_code(body["user_story"], language=body.get("language", "python"),
+                                           prompt=body.get("prompt", ""),
+                                           model=body.get("model", DEFAULT_MODEL), history=_history(body),
+                                           story_id=body.get("story_id")))
+
+    def _structured_result(stream: TestCaseStream, **extra: Any) -> Response:
+        if stream.error and not stream.cases:
+            return _error(stream.error, 502)
+        return jsonify(dict({"test_cases": [case._asdict() for case in stream.cases],
+                             "rejected": [{"text": text, "reason": reason} for text, reason in stream.rejected],
+                             "truncated": stream.truncated}, **extra))
+
+    @app.route("/api/test-cases", methods=["POST"])
+    def test_cases():
+        body = _json_body("user_story")
+        if body.get("structured"):
+            stream = TestCaseStream(body["user_story"], prompt=body.get("prompt", ""),
+                                    model=body.get("model", DEFAULT_MODEL), history=_history(body),
+                                    story_id=body.get("story_id"))
+            for _ in stream:
+                pass
+            return _structured_result(stream)
+        return _agent_result(generate_test_cases(body["user_story"], prompt=body.get("prompt", ""),
+                                                 model=body.get("model", DEFAULT_MODEL), history=_history(body),
+                                                 story_id=body.get("story_id")))
+
+    @app.route("/api/user-stories/from-document", methods=["POST"])
+    def user_story_from_document():
+        if "file" not in request.files:
+            raise ValueError("Missing multipart field: file")
+        model = request.form.get("model", DEFAULT_MODEL)
+        return _agent_result(handle_file_upload(_Upload(request.files["file"]), model=model))
+
+    # -- Rally aggregations ----------------------------------------------
+
+    def _require_rally() -> Optional[Response]:
+        if not utils.check_rally_config():
+            return _error("Rally is not configured", 503)
+        return None
+
+    story_path = "/api/rally/workspaces/<workspace_id>/projects/<project_id>/stories/<story_id>"
+    project_path = "/api/rally/workspaces/<workspace_id>/projects/<project_id>"
+
+    @app.route(f"{story_path}/test-cases", methods=["POST"])
+    def create_story_test_cases(workspace_id, project_id, story_id):
+        # Structured test cases for the story, created in Rally batch by batch as they are generated
+        unconfigured = _require_rally()
+        if unconfigured:
+            return unconfigured
+        body = _json_body("user_story")
+        stream = TestCaseStream(body["user_story"], prompt=body.get("prompt", ""),
+                                model=body.get("model", DEFAULT_MODEL), history=_history(
+                                    dict(body, workspace_id=workspace_id, project_id=project_id)
+                                    if body.get("with_history") else {}), story_id=story_id)
+        report = create_test_cases(workspace_id, project_id, story_id, stream)
+        response = _structured_result(stream, rally={
+            "created": [{"FormattedID": obj.get("FormattedID"), "_ref": obj.get("_ref")} for obj in report.created],
+            "errors": report.errors, "requests": report.requests})
+        if report.created:
+            response.status_code = 201
+        return response
+
+    @app.route(f"{story_path}/test-data")
+    def story_test_data(workspace_id, project_id, story_id):
+        unconfigured = _require_rally()
+        if unconfigured:
+            return unconfigured
+        data = cache.get_user_story_test_data(workspace_id, project_id, story_id)
+        return etag_response(data) if data is not None else _error("Failed to fetch test data", 502)
+
+    @app.route(f"{story_path}/test-summary")
+    def story_test_summary(workspace_id, project_id, story_id):
+        return _require_rally() or etag_response(
+            cache.get_user_story_test_summary(workspace_id, project_id, story_id))
+
+    @app.route(f"{project_path}/rca")
+    def project_rca(workspace_id, project_id):
+        unconfigured = _require_rally()
+        if unconfigured:
+            return unconfigured
+        data = cache.get_project_rca_data(workspace_id, project_id)
+        return etag_response(data) if data is not None else _error("Failed to fetch RCA data", 502)
+
+    @app.route(f"{project_path}/rca-summary")
+    def project_rca_summary(workspace_id, project_id):
+        return _require_rally() or etag_response(cache.get_project_rca_summary(workspace_id, project_id))
+
+    @app.route("/api/rally/workspaces/<workspace_id>/search")
+    def search(workspace_id):
+        # Typeahead over the local index: ?q=&kind=story&kind=defect&project=&limit=
+        unconfigured = _require_rally()
+        if unconfigured:
+            return unconfigured
+        project_id = request.args.get("project")
+        ensure_synced(workspace_id, [project_id] if project_id else None)
+        return jsonify(get_search_index().search(
+            request.args.get("q", ""), workspace_id=workspace_id, project_id=project_id,
+            kinds=request.args.getlist("kind") or None, limit=min(int(request.args.get("limit", 20)), 200)))
+
+    @app.route("/api/cache")
+    def cache_usage():
+        return jsonify(cache.cache_stats())
+
+    # Rally webhooks invalidate this process's caches
+    webhooks = create_webhook_app()
+    for rule in webhooks.url_map.iter_rules():
+        if rule.endpoint != "static":
+            app.add_url_rule(rule.rule, f"webhook_{rule.endpoint}", webhooks.view_functions[rule.endpoint],
+                             methods=rule.methods)
+
+    return app
+
+
+configure()
+app = create_app()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SDLC agent JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("SDLC_API_PORT", "8800")))
+    args = parser.parse_args()
+    app.run(host=args.host, port=args.port, threaded=True)
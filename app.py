@@ -1,58 +1,62 @@
 import streamlit as st
 from agents.product_owner import handle_file_upload
 from agents.developer import generate_code
-from agents.test_manager import generate_test_cases
+from agents.test_manager import TestCaseStream, generate_test_cases
+from agents.pipeline import run_pipeline
+from index.fulltext import ensure_synced, get_search_index, sync_workspace
+from index.retrieval import CONTEXT_INCLUDE_TESTS, project_history_index
+from index.text import strip_html
+from llm.client import CallScope
+from llm.policy import llm_stats
+from config.models import OPENAI_MODELS
+from rally.paging import SELECTOR_WINDOW, lazy_projects, lazy_user_stories
+from rally.batch import create_test_cases
+from rally.http import transfer_stats
+from rally.prefetch import PREFETCH_ENABLED, Prefetcher, prefetch_stats
 from utils import (
     check_rally_config,
     upload_user_story_to_rally,
     config,
-    test_rally_connection,
+    test_rally_connection
+)
+from rally.webhooks import start_receiver, webhook_stats
+from rally.cache import (
+    cache_stats,
     get_rally_workspaces,
-    get_rally_projects,
-    get_rally_user_stories,
     get_user_story_test_data,
-    get_project_rca_data
+    get_user_story_test_summary,
+    get_project_rca_data,
+    get_project_rca_summary
 )
-import openai
 import pandas as pd
 import plotly.express as px
 import urllib3
 import warnings
 import plotly.graph_objects as go
+import os
+import time
+import threading
+import contextvars
+import concurrent.futures
 from typing import Dict
 
-# Define OPENAI_MODELS right here, after imports
-OPENAI_MODELS = {
-    "gpt-4": {
-        "description": "Most capable model, best for complex tasks",
-        "context_length": "8,192 tokens",
-        "training_data": "Up to Sep 2023"
-    },
-    "gpt-4-turbo": {
-        "description": "Latest GPT-4 model with improved performance",
-        "context_length": "128,000 tokens",
-        "training_data": "Up to Dec 2023"
-    },
-    "gpt-3.5-turbo": {
-        "description": "Fast and cost-effective for most tasks",
-        "context_length": "4,096 tokens",
-        "training_data": "Up to Sep 2023"
-    },
-    "gpt-3.5-turbo-16k": {
-        "description": "Same as 3.5-turbo with extended context",
-        "context_length": "16,384 tokens",
-        "training_data": "Up to Sep 2023"
-    }
-}
-
 # Initialize session state for openai_model
 if 'openai_model' not in st.session_state:
     st.session_state.openai_model = "gpt-4"
 
+# A rerun replaces the page, so agent calls still running for the previous run are cancelled.
+# Blocking agent calls go through interruptible() so the previous run can end while they wait.
+if 'llm_scope' not in st.session_state:
+    st.session_state.llm_scope = CallScope()
+st.session_state.llm_scope.cancel()
+st.session_state.llm_scope.activate()
+
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
  
-openai.api_key = 'your-api-key-here'
+# Rally webhooks invalidate the shared caches; started once per server process
+if os.getenv("RALLY_WEBHOOK_PORT"):
+    start_receiver(int(os.getenv("RALLY_WEBHOOK_PORT")))
  
 # Configure page settings
 st.set_page_config(
@@ -177,7 +181,8 @@ if st.session_state.task_agents_enabled:
         [
             "👤 Product Owner Agent",
             "👨‍💻 Developer Agent",
-            "🧪 Test Manager Agent"
+            "🧪 Test Manager Agent",
+            "🔗 SDLC Pipeline"
         ]
     )
 else:
@@ -202,7 +207,8 @@ if st.session_state.ops_agents_enabled:
         "Select Ops Agent",
         [
             "🔍 Failure Analysis",
-            "🎯 Root Cause Analysis"
+            "🎯 Root Cause Analysis",
+            "🔎 Rally Search"
         ]
     )
 else:
@@ -311,6 +317,37 @@ if st.sidebar.checkbox("Show Configuration"):
                 st.sidebar.error("Please save Rally configuration first")
    
     st.sidebar.markdown('</div>', unsafe_allow_html=True)
+
+    # Shared Rally caches are per process, so this reflects all sessions
+    with st.sidebar.expander("Shared Cache Usage", expanded=False):
+        stats = cache_stats()
+        if stats:
+            # Sizes are None for backends that can't report them; those rows show blank
+            st.dataframe(
+                pd.DataFrame(stats).assign(
+                    kib=lambda df: (pd.to_numeric(df["bytes"], errors="coerce") / 1024).round(1)),
+                hide_index=True
+            )
+        else:
+            st.caption("No Rally data cached yet")
+        if os.getenv("RALLY_WEBHOOK_PORT"):
+            st.caption(f"Webhook invalidations received: {webhook_stats()['events']}")
+        transfer = transfer_stats()
+        if transfer["requests"]:
+            st.caption(f"Rally transfer: {transfer['not_modified']} of {transfer['requests']} requests not modified, "
+                       f"{(transfer['bytes_saved'] + transfer['compression_saved']) / 1024:.0f} KiB saved")
+        if PREFETCH_ENABLED:
+            prefetched = prefetch_stats()
+            st.caption(f"Prefetched: {prefetched['fetched']} fetches for {prefetched['selections']} selections "
+                       f"({prefetched['cancelled']} cancelled)")
+
+    # Outcomes of every OpenAI request made by this process, per model
+    with st.sidebar.expander("LLM Calls", expanded=False):
+        calls = llm_stats()
+        if calls:
+            st.dataframe(pd.DataFrame(calls).fillna(0), hide_index=True)
+        else:
+            st.caption("No LLM requests made yet")
  
 # Main content area with custom styling
 st.markdown("""
@@ -420,31 +457,181 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
  
+def interruptible(func, *args, **kwargs):
+    """
+    Call a blocking agent function so that a rerun can cancel it.
+
+    The call runs on a worker thread in this run's context, so its
+    completions belong to ``llm_scope``, while the script thread waits in
+    short steps and touches the page between them. Streamlit only stops a
+    run when the page is updated, so that is where a rerun ends this one;
+    the next run's ``llm_scope.cancel()`` then cancels the completion.
+    """
+    done = concurrent.futures.Future()
+    context = contextvars.copy_context()
+
+    def work():
+        try:
+            done.set_result(context.run(func, *args, **kwargs))
+        except BaseException as e:
+            done.set_exception(e)
+
+    threading.Thread(target=work, name="agent-call", daemon=True).start()
+    heartbeat = st.empty()
+    while True:
+        try:
+            return done.result(timeout=0.25)
+        except concurrent.futures.TimeoutError:
+            heartbeat.empty()
+ 
+def paged_selectbox(label: str, pages, key: str, label_of):
+    """
+    Selectbox over a ``LazyPages`` list that starts with one window of entries.
+ 
+    Further windows are fetched only when the user asks for them, so long
+    Rally lists render after a single page request.
+    """
+    shown_key = f"{key}_shown"
+    shown = st.session_state.get(shown_key, SELECTOR_WINDOW)
+    try:
+        items = pages.window(0, shown)
+        more = pages.has_more(shown)
+    except Exception as e:
+        st.error(f"Couldn't load the list from Rally: {e}")
+        return None
+    if not items:
+        return None
+    selected = st.selectbox(label, items, format_func=label_of, key=key)
+    if more:
+        if st.button(f"Load more ({len(items)} shown)", key=f"{key}_more"):
+            st.session_state[shown_key] = shown + SELECTOR_WINDOW
+            st.rerun()
+    return selected
+ 
 # Workspace and Project Selection
-def show_workspace_project_selector():
+def show_workspace_project_selector(key: str = "rally", prefetch: bool = False):
+    # key: per caller, so two selectors on one page don't clash.
+    # prefetch: warm the selected project's summaries, for pages that show them
     workspaces = st.session_state.get('workspaces', [])
     selected_workspace = None
     selected_project = None
    
     if workspaces:
         workspace_names = {w["name"]: w["id"] for w in workspaces}
-        selected_workspace_name = st.selectbox("Select Workspace", list(workspace_names.keys()))
+        selected_workspace_name = st.selectbox("Select Workspace", list(workspace_names.keys()),
+                                               key=f"{key}_workspace")
        
         if selected_workspace_name:
             selected_workspace = workspace_names[selected_workspace_name]
-            projects = get_rally_projects(selected_workspace)
-           
-            if projects:
-                project_names = {p["name"]: p["id"] for p in projects}
-                selected_project_name = st.selectbox("Select Project", list(project_names.keys()))
-               
-                if selected_project_name:
-                    selected_project = project_names[selected_project_name]
+            project = paged_selectbox("Select Project", lazy_projects(selected_workspace),
+                                      key=f"{key}_project_{selected_workspace}", label_of=lambda p: p["name"])
+            if project:
+                selected_project = project["id"]
+                if prefetch and PREFETCH_ENABLED:
+                    # Warm the RCA and recent stories' test summaries while the user picks what to view
+                    st.session_state.setdefault("prefetcher", Prefetcher()).select(
+                        selected_workspace, selected_project)
     else:
         st.warning("Please connect to Rally to fetch workspaces and projects")
    
     return selected_workspace, selected_project
  
+def rally_story_picker(key: str, prefetch: bool = False):
+    """
+    Optionally pick the user story from a Rally project instead of typing it.
+ 
+    Returns (story text, (workspace id, project id), story FormattedID); the
+    text is "" and the project and story None when nothing was picked.
+    """
+    if not st.checkbox("Pick the user story from Rally", key=f"{key}_from_rally",
+                       disabled=not check_rally_config()):
+        return "", None, None
+    workspace_id, project_id = show_workspace_project_selector(key, prefetch)
+    if not (workspace_id and project_id):
+        return "", None, None
+    story = paged_selectbox("Select User Story", lazy_user_stories(workspace_id, project_id),
+                            key=f"{key}_story_{project_id}", label_of=lambda s: s["display_name"])
+    if not story:
+        st.info("No user stories found in this project")
+        return "", (workspace_id, project_id), None
+    description = strip_html(story["description"]).strip()
+    return f"{story['name']}\n\n{description}".strip(), (workspace_id, project_id), story["formatted_id"]
+ 
+def project_history_selector(key: str, project=None):
+    """
+    Optionally pick a Rally project whose related history grounds the agent.
+ 
+    ``project`` is a (workspace id, project id) already chosen on the page,
+    used instead of asking again. Returns a function building (or fetching
+    the cached) history index, so the Rally fetches happen only when the
+    agent actually runs, or None.
+    """
+    if not st.checkbox("Include related Rally history", key=f"{key}_history",
+                       disabled=not check_rally_config(),
+                       help="Adds the most relevant stories, test cases and defects of a project to the prompt"):
+        return None
+    workspace_id, project_id = project or show_workspace_project_selector(f"{key}_history")
+    if not (workspace_id and project_id):
+        return None
+    include_tests = st.checkbox("Include test cases in the history", key=f"{key}_history_tests",
+                                value=CONTEXT_INCLUDE_TESTS,
+                                help="Fetches the test cases of every story in the project the first time "
+                                     "its history is used, which is slow for large projects")
+    return lambda: project_history_index(workspace_id, project_id, include_tests)
+
+def story_test_tiles(workspace_id: str, project_id: str, story_id: str):
+    """
+    Count tiles for a story's test cases, from a few count queries.
+
+    The test case rows are downloaded only when the detail view is opened.
+    """
+    summary = get_user_story_test_summary(workspace_id, project_id, story_id)
+    cols = st.columns(4)
+    cols[0].metric("Test Cases", summary["total_tests"])
+    cols[1].metric("Passed", summary["passed"])
+    cols[2].metric("Failed", summary["failed"])
+    cols[3].metric("Pass Rate", f"{summary['pass_percentage']:.1f}%")
+    if not summary["complete"]:
+        st.caption("Some counts couldn't be fetched from Rally and are shown as 0")
+    if st.checkbox("Show test cases", key=f"story_tests_{project_id}_{story_id}"):
+        test_data = get_user_story_test_data(workspace_id, project_id, story_id)
+        if test_data is None:
+            st.error("Couldn't fetch the test cases from Rally")
+        elif test_data["test_cases"]:
+            st.dataframe(pd.DataFrame([tc._asdict() for tc in test_data["test_cases"]]), hide_index=True)
+        else:
+            st.info(f"No test cases are linked to {story_id}")
+
+def project_rca_tiles(workspace_id: str, project_id: str):
+    """
+    Defect count tiles and distributions for a project, from count queries.
+
+    The defects themselves, and the root cause breakdown read from them,
+    are downloaded only when the detail view is opened.
+    """
+    summary = get_project_rca_summary(workspace_id, project_id)
+    st.metric("Defects", summary["total_defects"])
+    cols = st.columns(3)
+    for col, (title, field) in zip(cols, (("Severity", "severity_distribution"),
+                                           ("Priority", "priority_distribution"),
+                                           ("State", "state_distribution"))):
+        counts = summary[field]
+        if counts:
+            col.plotly_chart(px.bar(x=list(counts), y=list(counts.values()), title=title,
+                                    labels={"x": title, "y": "Defects"}))
+    if not summary["complete"]:
+        st.caption("Some counts couldn't be fetched from Rally and are left out")
+    if st.checkbox("Show defects and root causes", key=f"project_defects_{project_id}"):
+        rca_data = get_project_rca_data(workspace_id, project_id)
+        if rca_data is None:
+            st.error("Couldn't fetch the defects from Rally")
+        elif rca_data["defects"]:
+            st.dataframe(pd.DataFrame(list(rca_data["rca_summary"].items()),
+                                      columns=["Root Cause", "Defects"]), hide_index=True)
+            st.dataframe(pd.DataFrame([d._asdict() for d in rca_data["defects"]]), hide_index=True)
+        else:
+            st.info("No defects found in this project")
+
 # Handle main content based on selection
 if st.session_state.task_agents_enabled and selected_task == "👤 Product Owner Agent":
     st.title("Product Owner Agent")
@@ -452,26 +639,142 @@ if st.session_state.task_agents_enabled and selected_task == "👤 Product Owner
     
     if uploaded_file:
         with st.spinner("Processing requirements..."):
-            response = handle_file_upload(uploaded_file, model=st.session_state.openai_model)  # Pass selected model
+            response = interruptible(handle_file_upload, uploaded_file, model=st.session_state.openai_model)  # Pass selected model
             st.write(response)
 
 elif st.session_state.task_agents_enabled and selected_task == "👨‍💻 Developer Agent":
     st.title("Developer Agent")
-    user_story = st.text_area("Enter User Story")
+    picked, project, story_id = rally_story_picker("developer")
+    user_story = st.text_area("Enter User Story", value=picked, key=f"developer_story_text_{hash(picked)}")
+    history = project_history_selector("developer", project)
     
     if st.button("Generate Code"):
         with st.spinner("Generating code..."):
-            code = generate_code(user_story, model=st.session_state.openai_model)  # Pass selected model
+            code = interruptible(generate_code, user_story, model=st.session_state.openai_model,  # Pass selected model
+                                 history=history() if history else None, story_id=story_id)
             st.code(code)
 
 elif st.session_state.task_agents_enabled and selected_task == "🧪 Test Manager Agent":
     st.title("Test Manager Agent")
-    user_story = st.text_area("Enter User Story for Test Case Generation")
+    picked, project, story_id = rally_story_picker("test_manager", prefetch=True)
+    if story_id:
+        story_test_tiles(project[0], project[1], story_id)
+    user_story = st.text_area("Enter User Story for Test Case Generation", value=picked,
+                              key=f"test_manager_story_text_{hash(picked)}")
+    history = project_history_selector("test_manager", project)
+    structured = st.checkbox("Structured test cases", key="test_manager_structured",
+                             help="Name, steps, expected result, priority and method for each test case, "
+                                  "listed as they are generated")
+    create_in_rally = structured and st.checkbox(
+        f"Create the test cases in Rally, linked to {story_id}" if story_id
+        else "Create the test cases in Rally (pick the user story from Rally first)",
+        key="test_manager_create_in_rally", disabled=not story_id)
     
     if st.button("Generate Test Cases"):
-        with st.spinner("Generating test cases..."):
-            test_cases = generate_test_cases(user_story, model=st.session_state.openai_model)  # Pass selected model
-            st.write(test_cases)
+        if not structured:
+            with st.spinner("Generating test cases..."):
+                test_cases = interruptible(generate_test_cases, user_story,
+                                           model=st.session_state.openai_model,  # Pass selected model
+                                           history=history() if history else None, story_id=story_id)
+                st.write(test_cases)
+        else:
+            stream = TestCaseStream(user_story, model=st.session_state.openai_model,
+                                    history=history() if history else None, story_id=story_id)
+            table = st.empty()
+            rows = []
+
+            def shown(cases):
+                # Runs on the script thread, so the table can be redrawn as each case arrives
+                for case in cases:
+                    rows.append({"Name": case.name,
+                                 "Steps": "\n".join(f"{i}. {step}" for i, step in enumerate(case.steps, 1)),
+                                 "Expected Result": case.expected_result, "Priority": case.priority,
+                                 "Method": case.method})
+                    table.dataframe(pd.DataFrame(rows), hide_index=True)
+                    yield case
+
+            report = None
+            with st.spinner("Generating test cases..."):
+                if create_in_rally:
+                    try:
+                        report = create_test_cases(project[0], project[1], story_id, shown(stream))
+                    except Exception as e:
+                        st.error(f"Couldn't create the test cases in Rally: {e}")
+                else:
+                    for _ in shown(stream):
+                        pass
+            if stream.error and not stream.cases:
+                st.error(stream.error)
+            elif stream.truncated:
+                st.warning("The response stopped part way through; the last test case was dropped")
+            if stream.rejected:
+                with st.expander(f"{len(stream.rejected)} test case(s) didn't match the schema"):
+                    for text, reason in stream.rejected:
+                        st.markdown(f"**{reason}**")
+                        st.code(text, language="json")
+            if report is not None:
+                ids = ", ".join(obj.get("FormattedID", "?") for obj in report.created)
+                if report.created:
+                    st.success(f"Created {len(report.created)} test case(s) on {story_id} "
+                               f"in {report.requests} Rally request(s): {ids}")
+                for error in report.errors:
+                    st.warning(error)
+
+elif st.session_state.task_agents_enabled and selected_task == "🔗 SDLC Pipeline":
+    st.title("SDLC Pipeline")
+    st.caption("Requirements document → user stories → test cases and code, with every story processed in parallel")
+    uploaded_file = st.file_uploader("Upload Requirements Document", type=["txt", "pdf", "docx"], key="pipeline_file")
+    code_after_tests = st.checkbox("Generate code against the generated test cases")
+    upload_to_rally = st.checkbox("Upload stories to Rally", disabled=not check_rally_config())
+    workspace_id, project_id = None, None
+    if upload_to_rally:
+        workspace_id, project_id = show_workspace_project_selector("pipeline")
+   
+    if uploaded_file and st.button("Run Pipeline"):
+        progress = st.progress(0.0, text="Extracting user stories...")
+        slots = {}
+        steps_done, steps_total = 0, 0
+        for event in run_pipeline(uploaded_file, project_id=project_id, workspace_id=workspace_id,
+                                  model=st.session_state.openai_model, code_after_tests=code_after_tests):
+            if event.kind == "document":
+                if event.error:
+                    st.error(event.error)
+                    break
+            elif event.kind == "stories":
+                if event.error:
+                    st.warning(event.error)
+                    break
+                steps_total = len(event.value) * (3 if project_id else 2)
+                progress.progress(0.0, text=f"Processing {len(event.value)} user stories...")
+                for i, story in enumerate(event.value):
+                    with st.expander(story.splitlines()[0][:100], expanded=False):
+                        st.markdown(story)
+                        slots[i] = {"test_cases": st.empty(), "code": st.empty(), "upload": st.empty()}
+                        slots[i]["test_cases"].info("⏳ Generating test cases...")
+                        slots[i]["code"].info("⏳ Generating code...")
+                        if project_id:
+                            slots[i]["upload"].info("⏳ Uploading to Rally...")
+            elif event.kind == "duplicate":
+                names = ", ".join(f"{d.meta['formatted_id'] or 'this document'}: {d.meta['name']} ({d.score:.0%})"
+                                  for d in event.value)
+                slots[event.story]["test_cases"].warning(f"Skipped as a likely duplicate of {names}")
+                slots[event.story]["code"].empty()
+                slots[event.story]["upload"].empty()
+                steps_total -= 3 if project_id else 2
+            else:
+                slot = slots[event.story][event.kind]
+                if event.error:
+                    slot.error(event.error)
+                elif event.kind == "test_cases":
+                    slot.markdown(event.value)
+                elif event.kind == "code":
+                    slot.code(event.value)
+                else:
+                    slot.success(event.value)
+                steps_done += 1
+                progress.progress(steps_done / max(steps_total, 1), text=f"{steps_done} of {steps_total} steps done")
+        else:
+            progress.progress(1.0, text="Pipeline finished")
 
 elif ops_agents_enabled and selected_ops == "🔍 Failure Analysis":
     st.title("Failure Analysis")
@@ -479,18 +782,68 @@ elif ops_agents_enabled and selected_ops == "🔍 Failure Analysis":
     
     if st.button("Analyze"):
         with st.spinner("Analyzing failure..."):
-            analysis = analyze_failure(failure_description, model=st.session_state.openai_model)  # Pass selected model
+            analysis = interruptible(analyze_failure, failure_description, model=st.session_state.openai_model)  # Pass selected model
             st.write(analysis)
 
 elif ops_agents_enabled and selected_ops == "🎯 Root Cause Analysis":
     st.title("Root Cause Analysis")
+    if st.checkbox("Show a Rally project's defects", key="rca_from_rally", disabled=not check_rally_config()):
+        rca_workspace, rca_project = show_workspace_project_selector("rca", prefetch=True)
+        if rca_workspace and rca_project:
+            project_rca_tiles(rca_workspace, rca_project)
     issue_description = st.text_area("Describe the issue")
     
     if st.button("Analyze Root Cause"):
         with st.spinner("Analyzing root cause..."):
-            root_cause = analyze_root_cause(issue_description, model=st.session_state.openai_model)  # Pass selected model
+            root_cause = interruptible(analyze_root_cause, issue_description, model=st.session_state.openai_model)  # Pass selected model
             st.write(root_cause)
 
+elif ops_agents_enabled and selected_ops == "🔎 Rally Search":
+    st.title("Rally Search")
+    workspaces = st.session_state.get('workspaces', [])
+    if not workspaces:
+        st.warning("Please connect to Rally to fetch workspaces and projects")
+    else:
+        workspace_names = {w["name"]: w["id"] for w in workspaces}
+        workspace_id = workspace_names[st.selectbox("Select Workspace", list(workspace_names.keys()))]
+       
+        # Synced when a workspace is first opened, not on every rerun; only
+        # artifacts changed since the last sync are fetched
+        synced = st.session_state.setdefault("search_synced_workspaces", set())
+        if workspace_id not in synced:
+            with st.spinner("Syncing stories, test cases and defects..."):
+                ensure_synced(workspace_id)
+            synced.add(workspace_id)
+       
+        col1, col2, col3 = st.columns([4, 1, 1])
+        with col1:
+            query = st.text_input("Search", placeholder="US123, login, password res...",
+                                  label_visibility="collapsed")
+        with col2:
+            if st.button("Sync Changes"):
+                with st.spinner("Fetching changes..."):
+                    sync_workspace(workspace_id)
+        with col3:
+            if st.button("Full Resync"):
+                with st.spinner("Resyncing the whole workspace..."):
+                    sync_workspace(workspace_id, full=True)
+        kind_labels = {"story": "User Stories", "test_case": "Test Cases", "defect": "Defects"}
+        kinds = st.multiselect("Types", list(kind_labels), default=list(kind_labels),
+                               format_func=kind_labels.get)
+       
+        if query:
+            started = time.perf_counter()
+            results = get_search_index().search(query, workspace_id=workspace_id, kinds=kinds, limit=50)
+            st.caption(f"{len(results)} results in {(time.perf_counter() - started) * 1000:.1f} ms")
+            if results:
+                st.dataframe(
+                    pd.DataFrame(results)[["formatted_id", "name", "kind", "project_id", "snippet"]].rename(
+                        columns={"formatted_id": "ID", "name": "Name", "kind": "Type",
+                                 "project_id": "Project", "snippet": "Description"}),
+                    hide_index=True)
+        st.caption(" · ".join(f"{kind_labels.get(kind, kind)}: {count}"
+                              for kind, count in get_search_index().stats().items()) + " indexed")
+
 else:
     # Show welcome message when no agent is enabled
     st.title("Welcome to SDLC Agent Orchestrator")
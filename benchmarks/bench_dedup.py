@@ -0,0 +1,70 @@
+"""
+Latency and recall benchmark for index.dedup.DedupIndex.
+
+Indexes synthetic user stories (default 10,000), then times near-duplicate
+lookups for reworded copies of indexed stories and for unrelated stories,
+and reports how many reworded copies were found.
+
+Usage:
+    python benchmarks/bench_dedup.py [stories]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index.dedup import DedupIndex  # noqa: E402
+
+ROLES = ["customer", "administrator", "support agent", "guest", "auditor", "store manager"]
+ACTIONS = ["reset my password", "export monthly invoices", "filter orders by status", "upload a profile photo",
+           "approve refund requests", "schedule a report", "merge duplicate accounts", "view audit history"]
+GOALS = ["I can regain access", "finance can reconcile", "I find work faster", "others recognise me",
+         "customers are paid quickly", "stakeholders stay informed", "records stay clean", "I can investigate"]
+DETAILS = ["via email link", "as CSV", "on the dashboard", "from mobile", "within 24 hours", "with two-factor",
+           "for the last 90 days", "across regions"]
+
+
+# Domain terms, so stories share a template but not their subject, as real ones do
+TERMS = [f"term{i}" for i in range(5_000)]
+
+
+def synthetic_story(rnd):
+    subject = " ".join(rnd.sample(TERMS, 4))
+    return (f"As a {rnd.choice(ROLES)}, I want to {rnd.choice(ACTIONS)} for {subject} {rnd.choice(DETAILS)} "
+            f"so that {rnd.choice(GOALS)}.")
+
+
+def reword(story, rnd):
+    words = story.split()
+    words[rnd.randrange(len(words))] = "quickly"
+    return " ".join(words).replace("I want to", "I would like to")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    rnd = random.Random(1)
+    stories = [synthetic_story(rnd) for _ in range(n)]
+
+    index = DedupIndex()
+    started = time.perf_counter()
+    for i, story in enumerate(stories):
+        index.add(i, story)
+    print(f"indexed {n} stories in {time.perf_counter() - started:.2f}s")
+
+    for label, queries in (("reworded", [(i, reword(stories[i], rnd)) for i in rnd.sample(range(n), 1000)]),
+                           ("unrelated", [(None, synthetic_story(rnd)) for _ in range(1000)])):
+        found, timings = 0, []
+        for expected, query in queries:
+            t = time.perf_counter()
+            matches = index.query(query)
+            timings.append(time.perf_counter() - t)
+            found += expected is not None and any(m.key == expected for m in matches)
+        timings.sort()
+        print(f"{label:9s} p50 {timings[500] * 1e6:.0f}us  p99 {timings[990] * 1e6:.0f}us"
+              + (f"  recall {found / len(queries):.1%}" if label == "reworded" else ""))
+
+
+if __name__ == "__main__":
+    main()
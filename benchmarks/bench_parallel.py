@@ -0,0 +1,74 @@
+"""
+Scaling benchmark: rally.parallel.aggregate_results with 1..N worker processes.
+
+Generates synthetic test case results (default 1M rows over 5,000 test cases
+and three years), encodes them once, then times the aggregation with an
+increasing number of workers against a warm process pool. Each run is
+checked against the single-process result.
+
+Usage:
+    python benchmarks/bench_parallel.py [rows] [max_workers]
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rally.parallel import aggregate_results, encode_results, process_pool  # noqa: E402
+from rally.records import TestCaseResult  # noqa: E402
+
+VERDICTS = ["Pass", "Pass", "Pass", "Fail", "Blocked", "Inconclusive"]
+
+
+def synthetic_results(n, test_cases=5_000, days=3 * 365):
+    rnd = random.Random(1)
+    start = date(2022, 1, 1)
+    dates = [(start + timedelta(days=d)).isoformat() + "T10:00:00.000Z" for d in range(days)]
+    return [
+        TestCaseResult(f"TC{rnd.randrange(test_cases)}", "b1", rnd.choice(dates) if rnd.random() > 0.01 else "N/A",
+                       rnd.choice(VERDICTS), "US1", "tester")
+        for _ in range(n)
+    ]
+
+
+def _same(a, b):
+    return (a.day_origin == b.day_origin
+            and np.array_equal(a.daily_total, b.daily_total)
+            and np.array_equal(a.daily_failed, b.daily_failed)
+            and np.array_equal(a.verdict_counts, b.verdict_counts)
+            and np.array_equal(a.latest_day, b.latest_day)
+            and np.array_equal(a.latest_verdict, b.latest_verdict))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+    results = synthetic_results(rows)
+    started = time.perf_counter()
+    columns = encode_results(results)
+    print(f"{rows:,} results, {len(columns.test_case_ids):,} test cases, {os.cpu_count()} CPUs")
+    print(f"encode: {time.perf_counter() - started:.3f}s")
+
+    baseline = aggregate_results(results, workers=1, columns=columns)
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}")
+    serial = None
+    for workers in range(1, max_workers + 1):
+        with process_pool(workers) as pool:
+            # Warm the pool so start-up is not timed
+            list(pool.map(abs, range(workers)))
+            started = time.perf_counter()
+            aggregate = aggregate_results(results, workers=workers, executor=pool, columns=columns)
+            elapsed = time.perf_counter() - started
+        assert _same(aggregate, baseline), f"mismatch with {workers} workers"
+        serial = serial or elapsed
+        print(f"{workers:>8} {elapsed:>9.3f} {serial / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
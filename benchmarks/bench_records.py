@@ -0,0 +1,153 @@
+"""
+Memory benchmark: record types in rally.records versus the previous dict form.
+
+Builds synthetic Rally JSON for test cases, test case results and defects,
+converts it the old way (one dict per object, keeping the raw ``Results``
+reference and per-day failure detail copies) and with the record types, and
+reports the memory retained by each with ``tracemalloc``.
+
+Usage:
+    python benchmarks/bench_records.py [count]
+"""
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rally.records import Defect, TestCase, TestCaseResult  # noqa: E402
+
+VERDICTS = ["Pass", "Fail", "Blocked", "Inconclusive"]
+OWNERS = [f"user{i}@example.com" for i in range(40)]
+SEVERITIES = ["Crash/Data Loss", "Major Problem", "Minor Problem", "Cosmetic"]
+PRIORITIES = ["Resolve Immediately", "High Attention", "Normal", "Low"]
+STATES = ["Submitted", "Open", "Fixed", "Closed"]
+ROOT_CAUSES = ["Code", "Requirements", "Environment", "Test Data", "Design"]
+
+
+def _ref(kind, oid, name):
+    # Copy strings with join() so each object owns them, as json.loads output would
+    return {"_ref": f"https://rally1.rallydev.com/slm/webservice/v2.0/{kind}/{oid}",
+            "_refObjectName": "".join(name), "_type": kind.title()}
+
+
+def synthetic_test_cases(n):
+    rnd = random.Random(1)
+    for i in range(n):
+        yield {
+            "FormattedID": f"TC{i}", "Name": f"Verify behaviour number {i}", "ObjectID": 10_000 + i,
+            "LastRun": f"2024-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T10:00:00.000Z",
+            "LastVerdict": "".join(rnd.choice(VERDICTS)), "LastBuild": f"build-{rnd.randint(1, 50)}",
+            "Duration": rnd.random() * 10, "Owner": _ref("user", i % 40, rnd.choice(OWNERS)),
+            "LastResult": None,
+            "Results": {"_ref": f"https://rally1.rallydev.com/slm/webservice/v2.0/TestCase/{i}/Results",
+                        "_type": "TestCaseResult", "Count": rnd.randint(1, 30)},
+        }
+
+
+def synthetic_results(n):
+    rnd = random.Random(2)
+    for i in range(n):
+        yield {
+            "Build": f"build-{rnd.randint(1, 50)}", "Verdict": "".join(rnd.choice(VERDICTS)),
+            "Date": f"2024-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T10:00:00.000Z",
+            "WorkProduct": _ref("hierarchicalrequirement", i % 25, f"US{i % 25}"),
+            "Tester": _ref("user", i % 40, rnd.choice(OWNERS)),
+        }
+
+
+def synthetic_defects(n):
+    rnd = random.Random(3)
+    for i in range(n):
+        yield {
+            "ObjectID": 50_000 + i, "Name": f"Defect number {i}",
+            "State": "".join(rnd.choice(STATES)), "Priority": "".join(rnd.choice(PRIORITIES)),
+            "Severity": "".join(rnd.choice(SEVERITIES)), "c_RCARootCauseUS": "".join(rnd.choice(ROOT_CAUSES)),
+            "CreationDate": f"2024-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T10:00:00.000Z",
+        }
+
+
+def legacy_test_case(tc):
+    return {
+        "test_case_id": tc.get("FormattedID"),
+        "test_case_name": tc.get("Name", "Unnamed Test"),
+        "tcr_id": tc.get("ObjectID", "N/A"),
+        "date_time": tc.get("LastRun", "N/A"),
+        "verdict": tc.get("LastVerdict", "No Run"),
+        "LastBuild": tc.get("LastBuild", "Unknown"),
+        "Duration": tc.get("Duration", "N/A"),
+        "Owner": (tc.get("Owner", {}) or {}).get("_refObjectName", "Unassigned"),
+        "Results": tc.get("Results", []),
+    }
+
+
+def legacy_failure_detail(tc):
+    return {
+        "test_case_id": tc["test_case_id"], "test_case_name": tc["test_case_name"],
+        "build": tc["LastBuild"], "execution_time": tc["Duration"], "owner": tc["Owner"],
+    }
+
+
+def legacy_result(r):
+    return {
+        "build": r.get("Build", "N/A"), "date": r.get("Date", "N/A"), "verdict": r.get("Verdict", "N/A"),
+        "work_product": (r.get("WorkProduct", {}) or {}).get("_refObjectName", "N/A"),
+        "tester": (r.get("Tester", {}) or {}).get("_refObjectName", "N/A"),
+    }
+
+
+def legacy_defect(d):
+    return {
+        "name": d.get("Name", "Unnamed Defect"), "root_cause": d.get("c_RCARootCauseUS", "Unspecified"),
+        "severity": d.get("Severity", "None"), "priority": d.get("Priority", "None"),
+        "state": d.get("State", "None"), "creation_date": d.get("CreationDate", "").split("T")[0],
+    }
+
+
+def retained(build, generate, n):
+    """Return bytes retained by ``build`` once the parsed Rally JSON is released"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    raw = list(generate(n))
+    kept = build(raw)
+    del raw
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    def legacy_cases(raw):
+        cases = [legacy_test_case(tc) for tc in raw]
+        details = [legacy_failure_detail(tc) for tc in cases if tc["verdict"] == "Fail"]
+        return cases, details
+
+    def record_cases(raw):
+        cases = [TestCase.from_rally(tc) for tc in raw]
+        details = [tc for tc in cases if tc.verdict == "Fail"]
+        return cases, details
+
+    rows = [
+        ("test cases", legacy_cases, record_cases, synthetic_test_cases),
+        ("test case results", lambda raw: [legacy_result(r) for r in raw],
+         lambda raw: [TestCaseResult.from_rally(r, "TC1") for r in raw], synthetic_results),
+        ("defects", lambda raw: [legacy_defect(d) for d in raw],
+         lambda raw: [Defect.from_rally(d) for d in raw], synthetic_defects),
+    ]
+
+    print(f"{'dataset':<20} {'count':>9} {'dicts (MiB)':>12} {'records (MiB)':>14} {'saving':>8}")
+    for label, legacy, records, generate in rows:
+        old = retained(legacy, generate, n)
+        new = retained(records, generate, n)
+        print(f"{label:<20} {n:>9} {old / 2**20:>12.1f} {new / 2**20:>14.1f} {1 - new / old:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Sync and typeahead latency benchmark for index.fulltext.
+
+Starts the Rally stand-in with a large synthetic workspace (default 3,000
+stories, 30,000 test cases and 10,000 defects), syncs it into an in-memory
+search index, times typeahead queries typed one character at a time, and
+then times an incremental sync after one change.
+
+Usage:
+    python benchmarks/bench_search.py [test_cases]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+from index.fulltext import SearchIndex, sync_workspace  # noqa: E402
+from rally import stub  # noqa: E402
+
+QUERIES = ["US1234", "verify case 12", "defect 77", "story 3", "feature 150", "tc29999"]
+
+
+def main():
+    test_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 30_000
+    data = stub.StubData(stories=test_cases // 10, test_cases=test_cases, results_per_case=0,
+                         defects=test_cases // 3)
+    server = stub.serve(data=data)
+    utils.config.update(rally_endpoint=f"http://127.0.0.1:{server.server_port}", rally_api_key="bench")
+    index = SearchIndex(":memory:")
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sync_workspace("1", index=index)
+    print(f"full sync {index.stats()} in {time.perf_counter() - started:.2f}s")
+
+    timings = []
+    for query in QUERIES:
+        for end in range(1, len(query) + 1):
+            t = time.perf_counter()
+            index.search(query[:end], workspace_id="1")
+            timings.append(time.perf_counter() - t)
+    timings.sort()
+    print(f"{len(timings)} keystrokes: p50 {timings[len(timings) // 2] * 1000:.2f}ms  "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1000:.2f}ms  max {timings[-1] * 1000:.2f}ms")
+
+    data.create("hierarchicalrequirement", {"Name": "Reset password by email", "Project": "/project/100"})
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        written = sync_workspace("1", ["100"], index=index)
+    print(f"incremental sync wrote {written} in {(time.perf_counter() - started) * 1000:.0f}ms; "
+          f"found: {[r['display_name'] for r in index.search('reset pass')]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+
+# OpenAI chat models offered in the app. "fallbacks" are tried, in order,
+# when a call to the model keeps failing or the model can't take the prompt
+# (see llm.policy); larger-context models come first. "json_mode" marks the
+# models that accept response_format={"type": "json_object"}.
+OPENAI_MODELS = {
+    "gpt-4": {
+        "description": "Most capable model, best for complex tasks",
+        "context_length": "8,192 tokens",
+        "training_data": "Up to Sep 2023",
+        "fallbacks": ["gpt-4-turbo", "gpt-3.5-turbo-16k"]
+    },
+    "gpt-4-turbo": {
+        "description": "Latest GPT-4 model with improved performance",
+        "context_length": "128,000 tokens",
+        "training_data": "Up to Dec 2023",
+        "json_mode": True,
+        "fallbacks": ["gpt-4", "gpt-3.5-turbo-16k"]
+    },
+    "gpt-3.5-turbo": {
+        "description": "Fast and cost-effective for most tasks",
+        "context_length": "4,096 tokens",
+        "training_data": "Up to Sep 2023",
+        "json_mode": True,
+        "fallbacks": ["gpt-3.5-turbo-16k", "gpt-4-turbo"]
+    },
+    "gpt-3.5-turbo-16k": {
+        "description": "Same as 3.5-turbo with extended context",
+        "context_length": "16,384 tokens",
+        "training_data": "Up to Sep 2023",
+        "fallbacks": ["gpt-4-turbo", "gpt-3.5-turbo"]
+    }
+}
+
+# How many fallback models a call may move on to; 0 disables fallback
+LLM_FALLBACKS = int(os.getenv("LLM_FALLBACKS", "2"))
+
+def model_chain(model, fallbacks=None):
+    """``model`` followed by the fallbacks to try after it"""
+    limit = LLM_FALLBACKS if fallbacks is None else fallbacks
+    return [model] + OPENAI_MODELS.get(model, {}).get("fallbacks", [])[:max(limit, 0)]
+
+def supports_json_mode(model):
+    return bool(OPENAI_MODELS.get(model, {}).get("json_mode"))
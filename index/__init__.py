@@ -0,0 +1,8 @@
+"""
+Local indexes over Rally artifacts and generated text.
+
+``dedup`` flags near-duplicate user stories before they are generated or
+uploaded again. ``retrieval`` selects related project history for agent
+prompts. ``fulltext`` is a synced SQLite FTS5 search over stories, test
+cases and defects. Shared text handling lives in ``text``.
+"""
@@ -0,0 +1,174 @@
+"""
+Near-duplicate detection for user stories with MinHash and LSH.
+
+Each text is reduced to its set of word unigrams and bigrams
+(``index.text.shingles``), and a ``DedupIndex`` finds indexed texts whose
+Jaccard similarity to a query is at least ``threshold``. A 128-value MinHash
+signature is split into 32 bands of 4, and texts sharing any band are
+candidates. Candidates whose signatures agree too rarely are dropped in
+one vectorised comparison, and the rest are scored exactly, so a query
+stays under a millisecond for thousands of stories.
+
+``project_story_index`` builds an index of a project's existing Rally
+stories. It is cached like the story list it is built from, and dropped
+with it when a webhook reports story changes.
+"""
+import os
+import threading
+import zlib
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from index.text import shingles, tokenize
+from rally import cache
+
+# Jaccard similarity of word uni/bigrams above which texts count as duplicates
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.6"))
+
+_PRIME = np.uint64((1 << 31) - 1)
+
+# Signature estimates this far below the threshold skip exact scoring
+# (about 3.5 standard errors at 128 permutations)
+_ESTIMATE_MARGIN = 0.15
+
+
+class Duplicate(NamedTuple):
+    key: Hashable
+    score: float
+    meta: Any
+
+
+class DedupIndex:
+    """
+    MinHash/LSH index of texts for near-duplicate lookup.
+
+    ``add`` and ``query`` are thread-safe. Texts with no tokens left after
+    normalisation are not indexed and match nothing.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = 128, bands: int = 32,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._buckets: List[Dict[bytes, set]] = [{} for _ in range(bands)]
+        # key -> (shingle hashes, band keys, signature row, meta)
+        self._entries: Dict[Hashable, Tuple[frozenset, List[bytes], int, Any]] = {}
+        self._signatures = np.zeros((64, num_perm), dtype=np.uint64)
+        self._free_rows = list(range(63, -1, -1))
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _shingle_hashes(text: str) -> frozenset:
+        return frozenset(zlib.crc32(s.encode("utf-8")) for s in shingles(tokenize(text)))
+
+    def _signature(self, hashes: frozenset) -> np.ndarray:
+        x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))[None, :] % _PRIME
+        return ((self._a * x + self._b) % _PRIME).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i:i + self.rows].tobytes() for i in range(0, len(signature), self.rows)]
+
+    def _take_row(self) -> int:
+        if not self._free_rows:
+            size = len(self._signatures)
+            self._signatures = np.concatenate([self._signatures, np.zeros_like(self._signatures)])
+            self._free_rows = list(range(2 * size - 1, size - 1, -1))
+        return self._free_rows.pop()
+
+    def add(self, key: Hashable, text: str, meta: Any = None) -> bool:
+        """Index ``text`` under ``key``, replacing any previous text; False if nothing to index"""
+        hashes = self._shingle_hashes(text)
+        with self._lock:
+            self.remove(key)
+            if not hashes:
+                return False
+            signature = self._signature(hashes)
+            bands = self._band_keys(signature)
+            for bucket, band in zip(self._buckets, bands):
+                bucket.setdefault(band, set()).add(key)
+            row = self._take_row()
+            self._signatures[row] = signature
+            self._entries[key] = (hashes, bands, row, meta)
+        return True
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._free_rows.append(entry[2])
+            for bucket, band in zip(self._buckets, entry[1]):
+                keys = bucket.get(band)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del bucket[band]
+
+    def query(self, text: str, threshold: Optional[float] = None, limit: int = 5,
+              exclude: Iterable[Hashable] = ()) -> List[Duplicate]:
+        """Indexed texts at least ``threshold`` similar to ``text``, most similar first"""
+        threshold = self.threshold if threshold is None else threshold
+        hashes = self._shingle_hashes(text)
+        if not hashes:
+            return []
+        signature = self._signature(hashes)
+        bands = self._band_keys(signature)
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self._buckets, bands):
+                candidates.update(bucket.get(band, ()))
+            candidates = list(candidates.difference(exclude))
+            if not candidates:
+                return []
+            rows = np.fromiter((self._entries[key][2] for key in candidates), dtype=np.intp,
+                               count=len(candidates))
+            estimates = (self._signatures[rows] == signature).mean(axis=1)
+            matches = []
+            for i in np.flatnonzero(estimates >= threshold - _ESTIMATE_MARGIN):
+                key = candidates[i]
+                other, _, _, meta = self._entries[key]
+                common = len(hashes & other)
+                score = common / (len(hashes) + len(other) - common)
+                if score >= threshold:
+                    matches.append(Duplicate(key, round(score, 3), meta))
+        matches.sort(key=lambda d: -d.score)
+        return matches[:limit]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+
+def story_text(story: Dict[str, Any]) -> str:
+    """The text a story is compared on: its name and description"""
+    return f"{story.get('name', '')}\n{story.get('description', '')}"
+
+
+# Built indexes are mutable and handed out as-is
+_story_indexes = cache.get_cache("story_dedup_indexes", max_entries=32, copy_on_read=False)
+
+
+def build_story_index(stories: Iterable[Dict[str, Any]], threshold: float = DEDUP_THRESHOLD) -> DedupIndex:
+    """Index ``get_rally_user_stories`` entries by FormattedID, with the story as meta"""
+    index = DedupIndex(threshold)
+    for story in stories:
+        index.add(story["formatted_id"], story_text(story),
+                  {"formatted_id": story["formatted_id"], "name": story.get("name", "")})
+    return index
+
+
+def project_story_index(workspace_id: str, project_id: str) -> DedupIndex:
+    """The dedup index of a project's Rally stories, built on first use"""
+    credential = cache.credential_key()
+    return _story_indexes.get_or_compute(
+        (credential, str(workspace_id), str(project_id)),
+        lambda: build_story_index(cache.get_rally_user_stories(workspace_id, project_id) or []),
+        tags=[("credential", credential)] + cache.story_list_tags(workspace_id, project_id))
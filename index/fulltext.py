@@ -0,0 +1,354 @@
+"""
+Local full-text search over synced Rally stories, test cases and defects.
+
+Artifacts are copied into a SQLite FTS5 index of FormattedID, name and
+description. Searches, including prefix and typeahead queries, then run
+locally in a few milliseconds without a Rally request per keystroke.
+``sync_workspace`` pages through every project and fetches only artifacts
+changed since the last sync of that project (``LastUpdateDate``). A full
+resync also drops artifacts that were deleted in Rally.
+
+Rows and sync state are keyed by the Rally credential
+(``rally.cache.credential_key``), so searches only see artifacts synced
+with the current endpoint and API key, and each credential syncs on its own.
+
+The index lives in memory unless ``RALLY_SEARCH_DB`` names a file. A file
+survives restarts, so only changes need fetching on the next start.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import utils
+from index.text import strip_html
+from rally import cache
+from rally.portfolio import RALLY_BUDGET
+from rally.query import DEFECT_SEARCH, STORY_SEARCH, TEST_CASE_SEARCH
+from rally.stream import iter_query
+
+SEARCH_DB = os.getenv("RALLY_SEARCH_DB", ":memory:")
+
+# Projects synced longer ago than this are refreshed by ensure_synced
+SEARCH_SYNC_MAX_AGE = float(os.getenv("SEARCH_SYNC_MAX_AGE", "300"))
+
+# Artifact kind -> what to fetch for it
+KINDS = {"story": STORY_SEARCH, "test_case": TEST_CASE_SEARCH, "defect": DEFECT_SEARCH}
+
+# Bumped when the schema changes; an index file with another version is dropped and resynced
+_SCHEMA_VERSION = 2
+
+_DROP = """
+DROP TRIGGER IF EXISTS artifacts_ai;
+DROP TRIGGER IF EXISTS artifacts_ad;
+DROP TRIGGER IF EXISTS artifacts_au;
+DROP TABLE IF EXISTS artifacts_fts;
+DROP TABLE IF EXISTS artifacts;
+DROP TABLE IF EXISTS sync_state;
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    credential TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    formatted_id TEXT NOT NULL,
+    ids TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    workspace_id TEXT NOT NULL,
+    project_id TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    UNIQUE (credential, kind, object_id)
+);
+CREATE INDEX IF NOT EXISTS artifacts_by_project ON artifacts (credential, workspace_id, project_id, kind);
+CREATE INDEX IF NOT EXISTS artifacts_by_formatted_id ON artifacts (formatted_id COLLATE NOCASE);
+CREATE VIRTUAL TABLE IF NOT EXISTS artifacts_fts USING fts5(
+    ids, name, description,
+    content='artifacts', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+);
+CREATE TRIGGER IF NOT EXISTS artifacts_ai AFTER INSERT ON artifacts BEGIN
+    INSERT INTO artifacts_fts (rowid, ids, name, description) VALUES (new.id, new.ids, new.name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS artifacts_ad AFTER DELETE ON artifacts BEGIN
+    INSERT INTO artifacts_fts (artifacts_fts, rowid, ids, name, description)
+    VALUES ('delete', old.id, old.ids, old.name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS artifacts_au AFTER UPDATE ON artifacts BEGIN
+    INSERT INTO artifacts_fts (artifacts_fts, rowid, ids, name, description)
+    VALUES ('delete', old.id, old.ids, old.name, old.description);
+    INSERT INTO artifacts_fts (rowid, ids, name, description) VALUES (new.id, new.ids, new.name, new.description);
+END;
+CREATE TABLE IF NOT EXISTS sync_state (
+    credential TEXT NOT NULL,
+    workspace_id TEXT NOT NULL,
+    project_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    last_updated TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (credential, workspace_id, project_id, kind)
+);
+"""
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def match_expression(text: str) -> str:
+    """
+    FTS5 query for what a user typed: every word must match, the last as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    taken literally. Returns "" when ``text`` has no words.
+    """
+    terms = _TERM.findall(text or "")
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _ids(formatted_id: str) -> str:
+    # "US123" is also findable as "123"
+    digits = re.sub(r"\D", "", formatted_id)
+    return f"{formatted_id} {digits}" if digits else formatted_id
+
+
+class SearchIndex:
+    """
+    FTS5 index of Rally artifacts.
+
+    One connection is shared by all threads and serialised with a lock.
+    Queries take milliseconds, so sessions don't wait long on each other.
+    Methods taking ``credential`` default to the configured Rally credential.
+    """
+
+    # Above this many matches, BM25 ranking costs more than a keystroke allows
+    RANKED_MATCH_LIMIT = 2000
+
+    def __init__(self, path: str = SEARCH_DB):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            self._db.executescript(_DROP)
+            self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def upsert(self, workspace_id: str, project_id: str, kind: str, objects: Iterable[Dict[str, Any]],
+               credential: Optional[str] = None) -> int:
+        """Insert or update Rally objects of one kind; returns how many were written"""
+        credential = credential or cache.credential_key()
+        rows = [(credential, kind, str(obj["ObjectID"]), obj.get("FormattedID") or "", _ids(obj.get("FormattedID") or ""),
+                 obj.get("Name") or "", " ".join(strip_html(obj.get("Description") or "").split()),
+                 str(workspace_id), str(project_id), obj.get("LastUpdateDate") or "")
+                for obj in objects]
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("""
+                    INSERT INTO artifacts (credential, kind, object_id, formatted_id, ids, name, description,
+                                           workspace_id, project_id, updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (credential, kind, object_id) DO UPDATE SET
+                        formatted_id = excluded.formatted_id, ids = excluded.ids, name = excluded.name,
+                        description = excluded.description, workspace_id = excluded.workspace_id,
+                        project_id = excluded.project_id, updated = excluded.updated
+                """, rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def remove(self, kind: str, object_ids: Iterable[str], credential: Optional[str] = None) -> int:
+        credential = credential or cache.credential_key()
+        ids = [(credential, kind, str(object_id)) for object_id in object_ids]
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany("DELETE FROM artifacts WHERE credential = ? AND kind = ? AND object_id = ?", ids)
+            return self._db.total_changes - before
+
+    def object_ids(self, workspace_id: str, project_id: str, kind: str,
+                   credential: Optional[str] = None) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT object_id FROM artifacts WHERE credential = ? AND workspace_id = ? AND project_id = ? "
+                "AND kind = ?", (credential or cache.credential_key(), str(workspace_id), str(project_id), kind))]
+
+    def sync_state(self, workspace_id: str, project_id: str, kind: str,
+                   credential: Optional[str] = None) -> Tuple[str, float]:
+        """(latest LastUpdateDate seen, time of the last sync) for one project and kind"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_updated, synced_at FROM sync_state WHERE credential = ? AND workspace_id = ? "
+                "AND project_id = ? AND kind = ?",
+                (credential or cache.credential_key(), str(workspace_id), str(project_id), kind)).fetchone()
+        return row if row else ("", 0.0)
+
+    def record_sync(self, workspace_id: str, project_id: str, kind: str, last_updated: str,
+                    credential: Optional[str] = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state (credential, workspace_id, project_id, kind, last_updated, "
+                "synced_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (credential or cache.credential_key(), str(workspace_id), str(project_id), kind, last_updated,
+                 time.time()))
+
+    def _query(self, match: str, order: str, filters: str, params: List[Any], limit: int) -> List[tuple]:
+        return self._db.execute(
+            "SELECT a.id, a.kind, a.formatted_id, a.name, a.project_id, a.object_id, "
+            "snippet(artifacts_fts, 2, '[', ']', '…', 12) "
+            "FROM artifacts_fts JOIN artifacts a ON a.id = artifacts_fts.rowid "
+            f"WHERE artifacts_fts MATCH ? {filters} ORDER BY {order} LIMIT ?",
+            [match] + params + [limit]).fetchall()
+
+    def search(self, text: str, workspace_id: Optional[str] = None, project_id: Optional[str] = None,
+               kinds: Optional[Sequence[str]] = None, limit: int = 20,
+               credential: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Artifacts matching every word of ``text`` (the last as a prefix), best first.
+
+        An exact FormattedID comes first. When the query matches at most
+        ``RANKED_MATCH_LIMIT`` artifacts, the rest are ranked by BM25, with
+        FormattedID matches above name and name above description. Broader
+        queries, typically the first letters of a typeahead, would take too
+        long to rank; they list FormattedID and name matches newest first,
+        then description matches.
+        """
+        expression = match_expression(text)
+        if not expression:
+            return []
+        filters, params = ["AND a.credential = ?"], [credential or cache.credential_key()]
+        for column, value in (("workspace_id", workspace_id), ("project_id", project_id)):
+            if value is not None:
+                filters.append(f"AND a.{column} = ?")
+                params.append(str(value))
+        if kinds:
+            filters.append(f"AND a.kind IN ({','.join('?' * len(kinds))})")
+            params.extend(kinds)
+        filters = " ".join(filters)
+
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT a.id, a.kind, a.formatted_id, a.name, a.project_id, a.object_id, a.description "
+                f"FROM artifacts a WHERE a.formatted_id = ? COLLATE NOCASE {filters} LIMIT 1",
+                [text.strip()] + params).fetchall()
+            matches = self._db.execute(
+                "SELECT count(*) FROM (SELECT rowid FROM artifacts_fts WHERE artifacts_fts MATCH ? LIMIT ?)",
+                (expression, self.RANKED_MATCH_LIMIT + 1)).fetchone()[0]
+            if matches <= self.RANKED_MATCH_LIMIT:
+                rows += self._query(expression, "bm25(artifacts_fts, 10.0, 4.0, 1.0)", filters, params, limit + 1)
+            else:
+                rows += self._query(f"{{ids name}}: ({expression})", "artifacts_fts.rowid DESC",
+                                    filters, params, limit + 1)
+                if len(rows) <= limit:
+                    rows += self._query(expression, "artifacts_fts.rowid DESC", filters, params, 2 * limit + 1)
+
+        results, seen = [], set()
+        for row_id, kind, fid, name, project, oid, snippet in rows:
+            if row_id not in seen:
+                seen.add(row_id)
+                results.append({"kind": kind, "formatted_id": fid, "name": name, "project_id": project,
+                                "object_id": oid, "snippet": snippet, "display_name": f"{fid}: {name}"})
+        return results[:limit]
+
+    def stats(self, credential: Optional[str] = None) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT kind, COUNT(*) FROM artifacts WHERE credential = ? GROUP BY kind",
+                                         (credential or cache.credential_key(),)).fetchall())
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """The process-wide search index at ``RALLY_SEARCH_DB``"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(SEARCH_DB)
+        return _index
+
+
+def _fetch_changed(workspace_id: str, project_id: str, kind: str, since: str) -> List[Dict[str, Any]]:
+    """Every ``kind`` artifact of the project updated since ``since`` (all of them if empty)"""
+    projection = KINDS[kind]
+    params = {
+        "workspace": f"/workspace/{workspace_id}",
+        "project": f"/project/{project_id}",
+        "projectScopeDown": "false",
+        "fetch": projection.fetch,
+        "order": "LastUpdateDate ASC",
+    }
+    if since:
+        # Inclusive, so artifacts sharing the last timestamp seen aren't missed
+        params["query"] = f'(LastUpdateDate >= "{since}")'
+    return list(iter_query(utils.rally_session(), f"{utils.rally_base_endpoint()}/{projection.artifact}",
+                           params, fields=projection.fields, page_size=2000))
+
+
+def sync_project(workspace_id: str, project_id: str, kinds: Sequence[str] = tuple(KINDS),
+                 full: bool = False, index: Optional[SearchIndex] = None) -> Dict[str, int]:
+    """
+    Bring one project's artifacts in the index up to date; returns rows written per kind.
+
+    Normally only artifacts changed since the last sync are fetched. With
+    ``full``, everything is fetched and artifacts no longer in Rally are
+    removed.
+    """
+    index = index or get_search_index()
+    credential = cache.credential_key()
+    written = {}
+    for kind in kinds:
+        since = "" if full else index.sync_state(workspace_id, project_id, kind, credential)[0]
+        objects = RALLY_BUDGET.run(_fetch_changed, workspace_id, project_id, kind, since)
+        written[kind] = index.upsert(workspace_id, project_id, kind, objects, credential)
+        if full:
+            current = {str(obj["ObjectID"]) for obj in objects}
+            index.remove(kind, [oid for oid in index.object_ids(workspace_id, project_id, kind, credential)
+                                if oid not in current], credential)
+        latest = max((obj.get("LastUpdateDate") or "" for obj in objects), default="")
+        index.record_sync(workspace_id, project_id, kind, max(latest, since), credential)
+    return written
+
+
+def sync_workspace(workspace_id: str, project_ids: Optional[Iterable[str]] = None, full: bool = False,
+                   max_age: float = 0.0, max_workers: int = 8,
+                   index: Optional[SearchIndex] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Sync several projects (every project in the workspace by default) concurrently.
+
+    Projects synced less than ``max_age`` seconds ago are skipped. Returns
+    rows written per project and kind.
+    """
+    index = index or get_search_index()
+    if project_ids is None:
+        project_ids = [str(p["id"]) for p in cache.get_rally_projects(workspace_id) or []]
+    now = time.time()
+    stale = [str(pid) for pid in project_ids
+             if full or now - min(index.sync_state(workspace_id, pid, kind)[1] for kind in KINDS) >= max_age]
+    results = {}
+    if not stale:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(stale)))) as pool:
+        futures = {pool.submit(sync_project, workspace_id, pid, full=full, index=index): pid for pid in stale}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"Error syncing project {futures[future]} for search: {str(e)}")
+    return results
+
+
+def ensure_synced(workspace_id: str, project_ids: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, int]]:
+    """Incrementally sync projects not synced in the last ``SEARCH_SYNC_MAX_AGE`` seconds"""
+    return sync_workspace(workspace_id, project_ids, max_age=SEARCH_SYNC_MAX_AGE)
@@ -0,0 +1,221 @@
+"""
+Related Rally history for agent prompts, within a token budget.
+
+A project's stories, test cases and defect root causes are indexed as
+short snippets. Before generating code or test cases, the snippets most
+relevant to the story are selected, up to ``CONTEXT_TOP_K`` of them and
+``CONTEXT_TOKEN_BUDGET`` tokens, and added to the prompt. Users no longer
+need to paste related material by hand, and prompts stay small.
+
+``BM25Index`` needs no model. ``EmbeddingIndex`` takes any function mapping
+texts to vectors, e.g. an embeddings API, and ranks by cosine similarity.
+Both have the same ``add``/``search`` interface, so either can be passed to
+the agents.
+"""
+import math
+import os
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from index.text import strip_html, tokenize
+from llm.prompts import count_tokens
+from rally import cache
+from rally.portfolio import iter_story_test_data
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", "8"))
+# Whether history indexes include test cases by default; that costs one test
+# case query per story of the project when the index is first built
+CONTEXT_INCLUDE_TESTS = os.getenv("CONTEXT_INCLUDE_TESTS", "0").lower() in ("1", "true", "yes")
+
+
+class Snippet(NamedTuple):
+    """One retrievable piece of project history: a story, test case or defect"""
+    kind: str
+    key: str
+    text: str
+    score: float = 0.0
+
+
+class BM25Index:
+    """Okapi BM25 over snippet tokens; postings are compiled to arrays on the first search after a change"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._snippets: List[Snippet] = []
+        self._terms: List[Counter] = []
+        self._postings: Optional[Dict[str, tuple]] = None
+        self._lock = threading.Lock()
+
+    def add(self, snippet: Snippet) -> None:
+        with self._lock:
+            self._snippets.append(snippet)
+            self._terms.append(Counter(tokenize(snippet.text)))
+            self._postings = None
+
+    def _compile(self) -> Dict[str, tuple]:
+        lengths = np.array([sum(terms.values()) for terms in self._terms], dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+        docs: Dict[str, List[int]] = {}
+        for doc, terms in enumerate(self._terms):
+            for term in terms:
+                docs.setdefault(term, []).append(doc)
+        n = len(self._terms)
+        postings = {}
+        for term, ids in docs.items():
+            ids = np.array(ids, dtype=np.int32)
+            tf = np.array([self._terms[doc][term] for doc in ids], dtype=np.float32)
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            # Documents are static between compiles, so the whole BM25 term weight is precomputed
+            postings[term] = (ids, idf * tf * (self.k1 + 1) / (tf + norm[ids]))
+        return postings
+
+    def search(self, query: str, k: int = CONTEXT_TOP_K) -> List[Snippet]:
+        """The ``k`` best-scoring snippets for ``query``, best first"""
+        with self._lock:
+            if self._postings is None:
+                self._postings = self._compile()
+            postings, snippets = self._postings, self._snippets
+        scores = np.zeros(len(snippets), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in postings:
+                ids, weights = postings[term]
+                scores[ids] += weights
+        return _top(snippets, scores, k)
+
+    def __len__(self) -> int:
+        return len(self._snippets)
+
+
+class EmbeddingIndex:
+    """
+    Cosine-similarity search over embeddings from ``embed``.
+
+    ``embed(texts)`` returns one vector per text as a 2-D array. Snippets
+    are embedded in batches on the first search after they are added.
+    """
+
+    def __init__(self, embed: Callable[[Sequence[str]], Any]):
+        self.embed = embed
+        self._snippets: List[Snippet] = []
+        self._vectors = None
+        self._lock = threading.Lock()
+
+    def add(self, snippet: Snippet) -> None:
+        with self._lock:
+            self._snippets.append(snippet)
+
+    @staticmethod
+    def _normalise(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+    def search(self, query: str, k: int = CONTEXT_TOP_K) -> List[Snippet]:
+        with self._lock:
+            indexed = 0 if self._vectors is None else len(self._vectors)
+            if indexed < len(self._snippets):
+                new = self._normalise(self.embed([s.text for s in self._snippets[indexed:]]))
+                self._vectors = new if self._vectors is None else np.vstack([self._vectors, new])
+            vectors, snippets = self._vectors, self._snippets
+        if not snippets:
+            return []
+        return _top(snippets, vectors @ self._normalise(self.embed([query]))[0], k)
+
+    def __len__(self) -> int:
+        return len(self._snippets)
+
+
+def _top(snippets: List[Snippet], scores: np.ndarray, k: int) -> List[Snippet]:
+    k = min(k, int(np.count_nonzero(scores > 0)))
+    if k <= 0:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [snippets[i]._replace(score=round(float(scores[i]), 4)) for i in best]
+
+
+def select_snippets(snippets: Iterable[Snippet], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Snippet]:
+    """Take snippets in rank order while they fit in ``budget`` tokens, skipping any that don't"""
+    selected, used = [], 0
+    for snippet in snippets:
+        cost = count_tokens(snippet.text) + 4
+        if used + cost <= budget:
+            selected.append(snippet)
+            used += cost
+    return selected
+
+
+def format_context(snippets: Iterable[Snippet]) -> str:
+    labels = {"story": "Story", "test_case": "Test case", "defect": "Defect"}
+    return "\n".join(f"- {labels.get(s.kind, s.kind)} {s.key}: {s.text}" for s in snippets)
+
+
+def retrieve_context(history, query: str, budget: int = CONTEXT_TOKEN_BUDGET, k: int = CONTEXT_TOP_K,
+                     exclude: Iterable[str] = ()) -> str:
+    """
+    Related history for ``query`` as prompt text, or "" when nothing relevant fits.
+
+    ``history`` is a ``BM25Index`` or ``EmbeddingIndex``. Snippets whose key
+    is in ``exclude`` (e.g. the story being worked on) are left out; None
+    entries are ignored, so callers can pass a story ID they may not have.
+    """
+    exclude = {key for key in exclude if key}
+    candidates = [s for s in history.search(query, k + len(exclude)) if s.key not in exclude][:k]
+    return format_context(select_snippets(candidates, budget))
+
+
+def project_snippets(workspace_id: str, project_id: str, include_tests: bool = True,
+                     max_workers: int = 8) -> Iterable[Snippet]:
+    """Snippets for a project's stories, their test cases and its defects, from the cached fetchers"""
+    stories = cache.get_rally_user_stories(workspace_id, project_id) or []
+    for story in stories:
+        description = " ".join(strip_html(story.get("description", "")).split())
+        yield Snippet("story", story["formatted_id"], f"{story['name']}. {description}".strip(". "))
+    rca = cache.get_project_rca_data(workspace_id, project_id) or {}
+    for defect in rca.get("defects", []):
+        yield Snippet("defect", str(defect.object_id),
+                      f"{defect.name} (root cause: {defect.root_cause}, severity: {defect.severity})")
+    if include_tests:
+        pairs = [(str(project_id), story["formatted_id"]) for story in stories]
+        for _, data in iter_story_test_data(workspace_id, pairs, max_workers):
+            for case in (data or {}).get("test_cases", []):
+                yield Snippet("test_case", case.test_case_id,
+                              f"{case.test_case_name} (last verdict: {case.verdict})")
+
+
+def build_project_index(workspace_id: str, project_id: str, include_tests: bool = True,
+                        index_factory: Callable[[], Any] = BM25Index):
+    index = index_factory()
+    seen = set()
+    for snippet in project_snippets(workspace_id, project_id, include_tests):
+        if (snippet.kind, snippet.key) not in seen:
+            seen.add((snippet.kind, snippet.key))
+            index.add(snippet)
+    return index
+
+
+_history_indexes = cache.get_cache("project_history_indexes", max_entries=32, copy_on_read=False)
+
+
+def project_history_index(workspace_id: str, project_id: str,
+                          include_tests: bool = CONTEXT_INCLUDE_TESTS) -> BM25Index:
+    """
+    The BM25 history index of a project, built on first use and dropped when its data changes.
+
+    Stories and defects take one paged query each. With ``include_tests``
+    the test cases of every story are fetched too, one query per story, so
+    the first build of a large project's index is much slower.
+    """
+    credential = cache.credential_key()
+    tags = ([("credential", credential)] + cache.story_list_tags(workspace_id, project_id)
+            + cache.project_defect_tags(workspace_id, project_id))
+    if include_tests:
+        tags += [("tests",), ("tests", str(project_id))]
+    return _history_indexes.get_or_compute(
+        (credential, str(workspace_id), str(project_id), include_tests),
+        lambda: build_project_index(workspace_id, project_id, include_tests),
+        tags=tags)
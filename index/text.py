@@ -0,0 +1,36 @@
+"""
+Text normalisation shared by the local indexes.
+
+Rally descriptions are HTML and agent output is Markdown, so both are
+reduced to lowercase word tokens without markup or common stopwords.
+"""
+import html
+import re
+from typing import Iterable, List, Set
+
+_TAG = re.compile(r"<[^>]+>")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can could do does for from
+has have how i if in into is it its may me more must my no not of on or our shall should
+so some such than that the their them then there these they this those to up us was we
+were what when where which while who will with would you your
+""".split())
+
+
+def strip_html(text: str) -> str:
+    """Drop tags and decode entities, e.g. from a Rally ``Description``"""
+    return html.unescape(_TAG.sub(" ", text or ""))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens of ``text`` without markup and stopwords"""
+    return [t for t in _TOKEN.findall(strip_html(text).lower())
+            if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def shingles(tokens: Iterable[str], sizes: Iterable[int] = (1, 2)) -> Set[str]:
+    """The set of word n-grams of ``tokens`` for each n in ``sizes``"""
+    tokens = list(tokens)
+    return {" ".join(tokens[i:i + n]) for n in sizes for i in range(len(tokens) - n + 1)}
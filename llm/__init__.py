@@ -0,0 +1,13 @@
+"""
+The OpenAI call path shared by every agent.
+
+``client`` runs completions on one background event loop with a client per
+API key, a process-wide concurrency limit, per-request timeouts and
+cancellation scopes, behind both async and blocking entry points.
+``policy`` decides how failed requests are retried, hedged and moved to
+fallback models, and keeps per-model outcome and latency metrics.
+``prompts`` holds the agents' versioned templates, which render a stable
+system and instruction prefix followed by the variable slots.
+``structured`` picks JSON records out of a streamed response as each one
+closes.
+"""
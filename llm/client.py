@@ -0,0 +1,265 @@
+"""
+Async OpenAI completions with per-key clients, a concurrency cap and cancellation.
+
+Setting the module-global ``openai.api_key`` before each blocking call meant
+that two sessions with different keys could send each other's requests, and
+that every agent call held a thread for its whole duration. Here every
+completion runs on one background event loop, owned by this module:
+
+- each API key gets its own ``AsyncOpenAI`` client, and nothing global is set;
+- at most ``LLM_MAX_CONCURRENCY`` completions are in flight per process, and
+  the rest wait their turn without holding a connection;
+- each request has a timeout (``LLM_TIMEOUT`` seconds unless given), and
+  failed requests are retried, hedged and moved to fallback models as
+  ``llm.policy`` decides;
+- calls made while a ``CallScope`` is active belong to it, and
+  ``CallScope.cancel`` cancels those still running, e.g. when a Streamlit
+  session reruns and nobody is waiting for the old page any more.
+
+``complete`` and ``complete_many`` (an ``asyncio.gather`` fan-out) can be
+awaited from any event loop. ``complete_sync`` and ``complete_many_sync``
+block the calling thread instead; ``utils.call_openai_api`` is built on them.
+``start_stream`` and ``stream_sync`` stream a completion, handing each piece
+of text to a callback as it arrives.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Sequence, Union
+
+from openai import AsyncOpenAI
+
+from config.models import supports_json_mode
+from llm.policy import CallPolicy, execute
+
+# Completions in flight at once, across all sessions and threads
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Seconds a single completion may take
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_semaphore: Optional[asyncio.Semaphore] = None
+_clients: Dict[str, AsyncOpenAI] = {}
+
+_current_scope: contextvars.ContextVar = contextvars.ContextVar("llm_call_scope", default=None)
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """The loop all completions run on, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+
+def _client(api_key: str) -> AsyncOpenAI:
+    # Only touched from the loop thread, so no lock is needed
+    key = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    client = _clients.get(key)
+    if client is None:
+        # Retries are decided by llm.policy, not inside the client
+        client = _clients[key] = AsyncOpenAI(api_key=api_key, max_retries=0)
+    return client
+
+
+async def _request(messages: List[Dict[str, str]], api_key: str, model: str, timeout: float,
+                   **params: Any) -> str:
+    """A single request, waiting for a concurrency slot first"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    async with _semaphore:
+        response = await asyncio.wait_for(
+            _client(api_key).chat.completions.create(model=model, messages=messages, timeout=timeout, **params),
+            timeout)
+    return response.choices[0].message.content or ""
+
+
+async def _complete(messages: List[Dict[str, str]], api_key: str, model: str, timeout: float,
+                    policy: Optional[CallPolicy] = None, **params: Any) -> str:
+    # Hedges would only queue behind other requests once every slot is taken
+    return await execute(lambda candidate: _request(messages, api_key, candidate, timeout, **params), model,
+                         policy, can_hedge=lambda: _semaphore is None or not _semaphore.locked())
+
+
+class StreamInterrupted(Exception):
+    """
+    A streamed completion failed after some of its text was delivered.
+
+    It is not retried, since the text can't be taken back; ``text`` is what
+    arrived, and the original error is the ``__cause__``.
+    """
+
+    def __init__(self, text: str):
+        super().__init__(f"stream interrupted after {len(text)} characters")
+        self.text = text
+
+
+async def _stream_request(messages: List[Dict[str, str]], api_key: str, model: str, timeout: float,
+                          on_text: Callable[[str], None], json_mode: bool, **params: Any) -> str:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    if json_mode and supports_json_mode(model):
+        params["response_format"] = {"type": "json_object"}
+    parts: List[str] = []
+    async with _semaphore:
+        try:
+            # The timeout covers the wait for the first chunk and each gap between chunks
+            stream = await asyncio.wait_for(_client(api_key).chat.completions.create(
+                model=model, messages=messages, timeout=timeout, stream=True, **params), timeout)
+            iterator = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    parts.append(text)
+                    on_text(text)
+        except Exception as e:
+            if parts:
+                raise StreamInterrupted("".join(parts)) from e
+            raise
+    return "".join(parts)
+
+
+def _messages(prompt: Union[str, List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    return [{"role": "user", "content": prompt}] if isinstance(prompt, str) else list(prompt)
+
+
+class CallScope:
+    """
+    A group of completions that can be cancelled together.
+
+    While ``activate``-d in a thread (or inside ``with scope:``), completions
+    started from it, or from threads and tasks inheriting its context, are
+    tracked by the scope until they finish.
+    """
+
+    def __init__(self):
+        self._futures: set = set()
+        self._lock = threading.Lock()
+
+    def _track(self, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._untrack)
+
+    def _untrack(self, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel(self) -> int:
+        """Cancel the scope's unfinished completions; returns how many were cancelled"""
+        with self._lock:
+            futures, self._futures = self._futures, set()
+        return sum(1 for future in futures if future.cancel())
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._futures)
+
+    def activate(self) -> None:
+        """Make this the current scope for the rest of the calling context"""
+        _current_scope.set(self)
+
+    def __enter__(self) -> "CallScope":
+        self._token = _current_scope.set(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _current_scope.reset(self._token)
+
+
+def current_scope() -> Optional[CallScope]:
+    return _current_scope.get()
+
+
+def submit(coro: Coroutine) -> concurrent.futures.Future:
+    """Schedule ``coro`` on the completion loop, tracked by the current scope"""
+    future = asyncio.run_coroutine_threadsafe(coro, _event_loop())
+    scope = _current_scope.get()
+    if scope is not None:
+        scope._track(future)
+    return future
+
+
+async def complete(prompt: Union[str, List[Dict[str, str]]], api_key: str, model: str = "gpt-4",
+                   timeout: Optional[float] = None, policy: Optional[CallPolicy] = None, **params: Any) -> str:
+    """
+    One chat completion; ``prompt`` is a user message or a list of messages.
+
+    Each request may take ``timeout`` seconds. Failed requests are retried,
+    hedged and moved to fallback models according to ``policy``
+    (``llm.policy.DEFAULT_POLICY`` if not given). Raises the last OpenAI
+    client error or ``asyncio.TimeoutError`` once the policy gives up, and
+    ``CancelledError`` if cancelled.
+    """
+    coro = _complete(_messages(prompt), api_key, model, LLM_TIMEOUT if timeout is None else timeout, policy,
+                     **params)
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop and running is not None:
+        return await coro
+    return await asyncio.wrap_future(submit(coro))
+
+
+async def complete_many(prompts: Sequence[Union[str, List[Dict[str, str]]]], api_key: str,
+                        model: str = "gpt-4", timeout: Optional[float] = None, policy: Optional[CallPolicy] = None,
+                        **params: Any) -> List[Union[str, BaseException]]:
+    """Complete every prompt concurrently; failures are returned in place of their text"""
+    return await asyncio.gather(*(complete(prompt, api_key, model, timeout, policy, **params)
+                                  for prompt in prompts), return_exceptions=True)
+
+
+def complete_sync(prompt: Union[str, List[Dict[str, str]]], api_key: str, model: str = "gpt-4",
+                  timeout: Optional[float] = None, policy: Optional[CallPolicy] = None, **params: Any) -> str:
+    """Blocking ``complete``; raises ``concurrent.futures.CancelledError`` if its scope is cancelled"""
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    return submit(_complete(_messages(prompt), api_key, model, timeout, policy, **params)).result()
+
+
+def complete_many_sync(prompts: Sequence[Union[str, List[Dict[str, str]]]], api_key: str,
+                       model: str = "gpt-4", timeout: Optional[float] = None, policy: Optional[CallPolicy] = None,
+                       **params: Any) -> List[Union[str, BaseException]]:
+    """Blocking ``complete_many``"""
+    return submit(complete_many(prompts, api_key, model, timeout, policy, **params)).result()
+
+
+def start_stream(prompt: Union[str, List[Dict[str, str]]], api_key: str, on_text: Callable[[str], None],
+                 model: str = "gpt-4", timeout: Optional[float] = None, policy: Optional[CallPolicy] = None,
+                 json_mode: bool = False, **params: Any) -> concurrent.futures.Future:
+    """
+    Start a streamed completion; ``on_text`` receives each piece of text as it arrives.
+
+    ``on_text`` runs on the completion loop, so it must be quick and must
+    not block. With ``json_mode``, models that support it are asked for a
+    JSON object (``config.models``); the prompt must still ask for JSON.
+    Failures before any text arrives are retried and moved to fallback
+    models under ``policy``, but never hedged. The returned future, tracked
+    by the current scope, holds the whole text, or ``StreamInterrupted`` if
+    the stream failed part way.
+    """
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    messages = _messages(prompt)
+    return submit(execute(lambda candidate: _stream_request(messages, api_key, candidate, timeout, on_text,
+                                                            json_mode, **params),
+                          model, policy, can_hedge=lambda: False))
+
+
+def stream_sync(prompt: Union[str, List[Dict[str, str]]], api_key: str, on_text: Callable[[str], None],
+                model: str = "gpt-4", timeout: Optional[float] = None, policy: Optional[CallPolicy] = None,
+                json_mode: bool = False, **params: Any) -> str:
+    """Blocking ``start_stream``; returns the whole text"""
+    return start_stream(prompt, api_key, on_text, model, timeout, policy, json_mode, **params).result()
@@ -0,0 +1,249 @@
+"""
+Retries, hedged requests and model fallback for completions.
+
+A failed completion used to surface as "Error: ..." text after one try, even
+for a momentary 429 or 503. ``execute`` runs a request under a
+``CallPolicy`` instead:
+
+- Failures are classified. Rate limits, timeouts, connection errors and 5xx
+  are retried with exponential backoff and jitter, honouring
+  ``Retry-After``. A model that can't take the request (unknown model,
+  prompt over its context length) moves straight on to the next model.
+  Authentication and other request errors are raised at once.
+- Once ``max_attempts`` tries on a model fail, the next model in its
+  ``config.models`` fallback chain is tried.
+- With hedging on, an attempt still running after the model's observed p95
+  latency gets a second, identical request, and whichever finishes first is
+  used. This trims the slowest few percent of calls for about 5% more
+  requests, each billed in full, so it is off unless ``LLM_HEDGE=1`` is set.
+
+Every request records its outcome and latency per model; ``llm_stats``
+reports them.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import openai
+
+from config.models import model_chain
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+# Hedged requests are paid for twice; opt in with LLM_HEDGE=1
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+# Never hedge sooner than this many seconds, however fast the model usually is
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+
+# Outcome classes
+OK = "ok"
+RATE_LIMITED = "rate_limited"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER_ERROR = "server_error"
+UNAVAILABLE = "unavailable"
+FATAL = "fatal"
+CANCELLED = "cancelled"
+
+RETRYABLE = {RATE_LIMITED, TIMEOUT, CONNECTION, SERVER_ERROR}
+
+
+def classify(error: BaseException) -> str:
+    """The outcome class of a failed request"""
+    if isinstance(error, asyncio.CancelledError):
+        return CANCELLED
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+        return TIMEOUT
+    if isinstance(error, openai.RateLimitError):
+        # Quota exhaustion is also a 429, but retrying won't help it
+        return FATAL if getattr(error, "code", None) == "insufficient_quota" else RATE_LIMITED
+    if isinstance(error, openai.APIConnectionError):
+        return CONNECTION
+    if isinstance(error, openai.NotFoundError):
+        return UNAVAILABLE
+    if isinstance(error, openai.BadRequestError):
+        return UNAVAILABLE if getattr(error, "code", None) == "context_length_exceeded" else FATAL
+    if isinstance(error, openai.APIStatusError):
+        return SERVER_ERROR if error.status_code >= 500 or error.status_code in (408, 409) else FATAL
+    return FATAL
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class _ModelStats:
+    def __init__(self, window: int = 200):
+        self.outcomes: Dict[str, int] = {}
+        self.hedges = 0
+        self.hedges_won = 0
+        self.served_as_fallback = 0
+        self.latencies: deque = deque(maxlen=window)
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, _ModelStats] = {}
+
+
+def _model_stats(model: str) -> _ModelStats:
+    # Called with _stats_lock held
+    stats = _stats.get(model)
+    if stats is None:
+        stats = _stats[model] = _ModelStats()
+    return stats
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def llm_stats() -> List[Dict[str, Any]]:
+    """Per-model request outcomes, hedging and latency percentiles (seconds)"""
+    with _stats_lock:
+        rows = []
+        for model, stats in sorted(_stats.items()):
+            latencies = list(stats.latencies)
+            rows.append(dict(
+                model=model, requests=sum(stats.outcomes.values()), **stats.outcomes,
+                hedges=stats.hedges, hedges_won=stats.hedges_won, served_as_fallback=stats.served_as_fallback,
+                p50=_percentile(latencies, 0.5), p95=_percentile(latencies, 0.95)))
+        return rows
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+class CallPolicy:
+    """How hard ``execute`` tries before giving up"""
+
+    def __init__(self, max_attempts: int = LLM_MAX_ATTEMPTS, base_delay: float = 0.5, max_delay: float = 20.0,
+                 hedge: bool = LLM_HEDGE, hedge_quantile: float = 0.95, hedge_min_samples: int = 20,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_DELAY, fallbacks: Optional[int] = None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.fallbacks = fallbacks
+
+    def models(self, model: str) -> List[str]:
+        return model_chain(model, self.fallbacks)
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Seconds to wait before retry number ``attempt + 1``: full jitter, or the server's Retry-After"""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds after which a second request is sent, or None if not hedging yet"""
+        if not self.hedge:
+            return None
+        with _stats_lock:
+            latencies = list(_model_stats(model).latencies)
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, _percentile(latencies, self.hedge_quantile))
+
+
+DEFAULT_POLICY = CallPolicy()
+
+
+async def _timed(model: str, request: Callable[[str], Awaitable[Any]]) -> Any:
+    started = time.perf_counter()
+    try:
+        result = await request(model)
+    except BaseException as e:
+        outcome = classify(e)
+        with _stats_lock:
+            stats = _model_stats(model)
+            stats.outcomes[outcome] = stats.outcomes.get(outcome, 0) + 1
+        raise
+    with _stats_lock:
+        stats = _model_stats(model)
+        stats.outcomes[OK] = stats.outcomes.get(OK, 0) + 1
+        stats.latencies.append(time.perf_counter() - started)
+    return result
+
+
+async def _attempt(model: str, request: Callable[[str], Awaitable[Any]], policy: CallPolicy,
+                   can_hedge: Callable[[], bool]) -> Any:
+    """One attempt on ``model``, hedged with a second request if the first is slow"""
+    first = asyncio.ensure_future(_timed(model, request))
+    pending = {first}
+    try:
+        delay = policy.hedge_delay(model)
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and can_hedge():
+            with _stats_lock:
+                _model_stats(model).hedges += 1
+            pending.add(asyncio.ensure_future(_timed(model, request)))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        with _stats_lock:
+                            _model_stats(model).hedges_won += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def execute(request: Callable[[str], Awaitable[Any]], model: str, policy: Optional[CallPolicy] = None,
+                  can_hedge: Callable[[], bool] = lambda: True) -> Any:
+    """
+    Run ``request(model)`` under ``policy``, retrying and falling back as needed.
+
+    ``request`` is called with the model to use for each try. ``can_hedge``
+    is consulted before sending a hedge, e.g. to skip it when requests are
+    already queueing. Raises the last error when every model is exhausted,
+    or a fatal error at once.
+    """
+    policy = policy or DEFAULT_POLICY
+    error: Optional[BaseException] = None
+    for candidate in policy.models(model):
+        for attempt in range(policy.max_attempts):
+            try:
+                result = await _attempt(candidate, request, policy, can_hedge)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                outcome = classify(e)
+                if outcome not in RETRYABLE and outcome != UNAVAILABLE:
+                    raise
+                if outcome == UNAVAILABLE or attempt == policy.max_attempts - 1:
+                    break
+                await asyncio.sleep(policy.backoff(attempt, e))
+                continue
+            if candidate != model:
+                with _stats_lock:
+                    _model_stats(candidate).served_as_fallback += 1
+            return result
+    raise error
@@ -0,0 +1,131 @@
+"""
+Versioned prompt templates with a stable prefix and the variable parts last.
+
+Agents used to build prompts with f-strings that put the user story in the
+middle of the instructions, so no two prompts shared more than a few words
+of prefix. Each agent now declares a ``PromptTemplate``:
+
+- a system message and instructions that never change for a template
+  version; together they are the static prefix, and their token count is
+  computed once, when the template is declared;
+- named slots, rendered after the prefix in declaration order, so the
+  parts that vary least (language, extra instructions) come before those
+  that vary most (history, the story itself).
+
+Rendering is deterministic: slot values have line endings and trailing
+whitespace normalised, and empty slots are left out. Identical inputs
+therefore give byte-identical prompts, which is what provider-side prefix
+caching matches on. ``RenderedPrompt.key`` names the template version and
+hashes only the slot values, so completion cache keys are cheap to compute,
+and bumping a template's version retires the cached completions made with
+the old wording.
+"""
+import hashlib
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or the encoding can't be loaded offline
+    _encoding = None
+
+_TRAILING_SPACE = re.compile(r"[ \t]+\n")
+
+
+def count_tokens(text: str) -> int:
+    """Exact with tiktoken installed, otherwise about four characters per token"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, (len(text) + 3) // 4) if text else 0
+
+
+def normalise(text: str) -> str:
+    """Line endings to \\n, no trailing whitespace on lines or at the ends"""
+    text = str(text).replace("\r\n", "\n").replace("\r", "\n")
+    return _TRAILING_SPACE.sub("\n", text).strip()
+
+
+class RenderedPrompt(NamedTuple):
+    """Chat messages ready to send, with a cache key"""
+    messages: List[Dict[str, str]]
+    key: str
+
+
+class PromptTemplate:
+    """
+    A named, versioned prompt.
+
+    ``slots`` is a sequence of (name, heading) pairs. A slot with a heading is
+    rendered as "<heading>:" followed by its value; a slot with an empty
+    heading is rendered as the bare value.
+    """
+
+    def __init__(self, name: str, version: int, system: str, instructions: str,
+                 slots: Sequence[Tuple[str, str]]):
+        self.name = name
+        self.version = version
+        self.system = normalise(system)
+        self.instructions = normalise(instructions)
+        self.slots = tuple(slots)
+        # The static prefix, counted once
+        self.prefix_tokens = count_tokens(self.system) + count_tokens(self.instructions)
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, **values: Optional[str]) -> RenderedPrompt:
+        unknown = set(values) - {name for name, _ in self.slots}
+        if unknown:
+            raise ValueError(f"{self.id} has no slot(s) {', '.join(sorted(unknown))}")
+        parts, digest = [], hashlib.sha256()
+        for name, heading in self.slots:
+            value = normalise(values.get(name) or "")
+            if not value:
+                continue
+            part = f"{heading}:\n{value}" if heading else value
+            parts.append(part)
+            digest.update(f"{name}\0{value}\0".encode("utf-8"))
+        user = "\n\n".join([self.instructions] + parts)
+        messages = [{"role": "system", "content": self.system}, {"role": "user", "content": user}]
+        return RenderedPrompt(messages, f"{self.id}:{digest.hexdigest()}")
+
+    def __repr__(self) -> str:
+        return f"PromptTemplate({self.id!r}, prefix_tokens={self.prefix_tokens})"
+
+
+_templates: Dict[str, PromptTemplate] = {}
+
+
+def _content(template: PromptTemplate) -> tuple:
+    return template.system, template.instructions, template.slots
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    """
+    Add ``template`` to the registry; a name can only be declared once per version.
+
+    Declaring the same content again, as a module reload does, is accepted;
+    different wording under an existing version raises ``ValueError``, since
+    cached completions are keyed by the version.
+    """
+    existing = _templates.get(template.id)
+    if existing is not None and existing is not template and _content(existing) != _content(template):
+        raise ValueError(f"Prompt template {template.id} is already registered with different content")
+    _templates[template.id] = template
+    return template
+
+
+def get_template(name: str, version: Optional[int] = None) -> PromptTemplate:
+    """The template ``name`` at ``version``, or its latest version"""
+    if version is not None:
+        return _templates[f"{name}@v{version}"]
+    candidates = [t for t in _templates.values() if t.name == name]
+    if not candidates:
+        raise KeyError(name)
+    return max(candidates, key=lambda t: t.version)
+
+
+def templates() -> List[PromptTemplate]:
+    return sorted(_templates.values(), key=lambda t: (t.name, t.version))
@@ -0,0 +1,180 @@
+"""
+Incremental parsing of JSON list output while it streams.
+
+Asked for a list of records, a model writes something like
+``{"test_cases": [{...}, {...}]}``. It may wrap that in a code fence or a
+sentence, or slip in a trailing comma or a raw newline inside a string.
+``ItemScanner`` is fed the text chunk by chunk as it streams. It hands back
+each element of the records array (the array under a given key of the
+top-level object) as soon as that element closes, so callers can validate
+it and act on it before the rest of the response has arrived.
+
+The scanner repairs, as it goes, the mistakes that would otherwise lose an
+element:
+
+- text before the first ``{`` or ``[`` and after the document closes
+  (prose, code fences) is ignored;
+- raw control characters inside strings are escaped;
+- trailing commas before ``}`` and ``]`` are dropped.
+
+An element cut off by the end of the stream is never guessed at.
+``ItemScanner.partial`` reports that there was one, so callers can say the
+output was truncated.
+"""
+import json
+import re
+from typing import Any, List, NamedTuple, Optional
+
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class Item(NamedTuple):
+    """One array element: the parsed value, or None and the parse error"""
+    value: Any
+    text: str
+    error: Optional[str]
+
+
+class ItemScanner:
+    """
+    Feed streamed text with ``feed``; each call returns the array elements it completed.
+
+    The elements are those of the array under ``key`` in the top-level
+    object (keys compare ignoring case and punctuation, so "testCases"
+    matches "test_cases"), or of the first array directly inside it when
+    ``key`` is None, or of the top-level array itself. Arrays elsewhere,
+    e.g. a "tags" list before the records or the steps inside one, are
+    part of the enclosing value, never elements. A top-level object with
+    no such array is returned whole, as a single element, when it closes.
+    """
+
+    def __init__(self, key: Optional[str] = None):
+        self.key = None if key is None else _normalise_key(key)
+        self._stack: List[str] = []    # open containers, "{" or "["
+        self._array_depth: Optional[int] = None  # stack depth inside the items array
+        self._in_string = False
+        self._escaped = False
+        self._item: List[str] = []     # text of the element being read
+        self._in_item = False
+        self._document: List[str] = []  # the whole document, until the items array is found
+        self._string: Optional[List[str]] = None  # a top-level object's string, possibly a key
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self.done = False              # the items array or the document has closed
+        self.items = 0
+
+    @property
+    def partial(self) -> bool:
+        """True if an element was still open when the text stopped"""
+        return self._in_item and not self.done
+
+    def feed(self, text: str) -> List[Item]:
+        completed = []
+        for char in text:
+            if self.done:
+                break
+            if not self._stack:
+                # Before the document: skip prose and fences
+                if char in "{[":
+                    self._document.append(char)
+                    self._stack.append(char)
+                    if char == "[":
+                        self._array_depth = 1
+                continue
+            if self._in_string:
+                self._append(_CONTROL_ESCAPES.get(char, char) if char < " " else char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._string is not None:
+                        self._last_string, self._string = "".join(self._string), None
+                    continue
+                if self._string is not None:
+                    self._string.append(char)
+                continue
+            top_level = len(self._stack) == 1 and self._stack[0] == "{"
+            if char == '"':
+                self._start_item()
+                self._in_string = True
+                self._append(char)
+                if top_level:
+                    self._string = []
+            elif char == ":" and top_level:
+                self._current_key = _normalise_key(self._last_string or "")
+                self._append(char)
+            elif char in "{[":
+                if (char == "[" and top_level and self._array_depth is None
+                        and (self.key is None or self._current_key == self.key)):
+                    # The items array: its elements are read one by one from here on
+                    self._stack.append(char)
+                    self._array_depth = len(self._stack)
+                    self._document = []
+                    continue
+                self._start_item()
+                self._append(char)
+                self._stack.append(char)
+            elif char in "}]":
+                self._drop_trailing_comma(self._item if self._in_item else self._document)
+                if len(self._stack) == self._array_depth and char == "]":
+                    # The items array closed; anything after it is ignored
+                    completed.extend(self._finish_item())
+                    self._stack.pop()
+                    self.done = True
+                    continue
+                self._append(char)
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                    if self._array_depth is None:
+                        # No items array: the document is the one element
+                        self._item, self._in_item = self._document, True
+                        completed.extend(self._finish_item())
+                elif len(self._stack) == self._array_depth:
+                    completed.extend(self._finish_item())
+            elif char == "," and self._array_depth is not None and len(self._stack) == self._array_depth:
+                completed.extend(self._finish_item())
+            elif not char.isspace():
+                self._start_item()
+                self._append(char)
+                if char == "," and top_level:
+                    self._current_key = None
+            elif self._in_item or self._array_depth is None:
+                self._append(char)
+        return completed
+
+    def _start_item(self) -> None:
+        if self._array_depth is not None and len(self._stack) == self._array_depth:
+            self._in_item = True
+
+    def _append(self, char: str) -> None:
+        if self._in_item:
+            self._item.append(char)
+        elif self._array_depth is None:
+            self._document.append(char)
+
+    @staticmethod
+    def _drop_trailing_comma(buffer: List[str]) -> None:
+        # Only reached outside strings, so a trailing "," is a JSON comma
+        i = len(buffer) - 1
+        while i >= 0 and buffer[i].isspace():
+            i -= 1
+        if i >= 0 and buffer[i] == ",":
+            del buffer[i]
+
+    def _finish_item(self) -> List[Item]:
+        text = "".join(self._item).strip()
+        self._item, self._in_item = [], False
+        if not text:
+            return []
+        self.items += 1
+        try:
+            return [Item(json.loads(text), text, None)]
+        except ValueError as e:
+            return [Item(None, text, str(e))]
+
+
+def _normalise_key(key: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", key.lower())
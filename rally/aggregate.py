@@ -0,0 +1,143 @@
+"""
+Server-side counts for dashboard summary tiles.
+
+The pass/fail tiles and the defect distributions only need counts, which
+Rally already reports as ``TotalResultCount`` on every query. Each bucket is
+asked for with its own ``pagesize=1`` query, the queries run in parallel, and
+no result rows are transferred. The full fetchers in ``utils`` are still used
+when a detail view needs the rows themselves.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+
+import requests
+
+from rally.records import STOCK_PRIORITIES, STOCK_SEVERITIES, STOCK_STATES
+from utils import rally_base_endpoint, rally_session
+
+# Upper bound on concurrent count queries issued for one summary
+MAX_PARALLEL_COUNTS = 8
+
+
+def _and(*clauses: Optional[str]) -> str:
+    """Combine Rally query clauses; Rally only accepts binary, fully parenthesised ANDs"""
+    clauses = [c for c in clauses if c]
+    query = clauses[0]
+    for clause in clauses[1:]:
+        query = f"({query} AND {clause})"
+    return query
+
+
+def _equals(field: str, value: str) -> str:
+    if value == "None":
+        return f"({field} = null)"
+    escaped = value.replace('"', '\\"')
+    return f'({field} = "{escaped}")'
+
+
+def count_query(session: requests.Session, url: str, params: Dict[str, Any],
+                query: Optional[str] = None) -> Optional[int]:
+    """Return ``TotalResultCount`` for a query, or None if the request fails"""
+    count_params = dict(params, pagesize=1, start=1, fetch="ObjectID")
+    if query:
+        count_params["query"] = query
+    try:
+        response = session.get(url, params=count_params)
+        if response.status_code != 200:
+            print(f"Count query failed ({response.status_code}): {query}")
+            return None
+        return response.json().get('QueryResult', {}).get('TotalResultCount', 0)
+    except Exception as e:
+        print(f"Error running count query {query}: {str(e)}")
+        return None
+
+
+def count_buckets(session: requests.Session, url: str, params: Dict[str, Any],
+                  buckets: Dict[str, Optional[str]],
+                  max_workers: int = MAX_PARALLEL_COUNTS) -> Dict[str, Optional[int]]:
+    """Run one count query per bucket in parallel and return {bucket: count}"""
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(buckets)))) as pool:
+        futures = {name: pool.submit(count_query, session, url, params, query)
+                   for name, query in buckets.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def _distribution(counts: Dict[str, Optional[int]], prefix: str, total: int) -> Dict[str, int]:
+    """Pull one field's buckets out of ``counts``, folding unknown values into Other"""
+    distribution = {key[len(prefix):]: value for key, value in counts.items()
+                    if key.startswith(prefix) and value}
+    remainder = total - sum(distribution.values())
+    if remainder > 0:
+        distribution["Other"] = remainder
+    return distribution
+
+
+def get_user_story_test_summary(workspace_id: str, project_id: str, story_id: str) -> Dict[str, Any]:
+    """Pass/fail/other counts for a story's test cases without downloading them"""
+    return story_test_summary(rally_session(), rally_base_endpoint(), workspace_id, project_id, story_id)
+
+
+def story_test_summary(session: requests.Session, base_endpoint: str,
+                       workspace_id: str, project_id: str, story_id: str) -> Dict[str, Any]:
+    """``get_user_story_test_summary`` against an explicit session and endpoint"""
+    story_query = f"(WorkProduct.FormattedID = \"{story_id}\")"
+    params = {
+        "workspace": f"/workspace/{workspace_id}",
+        "project": f"/project/{project_id}",
+    }
+    counts = count_buckets(
+        session,
+        f"{base_endpoint}/testcase",
+        params,
+        {
+            "total": story_query,
+            "passed": _and(story_query, _equals("LastVerdict", "Pass")),
+            "failed": _and(story_query, _equals("LastVerdict", "Fail")),
+        }
+    )
+    total = counts["total"] or 0
+    passed = counts["passed"] or 0
+    failed = counts["failed"] or 0
+    return {
+        "total_tests": total,
+        "passed": passed,
+        "failed": failed,
+        "other": max(total - passed - failed, 0),
+        "pass_percentage": (passed / total) * 100 if total else 0,
+        "complete": None not in counts.values(),
+    }
+
+
+def get_project_rca_summary(workspace_id: str, project_id: str,
+                            severities: Optional[Iterable[str]] = None,
+                            priorities: Optional[Iterable[str]] = None,
+                            states: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Severity, priority and state distributions of a project's defects from counts.
+
+    Bucket values default to Rally's stock values from ``rally.records``, so
+    the same buckets are queried whatever this process has parsed before;
+    defects with any other value are reported under ``Other``.
+    """
+    project_query = f"(Project.ObjectID = {project_id})"
+    buckets: Dict[str, Optional[str]] = {"total": project_query}
+    for prefix, field, values in (("severity:", "Severity", severities or STOCK_SEVERITIES),
+                                  ("priority:", "Priority", priorities or STOCK_PRIORITIES),
+                                  ("state:", "State", states or STOCK_STATES)):
+        for value in values:
+            buckets[f"{prefix}{value}"] = _and(project_query, _equals(field, value))
+
+    counts = count_buckets(
+        rally_session(),
+        f"{rally_base_endpoint()}/defect",
+        {"workspace": f"/workspace/{workspace_id}"},
+        buckets
+    )
+    total = counts["total"] or 0
+    return {
+        "total_defects": total,
+        "severity_distribution": _distribution(counts, "severity:", total),
+        "priority_distribution": _distribution(counts, "priority:", total),
+        "state_distribution": _distribution(counts, "state:", total),
+        "complete": None not in counts.values(),
+    }
@@ -0,0 +1,150 @@
+"""
+Batched Rally creates, used to import generated test cases into a story.
+
+Creating objects one ``POST /<type>/create`` at a time costs a round trip
+each. ``batch_create`` sends up to ``RALLY_BATCH_SIZE`` creates in one
+request to WSAPI's ``/batch`` endpoint instead. Servers without ``/batch``
+get individual creates. Every request is made under the process-wide
+``RALLY_BUDGET``.
+
+``create_test_cases`` links the test cases to a story's ``WorkProduct``. It
+consumes its input lazily and sends each batch as soon as it is full, so
+fed a ``TestCaseStream`` the Rally writes overlap the model still writing
+the remaining cases. The story's cached test data is invalidated
+afterwards, so the new cases are counted at once.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from rally import cache
+from rally.portfolio import RALLY_BUDGET
+from rally.query import STORY_REF
+from utils import rally_base_endpoint, rally_session
+
+RALLY_BATCH_SIZE = int(os.getenv("RALLY_BATCH_SIZE", "25"))
+# Batches in flight at once per import
+RALLY_BATCH_WORKERS = int(os.getenv("RALLY_BATCH_WORKERS", "2"))
+
+TYPE_NAMES = {"testcase": "TestCase", "hierarchicalrequirement": "HierarchicalRequirement", "defect": "Defect"}
+
+
+class CreateReport(NamedTuple):
+    """Outcome of a bulk create: the created objects, per-object errors and requests made"""
+    created: List[Dict[str, Any]]
+    errors: List[str]
+    requests: int
+
+
+Outcome = Tuple[Optional[Dict[str, Any]], List[str]]
+
+
+def _create_one(session, base_endpoint: str, kind: str, fields: Dict[str, Any]) -> Outcome:
+    response = session.post(f"{base_endpoint}/{kind}/create", json={TYPE_NAMES[kind]: fields})
+    if response.status_code != 200:
+        return None, [f"HTTP {response.status_code}"]
+    result = response.json().get("CreateResult", {})
+    return result.get("Object"), list(result.get("Errors") or [])
+
+
+def batch_create(kind: str, objects: Sequence[Dict[str, Any]]) -> Tuple[List[Outcome], int]:
+    """
+    Create ``objects`` (field dicts) of ``kind`` in one ``/batch`` request.
+
+    Returns (object or None, errors) per input, in order, and the number of
+    requests made.
+    """
+    session, base_endpoint = rally_session(), rally_base_endpoint()
+    entries = [{"Entry": {"Path": f"/{kind}/create", "Method": "post", "Body": {TYPE_NAMES[kind]: fields}}}
+               for fields in objects]
+    response = RALLY_BUDGET.run(session.post, f"{base_endpoint}/batch", json={"Batch": entries})
+    if response.status_code in (404, 405):
+        # No batch endpoint here; fall back to one create per object
+        return [RALLY_BUDGET.run(_create_one, session, base_endpoint, kind, fields) for fields in objects], \
+            1 + len(objects)
+    if response.status_code != 200:
+        return [(None, [f"batch request failed: HTTP {response.status_code}"])] * len(objects), 1
+    body = response.json().get("BatchResult", {})
+    results = body.get("Results") or []
+    outcomes = []
+    for i in range(len(objects)):
+        result = results[i] if i < len(results) else {}
+        result = result.get("CreateResult", result)
+        errors = list(result.get("Errors") or [])
+        obj = result.get("Object")
+        if obj is None and not errors:
+            errors = list(body.get("Errors") or []) or ["no result"]
+        outcomes.append((obj, errors))
+    return outcomes, 1
+
+
+def story_ref(workspace_id: str, project_id: str, story_id: str) -> Optional[str]:
+    """The ``/hierarchicalrequirement/<ObjectID>`` reference of story ``story_id`` (a FormattedID)"""
+    params = {
+        "workspace": f"/workspace/{workspace_id}",
+        "project": f"/project/{project_id}",
+        "query": f'(FormattedID = "{story_id}")',
+        "fetch": STORY_REF.fetch,
+        "pagesize": 1,
+    }
+    response = RALLY_BUDGET.run(rally_session().get, f"{rally_base_endpoint()}/hierarchicalrequirement",
+                                params=params)
+    response.raise_for_status()
+    results = response.json().get("QueryResult", {}).get("Results") or []
+    return f"/hierarchicalrequirement/{results[0]['ObjectID']}" if results else None
+
+
+def create_test_cases(workspace_id: str, project_id: str, story_id: str, cases: Iterable[Any],
+                      batch_size: int = RALLY_BATCH_SIZE,
+                      on_created: Optional[Callable[[Any, Optional[Dict[str, Any]], List[str]], None]] = None
+                      ) -> CreateReport:
+    """
+    Create a Rally TestCase per item of ``cases``, linked to story ``story_id``.
+
+    Items are ``agents.test_manager.TestCaseSpec`` or anything with the same
+    ``to_rally``. ``on_created(case, object, errors)`` is called as each
+    batch completes, from a worker thread.
+    """
+    work_product = story_ref(workspace_id, project_id, story_id)
+    if work_product is None:
+        raise ValueError(f"User story {story_id} not found in project {project_id}")
+    project = f"/project/{project_id}"
+    created: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    requests = [1]  # the story lookup
+    lock = threading.Lock()
+
+    def send(batch: List[Any]) -> None:
+        outcomes, made = batch_create("testcase", [case.to_rally(work_product, project) for case in batch])
+        with lock:
+            requests[0] += made
+            for case, (obj, obj_errors) in zip(batch, outcomes):
+                if obj is not None:
+                    created.append(obj)
+                errors.extend(f"{case.name}: {error}" for error in obj_errors)
+        if on_created is not None:
+            for case, (obj, obj_errors) in zip(batch, outcomes):
+                on_created(case, obj, obj_errors)
+
+    batch: List[Any] = []
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, RALLY_BATCH_WORKERS), thread_name_prefix="rally-batch") as pool:
+            for case in cases:
+                batch.append(case)
+                if len(batch) >= batch_size:
+                    futures.append(pool.submit(send, batch))
+                    batch = []
+            if batch:
+                futures.append(pool.submit(send, batch))
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    with lock:
+                        errors.append(f"batch failed: {e}")
+    finally:
+        if futures:
+            cache.invalidate_tags([("story", str(story_id)), ("tests", str(project_id))])
+    return CreateReport(created, errors, requests[0])
@@ -0,0 +1,109 @@
+"""
+Process-level caches for Rally data shared across Streamlit sessions.
+
+Streamlit keeps one ``st.session_state`` per browser tab, so anything stored
+there is fetched once per user. Workspace, project and story lists are the
+same for every user of the same Rally credential, so they are cached here,
+once per process, keyed by a fingerprint of (endpoint, api key). Per-user
+state such as the current selection stays in ``st.session_state``.
+
+The cache classes live in ``shared_cache``; with ``SHARED_CACHE_URL`` set,
+the Rally caches here are shared by every replica of the app and API.
+"""
+import functools
+import hashlib
+from typing import Any, Callable, Hashable, Iterable, List, Optional
+
+import utils
+from rally import aggregate
+from shared_cache import ProcessCache, all_caches, cache_stats, get_cache, invalidate_tags  # noqa: F401
+
+
+def credential_key(endpoint: Optional[str] = None, api_key: Optional[str] = None) -> str:
+    """Return a short, non-reversible fingerprint for a Rally credential"""
+    endpoint = utils.config.get("rally_endpoint", "") if endpoint is None else endpoint
+    api_key = utils.config.get("rally_api_key", "") if api_key is None else api_key
+    digest = hashlib.sha256(f"{(endpoint or '').rstrip('/')}\0{api_key or ''}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def clear_caches(credential: Optional[str] = None) -> None:
+    """Clear every cache, or only the Rally entries belonging to one credential"""
+    for c in all_caches():
+        if credential is None:
+            c.invalidate()
+        else:
+            c.invalidate_tags([("credential", credential)])
+
+
+# Tags attached to cached Rally data. Each artifact kind has a kind-wide tag
+# (one-tuple) plus a tag per owning project or story, so a change can be
+# applied precisely when the webhook names the owner and broadly when not.
+def project_list_tags(workspace_id, *_, **__) -> List[tuple]:
+    return [("projects",), ("projects", str(workspace_id))]
+
+
+def story_list_tags(workspace_id, project_id, *_, **__) -> List[tuple]:
+    return [("stories",), ("stories", str(project_id))]
+
+
+def story_test_tags(workspace_id, project_id, story_id, *_, **__) -> List[tuple]:
+    return [("tests",), ("tests", str(project_id)), ("story", str(story_id))]
+
+
+def project_defect_tags(workspace_id, project_id, *_, **__) -> List[tuple]:
+    return [("defects",), ("defects", str(project_id))]
+
+
+def summary_complete(summary) -> bool:
+    """Cache a count summary only if every one of its count queries succeeded"""
+    return bool(summary) and bool(summary.get("complete"))
+
+
+def rally_cached(name: str, ttl: Optional[float] = None, max_entries: int = 256,
+                 tags: Optional[Callable[..., Iterable[Hashable]]] = None,
+                 should_cache: Callable[[Any], bool] = bool) -> Callable:
+    """
+    Decorator sharing a ``utils`` Rally fetcher's results across sessions.
+
+    Entries are keyed by the active credential plus the call arguments. Empty
+    or ``None`` results are not cached because the fetchers return them on
+    errors as well as on genuinely empty data; ``should_cache`` replaces that
+    check for fetchers that report failures differently. ``tags`` maps the call
+    arguments to invalidation tags for the entry; every entry is also tagged
+    with its credential. The caches are shared across replicas when
+    ``SHARED_CACHE_URL`` is set.
+    """
+    def decorator(func: Callable) -> Callable:
+        cache = get_cache(name, ttl=ttl, max_entries=max_entries, shared=True)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            credential = credential_key()
+            key = (credential, args, tuple(sorted(kwargs.items())))
+            entry_tags = [("credential", credential)]
+            if tags is not None:
+                entry_tags.extend(tags(*args, **kwargs))
+            return cache.get_or_compute(key, lambda: func(*args, **kwargs),
+                                        should_cache=should_cache, tags=entry_tags)
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+get_rally_workspaces = rally_cached("workspaces", ttl=3600)(utils.get_rally_workspaces)
+get_rally_projects = rally_cached("projects", ttl=3600, tags=project_list_tags)(
+    utils.get_rally_projects)
+get_rally_user_stories = rally_cached("user_stories", ttl=300, tags=story_list_tags)(
+    utils.get_rally_user_stories)
+get_user_story_test_data = rally_cached("story_test_data", ttl=120, max_entries=128,
+                                        tags=story_test_tags)(utils.get_user_story_test_data)
+get_project_rca_data = rally_cached("project_rca_data", ttl=300, max_entries=64,
+                                    tags=project_defect_tags)(utils.get_project_rca_data)
+get_user_story_test_summary = rally_cached("story_test_summary", ttl=120, tags=story_test_tags,
+                                           should_cache=summary_complete)(
+    aggregate.get_user_story_test_summary)
+get_project_rca_summary = rally_cached("project_rca_summary", ttl=300, tags=project_defect_tags,
+                                       should_cache=summary_complete)(
+    aggregate.get_project_rca_summary)
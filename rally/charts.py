@@ -0,0 +1,255 @@
+"""
+Chart data preparation and figure builders for test execution history.
+
+The heavy lifting is done on whole columns: results are loaded into one
+DataFrame, the latest result per test case is picked with a single sort and
+``drop_duplicates``, and per-status counts come from one ``np.bincount`` over
+categorical codes. When there are more test cases than can usefully be drawn
+as individual bars, neighbouring test cases are binned on the server so the
+browser receives a bounded number of bars.
+
+Trend charts are pre-aggregated to a day, week or month resolution chosen from
+the date range, switch to WebGL (``Scattergl``) traces without markers past
+``WEBGL_THRESHOLD`` points, and their figure JSON is cached by data version so
+reruns with unchanged data skip rebuilding and re-serialising the figure.
+"""
+import re
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from rally.cache import get_cache
+from rally.records import TestCaseResult
+
+STATUSES = ['Pass', 'Fail', 'No Run']
+STATUS_COLORS = {'Pass': '#4CAF50', 'Fail': '#FF6B6B', 'No Run': '#FFB74D'}
+
+# Above this many test cases the status chart bins neighbouring test cases
+MAX_STATUS_BARS = 200
+
+# Trend charts keep at most this many points per trace
+MAX_TREND_POINTS = 400
+
+# Traces with more points than this are drawn with WebGL and without markers;
+# kept below MAX_TREND_POINTS so long daily ranges reach it
+WEBGL_THRESHOLD = 250
+
+# Resolutions tried in order: (label, pandas resample rule, approximate days per point)
+RESOLUTIONS = [('day', 'D', 1), ('week', 'W-MON', 7), ('month', 'MS', 30.44)]
+
+_DIGITS = re.compile(r'(\d+)')
+_figure_cache = get_cache("trend_figures", max_entries=64, copy_on_read=False)
+
+
+def results_frame(results: Sequence[TestCaseResult]) -> pd.DataFrame:
+    """Load result records into a DataFrame with a parsed ``timestamp`` column"""
+    df = pd.DataFrame.from_records(results, columns=TestCaseResult._fields)
+    df['timestamp'] = pd.to_datetime(df['date'].where(df['date'] != 'N/A'), errors='coerce', utc=True)
+    return df
+
+
+def _natural_key(value: str) -> List:
+    return [int(part) if part.isdigit() else part for part in _DIGITS.split(value)]
+
+
+def latest_per_test_case(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return one row per test case holding its most recent result.
+
+    Results without a usable date sort first, so they only win for test cases
+    that have no dated result at all. Rows are ordered by test case ID in
+    natural order (TC2 before TC10).
+    """
+    latest = (df.sort_values('timestamp', na_position='first', kind='stable')
+                .drop_duplicates('test_case_id', keep='last'))
+    order = sorted(latest['test_case_id'], key=_natural_key)
+    return latest.set_index('test_case_id').loc[order].reset_index()
+
+
+def status_counts(latest: pd.DataFrame, max_bars: int = MAX_STATUS_BARS) -> pd.DataFrame:
+    """
+    Count latest statuses per test case, or per bin of neighbouring test cases.
+
+    Returns a frame with a ``label`` column (test case ID or ``first – last``
+    range), a ``date`` column (latest result date in the bar) and one count
+    column per entry in ``STATUSES``. Verdicts outside ``STATUSES`` are not
+    counted, as before.
+    """
+    n = len(latest)
+    if n == 0:
+        return pd.DataFrame(columns=['label', 'date'] + STATUSES)
+
+    bins = max(1, min(n, max_bars))
+    bin_index = (np.arange(n) * bins) // n
+    codes = pd.Categorical(latest['verdict'], categories=STATUSES).codes
+    counted = codes >= 0
+    counts = np.bincount(bin_index[counted] * len(STATUSES) + codes[counted],
+                         minlength=bins * len(STATUSES)).reshape(bins, len(STATUSES))
+
+    ids = latest['test_case_id'].to_numpy()
+    dates = latest['date'].str.split('T').str[0].to_numpy()
+    starts = np.searchsorted(bin_index, np.arange(bins), side='left')
+    ends = np.searchsorted(bin_index, np.arange(bins), side='right') - 1
+    if bins == n:
+        labels, bar_dates = ids, dates
+    else:
+        labels = [f"{ids[s]} – {ids[e]}" for s, e in zip(starts, ends)]
+        bar_dates = (latest.assign(bin=bin_index)
+                           .groupby('bin')['timestamp'].max()
+                           .dt.strftime('%Y-%m-%d').fillna('N/A').to_numpy())
+
+    frame = pd.DataFrame(counts, columns=STATUSES)
+    frame.insert(0, 'date', bar_dates)
+    frame.insert(0, 'label', labels)
+    return frame
+
+
+def status_figure(results: Sequence[TestCaseResult],
+                  max_bars: int = MAX_STATUS_BARS) -> go.Figure:
+    """Stacked bar chart of the latest status per test case"""
+    latest = latest_per_test_case(results_frame(results))
+    counts = status_counts(latest, max_bars)
+    binned = len(counts) < len(latest)
+
+    fig = go.Figure()
+    for status in STATUSES:
+        fig.add_trace(go.Bar(
+            name=status,
+            x=counts['label'],
+            y=counts[status],
+            marker_color=STATUS_COLORS[status],
+            customdata=counts['date'],
+            hovertemplate="<b>%{x}</b><br>" +
+                          "Status: %{data.name}<br>" +
+                          "Count: %{y}<br>" +
+                          "Date: %{customdata}<br>" +
+                          "<extra></extra>"
+        ))
+
+    fig.update_layout(
+        title='Test Case Wise Fail Vs Pass History',
+        xaxis_title='Test Case Range' if binned else 'Test Case ID',
+        yaxis_title='Count',
+        barmode='stack',
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        plot_bgcolor='white',
+        height=500
+    )
+    fig.update_xaxes(tickangle=45, showgrid=True, gridwidth=1, gridcolor='LightGray')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
+    return fig
+
+
+def _trend_frame(results: Sequence[TestCaseResult]) -> pd.DataFrame:
+    return pd.DataFrame({
+        'date': [result.date for result in results],
+        'verdict': [result.verdict for result in results],
+    })
+
+
+def data_version(df: pd.DataFrame) -> str:
+    """Cheap content hash of the columns a trend chart depends on"""
+    hashed = pd.util.hash_pandas_object(df[['date', 'verdict']], index=False)
+    return f"{len(df)}:{int(hashed.sum()) & 0xFFFFFFFFFFFFFFFF:x}"
+
+
+def choose_resolution(timestamps: pd.Series, max_points: int = MAX_TREND_POINTS) -> str:
+    """Return the finest of day/week/month that keeps the range under ``max_points``"""
+    valid = timestamps.dropna()
+    if valid.empty:
+        return 'day'
+    span_days = (valid.max() - valid.min()).days + 1
+    for label, _, days_per_point in RESOLUTIONS:
+        if span_days / days_per_point <= max_points:
+            return label
+    return RESOLUTIONS[-1][0]
+
+
+def failure_trend(df: pd.DataFrame, resolution: Optional[str] = None,
+                  max_points: int = MAX_TREND_POINTS) -> pd.DataFrame:
+    """
+    Total and failed result counts per period.
+
+    ``df`` needs ``date`` and ``verdict`` columns. Only the day part of each
+    date is parsed, which is all the coarsest-to-finest resolutions need and
+    several times faster than parsing full timestamps. Returns a frame indexed
+    by period start with ``total`` and ``failed`` columns; empty periods inside
+    the range are included with zero counts.
+    """
+    days = pd.to_datetime(df['date'].str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+    dated = days.notna().to_numpy()
+    if not dated.any():
+        return pd.DataFrame(columns=['total', 'failed'])
+    days = days[dated]
+    resolution = resolution or choose_resolution(days, max_points)
+    rule = dict((label, rule) for label, rule, _ in RESOLUTIONS)[resolution]
+    frame = pd.DataFrame({
+        'total': np.ones(len(days), dtype=np.int64),
+        'failed': (df['verdict'].to_numpy()[dated] == 'Fail').astype(np.int64),
+    }, index=pd.DatetimeIndex(days))
+    # Weekly bins otherwise close on, and are labelled by, their last day
+    trend = frame.resample(rule, label='left', closed='left').sum()
+    trend.attrs['resolution'] = resolution
+    return trend
+
+
+def failure_trend_figure(results: Sequence[TestCaseResult], resolution: Optional[str] = None,
+                         max_points: int = MAX_TREND_POINTS,
+                         version: Optional[str] = None) -> Optional[go.Figure]:
+    """
+    Line chart of total vs failed results over time, or None without dated results.
+
+    The serialised figure is cached under ``version`` (computed from the data
+    when not supplied), so callers that already track a data version, such as
+    a sync timestamp, avoid even the hashing pass.
+    """
+    df = None
+    if version is None:
+        df = _trend_frame(results)
+        version = data_version(df)
+    key = (version, resolution, max_points)
+    cached = _figure_cache.get(key)
+    if cached is not None:
+        return go.Figure(cached)
+
+    trend = failure_trend(_trend_frame(results) if df is None else df, resolution, max_points)
+    if trend.empty:
+        return None
+
+    dense = len(trend) > WEBGL_THRESHOLD
+    scatter = go.Scattergl if dense else go.Scatter
+    mode = 'lines' if dense else 'lines+markers'
+    x = trend.index.strftime('%Y-%m-%d')
+
+    fig = go.Figure()
+    fig.add_trace(scatter(
+        x=x,
+        y=trend['total'],
+        name="Total Tests",
+        line=dict(color="#4CAF50", width=2),
+        mode=mode
+    ))
+    fig.add_trace(scatter(
+        x=x,
+        y=trend['failed'],
+        name="Failed Tests",
+        line=dict(color="#FF6B6B", width=2),
+        mode=mode
+    ))
+    fig.update_layout(
+        title=f"Test Case Execution History (per {trend.attrs['resolution']})",
+        xaxis_title="Date",
+        yaxis_title="Number of Tests",
+        hovermode='x unified',
+        showlegend=True,
+        plot_bgcolor='white',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
+
+    _figure_cache.set(key, fig.to_plotly_json())
+    return fig
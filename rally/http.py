@@ -0,0 +1,211 @@
+"""
+Conditional GETs and compressed transfer for the Rally session.
+
+Workspace, project and story lists rarely change between fetches, yet every
+fetch used to download the same JSON again. ``ConditionalAdapter`` is
+mounted on the shared ``utils.rally_session``. It remembers the ETag and
+Last-Modified validators and the body of each GET, per credential and full
+URL (query parameters included). The next GET of that URL is sent with
+``If-None-Match`` / ``If-Modified-Since``, and a 304 reply is answered from
+the remembered body as an ordinary 200 response, so callers (including
+streaming ones) cannot tell the difference.
+
+Bodies are never read here. The response streams to the caller as usual,
+and the decoded chunks are copied as the caller reads them. Only a body
+read to the end is remembered, so a streamed page parsed incrementally
+stays streamed. Remembered bodies are bounded one by one
+(``RALLY_CONDITIONAL_MAX_BYTES``) and in total
+(``RALLY_CONDITIONAL_TOTAL_BYTES``), least recently used first out.
+
+The session also asks for gzip/deflate bodies. ``transfer_stats`` reports
+how many requests were revalidated and how many bytes the 304s and the
+compression saved.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+ACCEPT_ENCODING = "gzip, deflate"
+
+# The largest body remembered for revalidation, and the most kept in total
+RALLY_CONDITIONAL_MAX_BYTES = int(os.getenv("RALLY_CONDITIONAL_MAX_BYTES", str(4 * 1024 * 1024)))
+RALLY_CONDITIONAL_TOTAL_BYTES = int(os.getenv("RALLY_CONDITIONAL_TOTAL_BYTES", str(64 * 1024 * 1024)))
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,         # GETs sent
+    "conditional": 0,      # ... of which carried validators
+    "not_modified": 0,     # ... and were answered with 304
+    "bytes_saved": 0,      # body bytes a 304 did not transfer (as they were encoded on the wire)
+    "wire_bytes": 0,       # bytes received for the bodies that were read here
+    "decoded_bytes": 0,    # those bodies after decompression
+}
+
+# Hop-by-hop and encoding headers that don't apply to a replayed, decoded body
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+class _Remembered(NamedTuple):
+    etag: str
+    last_modified: str
+    body: bytes
+    wire_bytes: int
+    headers: Dict[str, str]
+    encoding: str
+
+
+class _BodyStore:
+    """LRU of remembered responses, bounded by the total size of their bodies"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[Hashable, _Remembered]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional["_Remembered"]:
+        with self._lock:
+            remembered = self._entries.get(key)
+            if remembered is not None:
+                self._entries.move_to_end(key)
+            return remembered
+
+    def set(self, key: Hashable, remembered: "_Remembered") -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous.body)
+            if len(remembered.body) > self.max_bytes:
+                return
+            self._entries[key] = remembered
+            self.bytes += len(remembered.body)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.body)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Bodies are immutable bytes, so they are handed out without copying
+_bodies = _BodyStore(RALLY_CONDITIONAL_TOTAL_BYTES)
+
+
+class _TeeRaw:
+    """
+    Wraps a response's ``raw`` stream, copying the decoded chunks as they are read.
+
+    ``on_complete(body, wire_bytes)`` is called once the body has been read
+    to the end. Bodies over ``RALLY_CONDITIONAL_MAX_BYTES`` stop being copied.
+    """
+
+    def __init__(self, raw, on_complete: Callable[[bytes, int], None]):
+        self._raw = raw
+        self._on_complete = on_complete
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        parts, size = ([] if decode_content else None), 0
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            if parts is not None:
+                size += len(chunk)
+                if size > RALLY_CONDITIONAL_MAX_BYTES:
+                    parts = None
+                else:
+                    parts.append(chunk)
+            yield chunk
+        if parts is not None:
+            self._on_complete(b"".join(parts), self._raw.tell() if hasattr(self._raw, "tell") else size)
+
+
+def _count(**amounts: int) -> None:
+    with _stats_lock:
+        for key, amount in amounts.items():
+            _stats[key] += amount
+
+
+def transfer_stats() -> Dict[str, Any]:
+    """Process-wide conditional GET and compression counters"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["compression_saved"] = stats["decoded_bytes"] - stats["wire_bytes"]
+    stats["remembered"] = len(_bodies)
+    stats["remembered_bytes"] = _bodies.bytes
+    return stats
+
+
+class ConditionalAdapter(HTTPAdapter):
+    """``HTTPAdapter`` that revalidates repeated GETs and replays the body on 304"""
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, **kwargs) -> requests.Response:
+        if request.method != "GET":
+            return super().send(request, stream=stream, **kwargs)
+        # The API key is part of the key because results depend on who is asking
+        credential = hashlib.sha256((request.headers.get("zsessionid") or "").encode("utf-8")).hexdigest()[:16]
+        key = (credential, request.url)
+        remembered = _bodies.get(key)
+        if remembered is not None:
+            if remembered.etag:
+                request.headers["If-None-Match"] = remembered.etag
+            if remembered.last_modified:
+                request.headers["If-Modified-Since"] = remembered.last_modified
+        response = super().send(request, stream=stream, **kwargs)
+        _count(requests=1, conditional=int(remembered is not None))
+
+        if response.status_code == 304 and remembered is not None:
+            response.close()
+            _count(not_modified=1, bytes_saved=remembered.wire_bytes)
+            return self._replay(request, response, remembered)
+        etag = response.headers.get("ETag", "")
+        last_modified = response.headers.get("Last-Modified", "")
+        if response.status_code != 200 or not (etag or last_modified):
+            return response
+
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > RALLY_CONDITIONAL_MAX_BYTES:
+            return response
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS}
+
+        def remember(body: bytes, wire_bytes: int) -> None:
+            _count(wire_bytes=wire_bytes, decoded_bytes=len(body))
+            _bodies.set(key, _Remembered(etag, last_modified, body, wire_bytes, headers,
+                                         response.encoding or "utf-8"))
+
+        # Read by the caller (or by requests itself when not streaming), never here
+        response.raw = _TeeRaw(response.raw, remember)
+        return response
+
+    def _replay(self, request: requests.PreparedRequest, not_modified: requests.Response,
+                remembered: _Remembered) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(remembered.headers)
+        # Fresh validators from the 304, if the server sent any
+        for header in ("ETag", "Last-Modified", "Date", "Cache-Control"):
+            if header in not_modified.headers:
+                response.headers[header] = not_modified.headers[header]
+        response._content = remembered.body
+        response._content_consumed = True
+        response.encoding = remembered.encoding
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = not_modified.elapsed
+        response.history = []
+        response.cookies = not_modified.cookies
+        return response
@@ -0,0 +1,119 @@
+"""
+Windowed access to long Rally lists without fetching them whole.
+
+``get_rally_projects`` and ``get_rally_user_stories`` return complete lists,
+which is what the indexes and dashboards need, but a selector only shows
+the first few dozen entries until the user asks for more. ``LazyPages``
+wraps the lazy ``utils.iter_rally_*`` generators and pulls from them only
+as far as the windows requested so far; the next Rally page is already
+being fetched in the background by then. Pagers are shared across
+sessions like the lists they stand in for, and dropped with them when a
+webhook reports changes.
+"""
+import threading
+from typing import Any, Callable, Iterator, List, Optional
+
+import utils
+from rally import cache
+
+# Entries a selector shows at first and adds per "load more"
+SELECTOR_WINDOW = 50
+
+
+class LazyPages:
+    """
+    A list materialised from an iterator on demand.
+
+    ``window`` and ``all`` are thread-safe; items already pulled are kept, so
+    later windows and other sessions reuse them. If the iterator raises, the
+    error is re-raised to every caller asking for more than was loaded and
+    the pager is marked ``failed``, so it is never taken for the whole list.
+    """
+
+    def __init__(self, factory: Callable[[], Iterator[Any]]):
+        self._factory = factory
+        self._iterator: Optional[Iterator[Any]] = None
+        self._items: List[Any] = []
+        self._exhausted = False
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def _fill(self, count: Optional[int]) -> None:
+        with self._lock:
+            if self._iterator is None and not self._exhausted and self._error is None:
+                self._iterator = self._factory()
+            while not self._exhausted and (count is None or len(self._items) < count):
+                if self._error is not None:
+                    raise self._error
+                try:
+                    self._items.append(next(self._iterator))
+                except StopIteration:
+                    self._exhausted = True
+                except Exception as e:
+                    print(f"Error loading page: {str(e)}")
+                    self._error = e
+                    self._iterator = None
+                    raise
+            if self._exhausted:
+                self._iterator = None
+
+    def window(self, start: int, size: int) -> List[Any]:
+        """Items ``start`` to ``start + size``, fetching only as far as needed"""
+        self._fill(start + size)
+        return self._items[start:start + size]
+
+    def all(self) -> List[Any]:
+        self._fill(None)
+        return list(self._items)
+
+    @property
+    def loaded(self) -> int:
+        return len(self._items)
+
+    @property
+    def exhausted(self) -> bool:
+        """True once every item has been fetched"""
+        return self._exhausted
+
+    @property
+    def failed(self) -> bool:
+        """True once the iterator has raised; the items loaded are only a prefix"""
+        return self._error is not None
+
+    def has_more(self, shown: int) -> bool:
+        """Whether there is anything after the first ``shown`` items"""
+        self._fill(shown + 1)
+        return len(self._items) > shown
+
+
+# Pagers hold live iterators, so they are per process and handed out as-is
+_pagers = cache.get_cache("lazy_rally_lists", ttl=300, max_entries=64, copy_on_read=False)
+
+
+def _pager(kind: str, key: tuple, factory: Callable[[], Iterator[Any]], tags: List[tuple]) -> LazyPages:
+    credential = cache.credential_key()
+    full_key = (credential, kind) + key
+    entry_tags = [("credential", credential)] + tags
+    pager = _pagers.get_or_compute(full_key, lambda: LazyPages(factory), tags=entry_tags)
+    if pager.failed:
+        # A failed pager holds only part of the list; start over with a new one
+        _pagers.invalidate(lambda k: k == full_key)
+        pager = _pagers.get_or_compute(full_key, lambda: LazyPages(factory), tags=entry_tags)
+    if pager.exhausted and not pager.loaded:
+        # Empty: check again on the next call rather than for the whole TTL
+        _pagers.invalidate(lambda k: k == full_key)
+    return pager
+
+
+def lazy_projects(workspace_id: str) -> LazyPages:
+    """The projects of a workspace, loaded a window at a time"""
+    return _pager("projects", (str(workspace_id),), lambda: utils.iter_rally_projects(workspace_id),
+                  cache.project_list_tags(workspace_id))
+
+
+def lazy_user_stories(workspace_id: str, project_id: str) -> LazyPages:
+    """The user stories of a project, newest first, loaded a window at a time"""
+    return _pager("stories", (str(workspace_id), str(project_id)),
+                  lambda: utils.iter_rally_user_stories(workspace_id, project_id),
+                  cache.story_list_tags(workspace_id, project_id))
+
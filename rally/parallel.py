@@ -0,0 +1,227 @@
+"""
+Partitioned, multi-process aggregation of test case results.
+
+Result records are encoded once into flat NumPy columns (test case code,
+verdict code, ``YYYY-MM-DD`` date bytes), partitioned into one shard per
+worker by test case, and written to ``multiprocessing.shared_memory`` blocks.
+Workers attach to the blocks by name, so no rows are pickled. Each worker
+parses dates and aggregates its shard with vectorised NumPy. It returns small
+partial arrays: daily totals, per-test-case verdict counts and the latest
+result per test case. The parent merges these partials with sums and
+element-wise maxima, which gives the same answer for any partitioning.
+"""
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from rally.records import VERDICT, TestCaseResult
+
+# Below this many results the pool start-up costs more than it saves
+PARALLEL_THRESHOLD = 200_000
+
+_NAT = np.iinfo(np.int64).min
+
+ArraySpec = Tuple[str, str, Tuple[int, ...]]
+
+
+class ResultColumns:
+    """Columnar encoding of test case results"""
+
+    def __init__(self, test_case: np.ndarray, verdict: np.ndarray, date: np.ndarray,
+                 test_case_ids: List[str]):
+        self.test_case = test_case
+        self.verdict = verdict
+        self.date = date
+        self.test_case_ids = test_case_ids
+
+    def __len__(self) -> int:
+        return len(self.test_case)
+
+
+def encode_results(results: Sequence[TestCaseResult]) -> ResultColumns:
+    """Encode records into int32 test case codes, int16 verdict codes and S10 dates"""
+    codes, uniques = pd.factorize(pd.Series([r.test_case_id for r in results], dtype=object))
+    verdict = np.fromiter((VERDICT.code(r.verdict) for r in results), dtype=np.int16, count=len(results))
+    # Undated results become empty strings, which NumPy parses as NaT
+    date = np.array([r.date[:10] if r.date[:1].isdigit() else "" for r in results], dtype="S10")
+    return ResultColumns(codes.astype(np.int32), verdict, date, list(uniques))
+
+
+class ResultAggregate:
+    """Merged aggregates over a set of test case results"""
+
+    def __init__(self, test_case_ids: List[str], day_origin: int, daily_total: np.ndarray,
+                 daily_failed: np.ndarray, verdict_counts: np.ndarray,
+                 latest_day: np.ndarray, latest_verdict: np.ndarray):
+        self.test_case_ids = test_case_ids
+        self.day_origin = day_origin
+        self.daily_total = daily_total
+        self.daily_failed = daily_failed
+        self.verdict_counts = verdict_counts
+        self.latest_day = latest_day
+        self.latest_verdict = latest_verdict
+
+    def failure_trend(self) -> Dict[str, Dict[str, Any]]:
+        """Per-day totals in the shape of ``get_user_story_test_data``'s failure_trend"""
+        trend = {}
+        for offset in np.flatnonzero(self.daily_total).tolist():
+            total = int(self.daily_total[offset])
+            failed = int(self.daily_failed[offset])
+            date = str(np.datetime64(self.day_origin + offset, "D"))
+            trend[date] = {"total": total, "failed": failed, "failure_rate": failed / total * 100}
+        return trend
+
+    def verdict_totals(self) -> Dict[str, int]:
+        totals = self.verdict_counts.sum(axis=0)
+        return {VERDICT.value(code): int(n) for code, n in enumerate(totals.tolist()) if n}
+
+    def latest_status(self) -> Dict[str, str]:
+        """Verdict of each test case's most recent dated result (or any result if none are dated)"""
+        return {tc: VERDICT.value(int(v)) for tc, v in zip(self.test_case_ids, self.latest_verdict.tolist())}
+
+
+def _aggregate_arrays(test_case: np.ndarray, verdict: np.ndarray, date: np.ndarray,
+                      n_test_cases: int, n_verdicts: int) -> Dict[str, Any]:
+    """Aggregate one shard; runs in a worker or in-process"""
+    days = date.astype("datetime64[D]").astype(np.int64)
+    dated = days != _NAT
+    fail = VERDICT.code("Fail")
+
+    if dated.any():
+        origin = int(days[dated].min())
+        offsets = days[dated] - origin
+        daily_total = np.bincount(offsets)
+        daily_failed = np.bincount(offsets[verdict[dated] == fail], minlength=len(daily_total))
+    else:
+        origin, daily_total, daily_failed = 0, np.zeros(0, np.int64), np.zeros(0, np.int64)
+
+    verdict_counts = np.bincount(test_case.astype(np.int64) * n_verdicts + verdict,
+                                 minlength=n_test_cases * n_verdicts)
+
+    # Latest per test case: sort by (test case, day) and keep each group's last row
+    order = np.lexsort((days, test_case))
+    sorted_tc = test_case[order]
+    last = np.flatnonzero(np.append(sorted_tc[1:] != sorted_tc[:-1], True)) if len(order) else order
+    latest_day = np.full(n_test_cases, _NAT, dtype=np.int64)
+    latest_verdict = np.full(n_test_cases, -1, dtype=np.int16)
+    latest_day[sorted_tc[last]] = days[order][last]
+    latest_verdict[sorted_tc[last]] = verdict[order][last]
+
+    return {
+        "origin": origin, "daily_total": daily_total, "daily_failed": daily_failed,
+        "verdict_counts": verdict_counts, "latest_day": latest_day, "latest_verdict": latest_verdict,
+    }
+
+
+def _attach(spec: ArraySpec) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, dtype, shape = spec
+    # The parent owns and unlinks the block. Before Python 3.13 attaching also
+    # registers it, which is harmless with the tracker shared via process_pool()
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Return a pool suitable for ``aggregate_results(executor=...)``.
+
+    The shared-memory resource tracker is started first so that workers
+    inherit it rather than starting their own, which would otherwise report
+    the parent's blocks as leaked when the workers exit.
+    """
+    resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _aggregate_shard(specs: List[ArraySpec], start: int, end: int,
+                     n_test_cases: int, n_verdicts: int) -> Dict[str, Any]:
+    blocks, arrays = zip(*(_attach(spec) for spec in specs))
+    try:
+        return _aggregate_arrays(*(a[start:end] for a in arrays), n_test_cases, n_verdicts)
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+
+def _merge(partials: List[Dict[str, Any]], test_case_ids: List[str], n_verdicts: int) -> ResultAggregate:
+    n_test_cases = len(test_case_ids)
+    dated = [p for p in partials if len(p["daily_total"])]
+    origin = min((p["origin"] for p in dated), default=0)
+    span = max((p["origin"] - origin + len(p["daily_total"]) for p in dated), default=0)
+    daily_total = np.zeros(span, dtype=np.int64)
+    daily_failed = np.zeros(span, dtype=np.int64)
+    verdict_counts = np.zeros(n_test_cases * n_verdicts, dtype=np.int64)
+    latest_day = np.full(n_test_cases, _NAT, dtype=np.int64)
+    latest_verdict = np.full(n_test_cases, -1, dtype=np.int16)
+
+    for p in partials:
+        if len(p["daily_total"]):
+            at = p["origin"] - origin
+            daily_total[at:at + len(p["daily_total"])] += p["daily_total"]
+            daily_failed[at:at + len(p["daily_failed"])] += p["daily_failed"]
+        verdict_counts[:len(p["verdict_counts"])] += p["verdict_counts"]
+        newer = (p["latest_verdict"] >= 0) & ((p["latest_day"] > latest_day) | (latest_verdict < 0))
+        latest_day[newer] = p["latest_day"][newer]
+        latest_verdict[newer] = p["latest_verdict"][newer]
+
+    return ResultAggregate(test_case_ids, origin, daily_total, daily_failed,
+                           verdict_counts.reshape(n_test_cases, n_verdicts), latest_day, latest_verdict)
+
+
+def aggregate_results(results: Sequence[TestCaseResult], workers: Optional[int] = None,
+                      executor: Optional[Executor] = None,
+                      columns: Optional[ResultColumns] = None) -> ResultAggregate:
+    """
+    Aggregate test case results, in parallel when the input is large.
+
+    ``workers`` defaults to the CPU count, and inputs under
+    ``PARALLEL_THRESHOLD`` are aggregated in-process. Pass a long-lived
+    ``executor`` from ``process_pool`` to avoid starting a pool per call, and pre-encoded
+    ``columns`` to skip encoding (e.g. when benchmarking).
+    """
+    columns = columns or encode_results(results)
+    n_test_cases = len(columns.test_case_ids)
+    n_verdicts = len(VERDICT)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or (executor is None and len(columns) < PARALLEL_THRESHOLD):
+        partial = _aggregate_arrays(columns.test_case, columns.verdict, columns.date,
+                                    n_test_cases, n_verdicts)
+        return _merge([partial], columns.test_case_ids, n_verdicts)
+
+    # Partition by test case: each shard is contiguous after a stable reorder
+    shard = columns.test_case % workers
+    order = np.argsort(shard, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(shard, minlength=workers))])
+
+    blocks = []
+    try:
+        specs = []
+        for array in (columns.test_case, columns.verdict, columns.date):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array[order]
+            specs.append((block.name, array.dtype.str, array.shape))
+
+        pool = executor or process_pool(workers)
+        try:
+            futures = [pool.submit(_aggregate_shard, specs, int(bounds[i]), int(bounds[i + 1]),
+                                   n_test_cases, n_verdicts)
+                       for i in range(workers) if bounds[i + 1] > bounds[i]]
+            partials = [future.result() for future in futures]
+        finally:
+            if executor is None:
+                pool.shutdown()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return _merge(partials, columns.test_case_ids, n_verdicts)
@@ -0,0 +1,203 @@
+"""
+Portfolio-level RCA and test health across many projects or stories.
+
+The per-project and per-story fetchers are run concurrently, and every
+Rally-bound call in the process shares one ``ConcurrencyBudget``, so one
+user's 40-project release view cannot flood Rally or starve other sessions.
+Results are yielded as each project or story finishes and folded into one
+running total in place; the merge functions built on the same folds are
+associative, so partial results can be combined in any grouping or order.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from rally import cache
+from rally.rollup import DefectCube, rca_summaries
+
+
+class ConcurrencyBudget:
+    """Process-wide cap on in-flight Rally requests, shared by all sessions"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        with self._semaphore:
+            return func(*args, **kwargs)
+
+
+RALLY_BUDGET = ConcurrencyBudget(int(os.getenv("RALLY_MAX_CONCURRENCY", "8")))
+
+
+def _iter_concurrently(calls: Dict[Any, Tuple[Callable, tuple]],
+                       max_workers: int) -> Iterator[Tuple[Any, Any]]:
+    """Run ``{key: (func, args)}`` under the budget, yielding (key, result) as each finishes"""
+    if not calls:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls)))) as pool:
+        futures = {pool.submit(RALLY_BUDGET.run, func, *args): key
+                   for key, (func, args) in calls.items()}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error fetching {futures[future]}: {str(e)}")
+                result = None
+            yield futures[future], result
+
+
+def _workspace_projects(workspace_id: str, project_ids: Optional[Iterable[str]]) -> Dict[str, str]:
+    """Return {project_id: name}, listing the workspace when no ids are given"""
+    if project_ids is None:
+        return {str(p["id"]): p["name"] for p in cache.get_rally_projects(workspace_id) or []}
+    return {str(p): str(p) for p in project_ids}
+
+
+# -- RCA ------------------------------------------------------------------
+
+def empty_rca() -> Dict[str, Any]:
+    """Identity element for ``merge_rca``"""
+    cube = DefectCube()
+    return dict(defects=[], rollup=cube, **rca_summaries(cube))
+
+
+def _add_rca(into: Dict[str, Any], part: Dict[str, Any]) -> None:
+    """Fold ``part``'s defects and counts into ``into``; its summaries are left stale"""
+    if part.get("rollup") is not None:
+        into["rollup"].merge(part["rollup"])
+    into["defects"].extend(part["defects"])
+
+
+def merge_rca(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine two ``get_project_rca_data`` results into a new one"""
+    merged = empty_rca()
+    for part in (left, right):
+        _add_rca(merged, part)
+    merged.update(rca_summaries(merged["rollup"]))
+    return merged
+
+
+def iter_project_rca(workspace_id: str, project_ids: Optional[Iterable[str]] = None,
+                     max_workers: int = 8) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """Yield (project_id, rca_data) for each project as soon as it is fetched"""
+    projects = _workspace_projects(workspace_id, project_ids)
+    calls = {pid: (cache.get_project_rca_data, (workspace_id, pid)) for pid in projects}
+    yield from _iter_concurrently(calls, max_workers)
+
+
+def get_portfolio_rca_data(workspace_id: str, project_ids: Optional[Iterable[str]] = None,
+                           max_workers: int = 8,
+                           on_result: Optional[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = None
+                           ) -> Dict[str, Any]:
+    """
+    RCA across several projects, or every project in the workspace.
+
+    ``on_result(project_id, project_data, merged_so_far)`` is called as each
+    project arrives, so a UI can redraw incrementally; ``merged_so_far`` is
+    the running total itself, not a copy. The merged result has
+    the usual ``get_project_rca_data`` keys plus ``projects`` (per-project
+    defect counts) and ``failed_projects``. The cube's ``project`` dimension
+    allows slicing the merged data by project.
+    """
+    names = _workspace_projects(workspace_id, project_ids)
+    merged = empty_rca()
+    merged_projects: List[Dict[str, Any]] = []
+    failed: List[str] = []
+    for project_id, data in iter_project_rca(workspace_id, names, max_workers):
+        if data is None:
+            failed.append(project_id)
+            continue
+        _add_rca(merged, data)
+        merged_projects.append({"id": project_id, "name": names.get(project_id, project_id),
+                                "total_defects": len(data["defects"])})
+        if on_result is not None:
+            merged.update(rca_summaries(merged["rollup"]))
+            on_result(project_id, data, merged)
+    merged.update(rca_summaries(merged["rollup"]))
+    merged["projects"] = merged_projects
+    merged["failed_projects"] = failed
+    return merged
+
+
+# -- Test health ----------------------------------------------------------
+
+def empty_test_data() -> Dict[str, Any]:
+    """Identity element for ``merge_test_data``"""
+    return {
+        "total_tests": 0, "passed": 0, "failed": 0, "other": 0,
+        "test_cases": [], "defects": [], "pass_percentage": 0,
+        "statistics": {}, "failure_trend": {}, "daily_trend": {},
+    }
+
+
+def _add_test_data(into: Dict[str, Any], part: Dict[str, Any]) -> None:
+    """Fold ``part``'s counts, test cases and trend into ``into``; rates are left stale"""
+    for key in ("passed", "failed", "other"):
+        into[key] += part[key]
+    into["test_cases"].extend(part["test_cases"])
+    into["defects"].extend(part["defects"])
+    for date, day in part["failure_trend"].items():
+        merged_day = into["failure_trend"].setdefault(
+            date, {"total": 0, "failed": 0, "failure_rate": 0, "failure_details": []})
+        merged_day["total"] += day["total"]
+        merged_day["failed"] += day["failed"]
+        merged_day["failure_details"].extend(day["failure_details"])
+
+
+def _update_rates(merged: Dict[str, Any]) -> None:
+    """Recompute the totals and percentages ``_add_test_data`` leaves stale"""
+    merged["total_tests"] = len(merged["test_cases"])
+    if merged["total_tests"]:
+        merged["pass_percentage"] = (merged["passed"] / merged["total_tests"]) * 100
+    for day in merged["failure_trend"].values():
+        if day["total"]:
+            day["failure_rate"] = (day["failed"] / day["total"]) * 100
+
+
+def merge_test_data(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine two ``get_user_story_test_data`` results into a new one"""
+    merged = empty_test_data()
+    for part in (left, right):
+        _add_test_data(merged, part)
+    _update_rates(merged)
+    return merged
+
+
+def iter_story_test_data(workspace_id: str, stories: Sequence[Tuple[str, str]],
+                         max_workers: int = 8) -> Iterator[Tuple[Tuple[str, str], Optional[Dict[str, Any]]]]:
+    """Yield ((project_id, story_id), test_data) for each story as soon as it is fetched"""
+    calls = {(project_id, story_id): (cache.get_user_story_test_data, (workspace_id, project_id, story_id))
+             for project_id, story_id in stories}
+    yield from _iter_concurrently(calls, max_workers)
+
+
+def get_portfolio_test_data(workspace_id: str, stories: Sequence[Tuple[str, str]],
+                            max_workers: int = 8,
+                            on_result: Optional[Callable[[Tuple[str, str], Dict[str, Any], Dict[str, Any]], None]] = None
+                            ) -> Dict[str, Any]:
+    """
+    Test health across several stories, given as (project_id, story_id) pairs.
+
+    Behaves like ``get_portfolio_rca_data``: ``on_result`` sees each story as it
+    finishes, and the merged result adds ``stories`` and ``failed_stories``.
+    """
+    merged = empty_test_data()
+    per_story: List[Dict[str, Any]] = []
+    failed: List[Tuple[str, str]] = []
+    for key, data in iter_story_test_data(workspace_id, stories, max_workers):
+        if not data:
+            failed.append(key)
+            continue
+        _add_test_data(merged, data)
+        per_story.append({"project_id": key[0], "story_id": key[1], "total_tests": data["total_tests"],
+                          "passed": data["passed"], "failed": data["failed"]})
+        if on_result is not None:
+            _update_rates(merged)
+            on_result(key, data, merged)
+    _update_rates(merged)
+    merged["stories"] = per_story
+    merged["failed_stories"] = failed
+    return merged
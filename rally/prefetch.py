@@ -0,0 +1,136 @@
+"""
+Warm the Rally caches for a project as soon as it is selected.
+
+On the analytics pages, picking a workspace and project is almost always
+followed by the project's defect tiles or a story's test tiles. Those
+render from count summaries, and rows are only fetched once a detail view
+is opened, so ``Prefetcher.select`` warms just the summaries in the
+background: the project's RCA summary and, once the story list has
+arrived, the test summaries of its ``PREFETCH_STORIES`` most recent
+stories. Results land in the shared caches in ``rally.cache``,
+whose single-flight locking makes a page that asks while a prefetch is
+still running wait for it instead of fetching again.
+
+Each session keeps its own ``Prefetcher``; selecting another project
+cancels whatever of the previous selection has not started yet. All
+prefetches run on one small pool of ``PREFETCH_WORKERS`` threads, and each
+call also goes through ``RALLY_BUDGET``, so warming never takes more than
+part of the process-wide Rally budget away from requests a user is
+waiting on.
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rally import cache
+from rally.paging import lazy_user_stories
+from rally.portfolio import RALLY_BUDGET
+
+PREFETCH_ENABLED = os.getenv("RALLY_PREFETCH", "1") != "0"
+# Most recent stories whose test summary is warmed per selection
+PREFETCH_STORIES = int(os.getenv("PREFETCH_STORIES", "10"))
+# Threads shared by every session's prefetches; keep below RALLY_MAX_CONCURRENCY
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "3"))
+
+_pool = ThreadPoolExecutor(max_workers=max(1, PREFETCH_WORKERS), thread_name_prefix="rally-prefetch")
+
+_stats_lock = threading.Lock()
+_stats = {"selections": 0, "fetched": 0, "cancelled": 0, "failed": 0}
+
+
+def _count(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+
+def prefetch_stats() -> Dict[str, int]:
+    """Process-wide prefetch counters"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class Prefetcher:
+    """Background cache warming for one session's current project selection"""
+
+    def __init__(self, stories: int = PREFETCH_STORIES, pool: Optional[ThreadPoolExecutor] = None):
+        self.stories = stories
+        self._pool = pool or _pool
+        self._lock = threading.Lock()
+        self._selection: Optional[Tuple[str, str]] = None
+        self._generation = 0
+        self._futures: List[Future] = []
+
+    @property
+    def selection(self) -> Optional[Tuple[str, str]]:
+        return self._selection
+
+    def select(self, workspace_id: str, project_id: str) -> bool:
+        """
+        Start warming the caches for a project, cancelling the previous selection.
+
+        Returns False when the project is already the current selection.
+        """
+        selection = (str(workspace_id), str(project_id))
+        with self._lock:
+            if selection == self._selection:
+                return False
+            self._cancel()
+            self._selection = selection
+            generation = self._generation
+            _count("selections")
+            self._submit(generation, cache.get_project_rca_summary, *selection)
+            self._submit(generation, self._warm_stories, generation, *selection)
+        return True
+
+    def cancel(self) -> None:
+        """Drop the current selection and its prefetches that have not started"""
+        with self._lock:
+            self._cancel()
+            self._selection = None
+
+    def _cancel(self) -> None:
+        self._generation += 1
+        cancelled = sum(1 for future in self._futures if future.cancel())
+        if cancelled:
+            _count("cancelled", cancelled)
+        self._futures = []
+
+    def _submit(self, generation: int, func: Callable, *args) -> None:
+        # Called with self._lock held
+        self._futures = [future for future in self._futures if not future.done()]
+        self._futures.append(self._pool.submit(self._run, generation, func, *args))
+
+    def _run(self, generation: int, func: Callable, *args) -> Any:
+        if generation != self._generation:
+            # Superseded after being queued but before cancel() reached it
+            _count("cancelled")
+            return None
+        try:
+            result = RALLY_BUDGET.run(func, *args)
+        except Exception as e:
+            print(f"Prefetch of {getattr(func, '__name__', func)}{args} failed: {str(e)}")
+            _count("failed")
+            return None
+        _count("fetched")
+        return result
+
+    def _warm_stories(self, generation: int, workspace_id: str, project_id: str) -> None:
+        # Stories come newest first, so the first window is the most recent ones
+        stories = lazy_user_stories(workspace_id, project_id).window(0, self.stories) if self.stories else []
+        with self._lock:
+            if generation != self._generation:
+                return
+            for story in stories:
+                self._submit(generation, cache.get_user_story_test_summary,
+                             workspace_id, project_id, story["formatted_id"])
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the current selection's prefetches are done; False on timeout"""
+        while True:
+            with self._lock:
+                pending = [future for future in self._futures if not future.done()]
+            if not pending:
+                return True
+            if wait(pending, timeout).not_done:
+                return False
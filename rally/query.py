@@ -0,0 +1,118 @@
+"""
+Declarative field projections for Rally queries.
+
+Every consumer of Rally data declares the attributes it reads as a
+``Projection``; the ``fetch`` parameter sent to Rally is computed from those
+declarations rather than written by hand, so each field is requested once and
+only if something reads it. ``Projection.audit`` runs a consumer over sample
+records and reports requested fields it never touched, which keeps the
+declarations honest as consumers change.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Set, Union
+
+from rally.records import Defect, TestCase
+
+
+class Projection:
+    """The set of attributes one consumer reads from one Rally artifact type"""
+
+    def __init__(self, artifact: str, fields: Iterable[str], name: str = ""):
+        self.artifact = artifact
+        self.fields = _dedupe(fields)
+        self.name = name or artifact
+
+    @property
+    def fetch(self) -> str:
+        """The minimal ``fetch`` parameter for this projection"""
+        return ",".join(self.fields)
+
+    def __add__(self, other: "Projection") -> "Projection":
+        if other.artifact != self.artifact:
+            raise ValueError(f"Cannot combine {self.artifact} and {other.artifact} projections")
+        return Projection(self.artifact, self.fields + other.fields, f"{self.name}+{other.name}")
+
+    def audit(self, consume: Callable[[Dict[str, Any]], Any],
+              samples: Iterable[Dict[str, Any]]) -> List[str]:
+        """
+        Return fields this projection requests that ``consume`` never reads.
+
+        ``consume`` is called with each sample (a Rally JSON object) wrapped so
+        that key lookups are recorded.
+        """
+        read: Set[str] = set()
+        for sample in samples:
+            consume(_TrackingDict(sample, read))
+        return [field for field in self.fields if field not in read]
+
+    def assert_minimal(self, consume: Callable[[Dict[str, Any]], Any],
+                       samples: Iterable[Dict[str, Any]]) -> None:
+        """Raise ``AssertionError`` if the projection requests unread fields"""
+        unused = self.audit(consume, samples)
+        if unused:
+            raise AssertionError(f"{self.name} fetches fields it never reads: {', '.join(unused)}")
+
+    def __repr__(self) -> str:
+        return f"Projection({self.artifact!r}, {self.fetch!r})"
+
+
+class _TrackingDict(dict):
+    """dict that records which keys were looked up"""
+
+    def __init__(self, data: Dict[str, Any], read: Set[str]):
+        super().__init__(data)
+        self._read = read
+
+    def __getitem__(self, key):
+        self._read.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._read.add(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._read.add(key)
+        return super().__contains__(key)
+
+
+def _dedupe(fields: Iterable[str]) -> tuple:
+    seen: Dict[str, None] = {}
+    for field in fields:
+        for part in field.split(","):
+            part = part.strip()
+            if part:
+                seen.setdefault(part, None)
+    return tuple(seen)
+
+
+def plan_fetch(*parts: Union[Projection, Sequence[str], str]) -> str:
+    """Merge projections or field lists into one deduplicated ``fetch`` string"""
+    fields: List[str] = []
+    for part in parts:
+        if isinstance(part, Projection):
+            fields.extend(part.fields)
+        elif isinstance(part, str):
+            fields.append(part)
+        else:
+            fields.extend(part)
+    return ",".join(_dedupe(fields))
+
+
+# Projections used by the fetchers in utils.py and rally_test.py
+WORKSPACE_LIST = Projection("workspace", ("Name", "ObjectID"), "workspace list")
+PROJECT_LIST = Projection("project", ("Name", "ObjectID"), "project list")
+STORY_LIST = Projection("hierarchicalrequirement", ("FormattedID", "Name", "Description"), "story list")
+STORY_REF = Projection("hierarchicalrequirement", ("ObjectID",), "story ref")
+STORY_TEST_CASES = Projection("testcase", TestCase.RALLY_FIELDS, "story test cases")
+PROJECT_DEFECTS = Projection("defect", Defect.RALLY_FIELDS, "project defects")
+TEST_CASE_LOOKUP = Projection("testcase", ("ObjectID",), "test case lookup")
+TEST_CASE_SUMMARY = Projection(
+    "testcase", ("FormattedID", "Name", "Priority", "LastVerdict", "Method"), "test case summary")
+TEST_CASE_HISTORY = Projection(
+    "testcaseresult", ("Build", "Date", "Verdict", "WorkProduct", "Tester"), "test case history")
+
+# Full-text search sync (index.fulltext)
+SEARCH_FIELDS = ("ObjectID", "FormattedID", "Name", "Description", "LastUpdateDate")
+STORY_SEARCH = Projection("hierarchicalrequirement", SEARCH_FIELDS, "story search sync")
+TEST_CASE_SEARCH = Projection("testcase", SEARCH_FIELDS, "test case search sync")
+DEFECT_SEARCH = Projection("defect", SEARCH_FIELDS, "defect search sync")
@@ -0,0 +1,196 @@
+"""
+Compact record types for Rally test cases, test case results and defects.
+
+Records are ``NamedTuple`` instances, which store their fields inline instead
+of in a per-object dict, and low-cardinality fields (verdict, severity,
+priority, state, owner, build) are interned through a ``Vocabulary`` so every
+record shares one string object per distinct value. Each record type lists the
+Rally attributes it reads in ``RALLY_FIELDS`` and is built directly from the
+Rally JSON with ``from_rally``.
+"""
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+
+class Vocabulary:
+    """
+    Enum-like set of string values that grows as new values are seen.
+
+    Rally lets each subscription customise severity, priority and state values,
+    so a closed ``Enum`` would reject real data. A vocabulary instead interns
+    every value it meets and assigns it a small integer code, which the array
+    based aggregations use in place of the string.
+    """
+
+    def __init__(self, name: str, known: Iterable[str] = ()):
+        self.name = name
+        self._codes: Dict[str, int] = {}
+        self._values: List[str] = []
+        self._lock = threading.Lock()
+        for value in known:
+            self.code(value)
+
+    def code(self, value: str) -> int:
+        """Return the integer code for ``value``, registering it if new"""
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self._values)
+                    self._values.append(sys.intern(value))
+                    self._codes[self._values[code]] = code
+        return code
+
+    def intern(self, value: Any, default: str) -> str:
+        """Return the shared string instance for ``value`` (``default`` if empty)"""
+        if value is None or value == "":
+            value = default
+        return self._values[self.code(str(value))]
+
+    def value(self, code: int) -> str:
+        return self._values[code]
+
+    @property
+    def values(self) -> List[str]:
+        return list(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"Vocabulary({self.name!r}, {len(self._values)} values)"
+
+
+VERDICT = Vocabulary("Verdict", ("Pass", "Fail", "Blocked", "Error", "Inconclusive", "No Run"))
+# Rally's stock defect values; subscriptions may add more, which the
+# vocabularies below pick up as defects are parsed
+STOCK_SEVERITIES = ("None", "Crash/Data Loss", "Major Problem", "Minor Problem", "Cosmetic")
+STOCK_PRIORITIES = ("None", "Resolve Immediately", "High Attention", "Normal", "Low")
+STOCK_STATES = ("None", "Submitted", "Open", "Fixed", "Closed")
+
+SEVERITY = Vocabulary("Severity", STOCK_SEVERITIES)
+PRIORITY = Vocabulary("Priority", STOCK_PRIORITIES)
+STATE = Vocabulary("State", STOCK_STATES)
+ROOT_CAUSE = Vocabulary("RootCause", ("Unspecified",))
+OWNER = Vocabulary("Owner", ("Unassigned",))
+BUILD = Vocabulary("Build", ("Unknown", "N/A"))
+
+
+def _ref_name(value: Any) -> Optional[str]:
+    """Return ``_refObjectName`` from a Rally object reference, if present"""
+    if isinstance(value, dict):
+        return value.get("_refObjectName")
+    return None
+
+
+class TestCase(NamedTuple):
+    """Latest state of a Rally TestCase as shown on the story test views"""
+    test_case_id: str
+    test_case_name: str
+    tcr_id: Any
+    date_time: str
+    verdict: str
+    last_build: str
+    duration: Any
+    owner: str
+
+    RALLY_FIELDS = ("FormattedID", "Name", "ObjectID", "LastRun", "LastVerdict",
+                    "LastBuild", "Duration", "Owner")
+
+    @classmethod
+    def from_rally(cls, obj: Dict[str, Any]) -> "TestCase":
+        return cls(
+            test_case_id=obj.get("FormattedID"),
+            test_case_name=obj.get("Name", "Unnamed Test"),
+            tcr_id=obj.get("ObjectID", "N/A"),
+            date_time=obj.get("LastRun") or "N/A",
+            verdict=VERDICT.intern(obj.get("LastVerdict"), "No Run"),
+            last_build=BUILD.intern(obj.get("LastBuild"), "Unknown"),
+            duration=obj.get("Duration", "N/A"),
+            owner=OWNER.intern(_ref_name(obj.get("Owner")), "Unassigned"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the dict layout previously produced by ``get_user_story_test_data``"""
+        return {
+            "test_case_id": self.test_case_id,
+            "test_case_name": self.test_case_name,
+            "tcr_id": self.tcr_id,
+            "date_time": self.date_time,
+            "verdict": self.verdict,
+            "LastBuild": self.last_build,
+            "Duration": self.duration,
+            "Owner": self.owner,
+        }
+
+
+class TestCaseResult(NamedTuple):
+    """One execution of a test case (a Rally TestCaseResult)"""
+    test_case_id: str
+    build: str
+    date: str
+    verdict: str
+    work_product: str
+    tester: str
+    test_case_name: str = ""
+
+    RALLY_FIELDS = ("Build", "Date", "Verdict", "TestCase", "WorkProduct", "Tester")
+
+    @classmethod
+    def from_rally(cls, obj: Dict[str, Any], test_case_id: Optional[str] = None,
+                   test_case_name: str = "") -> "TestCaseResult":
+        if test_case_id is None:
+            test_case = obj.get("TestCase") or {}
+            test_case_id = test_case.get("FormattedID") or _ref_name(test_case) or "Unknown"
+        return cls(
+            test_case_id=test_case_id,
+            build=BUILD.intern(obj.get("Build"), "N/A"),
+            date=obj.get("Date") or "N/A",
+            verdict=VERDICT.intern(obj.get("Verdict"), "N/A"),
+            work_product=sys.intern(_ref_name(obj.get("WorkProduct")) or "N/A"),
+            tester=OWNER.intern(_ref_name(obj.get("Tester")), "N/A"),
+            test_case_name=test_case_name,
+        )
+
+
+class Defect(NamedTuple):
+    """A Rally Defect with the attributes used for root cause analysis"""
+    name: str
+    root_cause: str
+    severity: str
+    priority: str
+    state: str
+    creation_date: str
+    object_id: Any = None
+
+    RALLY_FIELDS = ("ObjectID", "Name", "State", "Priority", "Severity",
+                    "c_RCARootCauseUS", "CreationDate")
+
+    @classmethod
+    def from_rally(cls, obj: Dict[str, Any]) -> "Defect":
+        return cls(
+            name=obj.get("Name", "Unnamed Defect"),
+            root_cause=ROOT_CAUSE.intern(obj.get("c_RCARootCauseUS"), "Unspecified"),
+            severity=SEVERITY.intern(obj.get("Severity"), "None"),
+            priority=PRIORITY.intern(obj.get("Priority"), "None"),
+            state=STATE.intern(obj.get("State"), "None"),
+            creation_date=(obj.get("CreationDate") or "").split("T")[0],
+            object_id=obj.get("ObjectID"),
+        )
+
+    @property
+    def month(self) -> str:
+        return self.creation_date[:7]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the dict layout previously produced by ``get_project_rca_data``"""
+        return {
+            "name": self.name,
+            "root_cause": self.root_cause,
+            "severity": self.severity,
+            "priority": self.priority,
+            "state": self.state,
+            "creation_date": self.creation_date,
+        }
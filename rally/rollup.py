@@ -0,0 +1,204 @@
+"""
+Rollup cube over defects for root cause analysis.
+
+Each defect is counted in one cell of a dense ``int32`` array whose axes are
+(root cause, severity, priority, state, month, project). Dimension values are
+dictionary-encoded to axis positions, and an axis grows when a new value shows
+up, so the cube can be updated one defect at a time as new data syncs in.
+
+Any slice (filter on some dimensions) and dice (group by others) is an
+``np.take`` per filtered axis followed by a ``sum`` over the remaining ones.
+The arrays stay small: a project with 10 root causes, the stock severity,
+priority and state values and five years of months is about 130k cells
+(0.5 MB), and queries run in tens to a few hundred microseconds.
+"""
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from rally.records import Defect
+
+DIMENSIONS = ("root_cause", "severity", "priority", "state", "month", "project")
+
+
+class _Encoder:
+    """Dictionary encoding of one dimension's values"""
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self):
+        self.codes: Dict[Any, int] = {}
+        self.values: List[Any] = []
+
+    def encode(self, value: Any) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class DefectCube:
+    """Dense count cube over defect dimensions; see the module docstring"""
+
+    def __init__(self, dimensions: Sequence[str] = DIMENSIONS):
+        self.dimensions = tuple(dimensions)
+        self._axis = {name: i for i, name in enumerate(self.dimensions)}
+        self._encoders = [_Encoder() for _ in self.dimensions]
+        self._counts = np.zeros((0,) * len(self.dimensions), dtype=np.int32)
+        self._lock = threading.Lock()
+
+    # -- building ---------------------------------------------------------
+
+    def _coordinates(self, defect: Defect, project: Any) -> Dict[str, Any]:
+        return {
+            "root_cause": defect.root_cause,
+            "severity": defect.severity,
+            "priority": defect.priority,
+            "state": defect.state,
+            "month": defect.month,
+            "project": project,
+        }
+
+    def _encode(self, coordinates: Dict[str, Any]) -> tuple:
+        return tuple(encoder.encode(coordinates.get(dim))
+                     for dim, encoder in zip(self.dimensions, self._encoders))
+
+    def _grow(self) -> None:
+        """Extend any axis that gained values since the array was last sized"""
+        shape = tuple(len(encoder.values) for encoder in self._encoders)
+        if shape != self._counts.shape:
+            self._counts = np.pad(self._counts, [(0, new - old) for new, old
+                                                 in zip(shape, self._counts.shape)])
+
+    def add_cell(self, coordinates: Dict[str, Any], count: int = 1) -> None:
+        """Add ``count`` (may be negative) to the cell at ``coordinates``"""
+        with self._lock:
+            key = self._encode(coordinates)
+            self._grow()
+            self._counts[key] += count
+
+    def add(self, defect: Defect, project: Any = None, count: int = 1) -> None:
+        """Count one defect; ``count=-1`` retracts it"""
+        self.add_cell(self._coordinates(defect, project), count)
+
+    def remove(self, defect: Defect, project: Any = None) -> None:
+        self.add(defect, project, -1)
+
+    def update(self, old: Optional[Defect], new: Optional[Defect], project: Any = None) -> None:
+        """Replace ``old`` with ``new``; either may be None for a create or delete"""
+        if old is not None:
+            self.remove(old, project)
+        if new is not None:
+            self.add(new, project)
+
+    def extend(self, defects: Iterable[Defect], project: Any = None) -> "DefectCube":
+        """Count many defects, resizing the array once rather than per new value"""
+        with self._lock:
+            keys = [self._encode(self._coordinates(defect, project)) for defect in defects]
+            self._grow()
+            if keys:
+                np.add.at(self._counts, tuple(np.array(keys, dtype=np.intp).T), 1)
+        return self
+
+    def merge(self, other: "DefectCube") -> "DefectCube":
+        """Add every count of ``other`` into this cube (associative and commutative)"""
+        if other.dimensions != self.dimensions:
+            raise ValueError("Cannot merge cubes with different dimensions")
+        with other._lock:
+            other_values = [list(encoder.values) for encoder in other._encoders]
+            other_counts = other._counts.copy()
+        with self._lock:
+            # Map each of other's axis positions to ours; the maps are injective
+            maps = [np.array([encoder.encode(value) for value in values], dtype=np.intp)
+                    for encoder, values in zip(self._encoders, other_values)]
+            self._grow()
+            if other_counts.size:
+                self._counts[np.ix_(*maps)] += other_counts
+        return self
+
+    # -- querying ---------------------------------------------------------
+
+    def values(self, dimension: str) -> List[Any]:
+        """Every value seen for ``dimension``, in first-seen order"""
+        return list(self._encoders[self._axis[dimension]].values)
+
+    def _slice(self, where: Dict[str, Any]) -> tuple:
+        """Return (sub-array, per-axis value lists) after applying filters"""
+        counts = self._counts
+        axis_values = [encoder.values for encoder in self._encoders]
+        for dim, wanted in where.items():
+            axis = self._axis[dim]
+            if isinstance(wanted, (str, int)) or wanted is None:
+                wanted = [wanted]
+            encoder = self._encoders[axis]
+            kept = [v for v in wanted if v in encoder.codes]
+            counts = np.take(counts, [encoder.codes[v] for v in kept], axis=axis)
+            axis_values[axis] = kept
+        return counts, axis_values
+
+    def total(self, **where: Any) -> int:
+        """Number of defects matching the filters, e.g. ``total(severity="Cosmetic")``"""
+        with self._lock:
+            counts, _ = self._slice(where)
+            return int(counts.sum())
+
+    def rollup(self, by: Union[str, Sequence[str]], **where: Any) -> Dict[Any, int]:
+        """
+        Count defects grouped by ``by`` after filtering on ``where``.
+
+        ``where`` values may be a single value or a list of accepted values.
+        Keys are plain values when grouping by one dimension and tuples
+        otherwise; groups whose count is zero are omitted.
+        """
+        single = isinstance(by, str)
+        by = (by,) if single else tuple(by)
+        axes = [self._axis[dim] for dim in by]
+        with self._lock:
+            counts, axis_values = self._slice(where)
+            other_axes = tuple(i for i in range(len(self.dimensions)) if i not in axes)
+            grouped = counts.sum(axis=other_axes, dtype=np.int64)
+            # sum() keeps the remaining axes in dimension order; reorder to ``by``
+            grouped = np.transpose(grouped, np.argsort(np.argsort(axes)))
+            labels = [axis_values[axis] for axis in axes]
+
+        positions = np.nonzero(grouped)
+        columns = [[labels[i][p] for p in index.tolist()] for i, index in enumerate(positions)]
+        keys = columns[0] if single else zip(*columns)
+        return dict(zip(keys, grouped[positions].tolist()))
+
+    def nested(self, outer: str, inner: str, **where: Any) -> Dict[Any, Dict[Any, int]]:
+        """Two-level ``{outer: {inner: count}}`` view, e.g. month -> root cause"""
+        result: Dict[Any, Dict[Any, int]] = {}
+        for (outer_value, inner_value), count in self.rollup((outer, inner), **where).items():
+            result.setdefault(outer_value, {})[inner_value] = count
+        return result
+
+    @property
+    def shape(self) -> Dict[str, int]:
+        return dict(zip(self.dimensions, self._counts.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self._counts.nbytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def rca_summaries(cube: DefectCube) -> Dict[str, Any]:
+    """The summary views returned by ``get_project_rca_data``, read from ``cube``"""
+    return {
+        "rca_summary": cube.rollup("root_cause"),
+        "monthly_trend": cube.nested("month", "root_cause"),
+        "severity_distribution": cube.rollup("severity"),
+        "priority_distribution": cube.rollup("priority"),
+        "state_distribution": cube.rollup("state"),
+    }
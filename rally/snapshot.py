@@ -0,0 +1,192 @@
+"""
+Parquet / Arrow snapshots of fetched Rally data for offline analysis.
+
+Test cases, test case results and defects are written as hive-partitioned
+datasets under ``<root>/<dataset>/project=<id>/month=<YYYY-MM>/``. Writing a
+project's data again replaces only the months it contains. Data exported one
+story at a time is written with a ``scope`` (the story), and exporting a
+story again replaces only that story's rows. Loading reads
+through a memory-mapped filesystem and can prune by project and month without
+opening unrelated files.
+
+Parquet files are small and compressed, so reading them decodes into fresh
+buffers. Snapshots written with ``format="arrow"`` (uncompressed Arrow IPC)
+are instead mapped zero-copy: column buffers point straight into the page
+cache, and only the pages that are touched are read from disk.
+"""
+import glob
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Type
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from rally.records import Defect, TestCase, TestCaseResult
+from rally.rollup import DefectCube
+
+SNAPSHOT_DIR = os.getenv("RALLY_SNAPSHOT_DIR", "")
+
+# Partition value for records without a usable date
+UNDATED = "undated"
+
+_string = pa.string()
+_label = pa.dictionary(pa.int32(), pa.string())
+
+# dataset -> (record type, field holding its date, Arrow schema of the record fields).
+# Low-cardinality fields are dictionary-encoded; Rally's loosely typed ObjectID
+# and Duration values are stored as strings.
+DATASETS: Dict[str, tuple] = {
+    "test_cases": (TestCase, "date_time", pa.schema([
+        ("test_case_id", _string), ("test_case_name", _string), ("tcr_id", _string),
+        ("date_time", _string), ("verdict", _label), ("last_build", _label),
+        ("duration", _string), ("owner", _label),
+    ])),
+    "results": (TestCaseResult, "date", pa.schema([
+        ("test_case_id", _string), ("build", _label), ("date", _string), ("verdict", _label),
+        ("work_product", _label), ("tester", _label), ("test_case_name", _string),
+    ])),
+    "defects": (Defect, "creation_date", pa.schema([
+        ("name", _string), ("root_cause", _label), ("severity", _label), ("priority", _label),
+        ("state", _label), ("creation_date", _string), ("object_id", _string),
+    ])),
+}
+
+_PARTITIONING = ds.partitioning(pa.schema([("project", _string), ("month", _string)]), flavor="hive")
+_FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+
+
+def _month(date: Any) -> str:
+    date = str(date or "")
+    return date[:7] if date[:4].isdigit() else UNDATED
+
+
+def _column(values: Sequence[Any], field: pa.Field) -> pa.Array:
+    if field.type == _string:
+        values = [None if v is None else str(v) for v in values]
+    return pa.array(values, type=field.type)
+
+
+def records_table(dataset: str, records: Sequence[Any], project: Any) -> pa.Table:
+    """Convert records to an Arrow table with ``project`` and ``month`` columns"""
+    record_type, date_field, schema = DATASETS[dataset]
+    columns = list(zip(*records)) if records else [()] * len(record_type._fields)
+    arrays = [_column(values, field) for values, field in zip(columns, schema)]
+    dates = columns[record_type._fields.index(date_field)]
+    arrays.append(pa.array([str(project)] * len(records), type=_string))
+    arrays.append(pa.array([_month(d) for d in dates], type=_string))
+    return pa.Table.from_arrays(arrays, schema=schema.append(pa.field("project", _string))
+                                                   .append(pa.field("month", _string)))
+
+
+def _scope_token(scope: Any) -> str:
+    return re.sub(r"[^\w.-]", "_", str(scope))
+
+
+def export_snapshot(root: str, dataset: str, records: Sequence[Any], project: Any,
+                    format: str = "parquet", scope: Any = None) -> int:
+    """
+    Write ``records`` (of the dataset's record type) for one project.
+
+    Without ``scope``, months present in ``records`` replace what was
+    previously written for this project; other months and projects are left
+    alone. With ``scope`` (e.g. a story id), the records replace only those
+    previously written with the same scope, in every month of the project,
+    and rows of other scopes in the same partitions are kept. Returns the
+    number of rows written.
+    """
+    extension = "parquet" if format == "parquet" else "arrow"
+    path = os.path.join(root, dataset)
+    if scope is not None:
+        token = _scope_token(scope)
+        project_dir = os.path.join(path, f"project={project}")
+        pattern = os.path.join(glob.escape(project_dir), "*", f"{glob.escape(token)}-part-*.{extension}")
+        for stale in glob.glob(pattern):
+            os.remove(stale)
+    if not records:
+        return 0
+    table = records_table(dataset, records, project)
+    if scope is None:
+        behaviour, basename = "delete_matching", "part-{i}." + extension
+    else:
+        behaviour, basename = "overwrite_or_ignore", f"{token}-part-{{i}}.{extension}"
+    ds.write_dataset(
+        table, path, format=_FORMATS[format], partitioning=_PARTITIONING,
+        existing_data_behavior=behaviour, basename_template=basename,
+    )
+    return len(records)
+
+
+def export_test_data(root: str, test_data: Dict[str, Any], project: Any, story: Any, **kwargs) -> int:
+    """Snapshot the test cases of a ``get_user_story_test_data`` result, replacing only ``story``'s"""
+    return export_snapshot(root, "test_cases", test_data.get("test_cases") or [], project, scope=story,
+                           **kwargs)
+
+
+def export_rca_data(root: str, rca_data: Dict[str, Any], project: Any, **kwargs) -> int:
+    """Snapshot the defects of a ``get_project_rca_data`` result"""
+    return export_snapshot(root, "defects", rca_data.get("defects") or [], project, **kwargs)
+
+
+def open_snapshot(root: str, dataset: str, format: str = "parquet") -> Optional[ds.Dataset]:
+    """Open a snapshot dataset on a memory-mapped filesystem, or None if none was written"""
+    path = os.path.join(root, dataset)
+    if not os.path.isdir(path):
+        return None
+    return ds.dataset(path, format=_FORMATS[format], partitioning=_PARTITIONING,
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def load_snapshot(root: str, dataset: str, projects: Optional[Iterable[Any]] = None,
+                  months: Optional[Iterable[str]] = None, columns: Optional[List[str]] = None,
+                  format: str = "parquet") -> pa.Table:
+    """
+    Read a snapshot as an Arrow table, pruned to ``projects`` and ``months``.
+
+    Only the partitions matching the filters are opened, and only ``columns``
+    are read when given.
+    """
+    snapshot = open_snapshot(root, dataset, format)
+    if snapshot is None:
+        _, _, schema = DATASETS[dataset]
+        return schema.empty_table()
+    condition = None
+    for name, wanted in (("project", projects), ("month", months)):
+        if wanted is not None:
+            clause = ds.field(name).isin([str(v) for v in wanted])
+            condition = clause if condition is None else condition & clause
+    return snapshot.to_table(columns=columns, filter=condition)
+
+
+def load_frame(root: str, dataset: str, **kwargs) -> pd.DataFrame:
+    """Like ``load_snapshot`` but as a DataFrame; label columns become categoricals"""
+    return load_snapshot(root, dataset, **kwargs).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def load_records(root: str, dataset: str, **kwargs) -> List[Any]:
+    """Like ``load_snapshot`` but as record objects, for the record-based chart helpers"""
+    record_type: Type = DATASETS[dataset][0]
+    table = load_snapshot(root, dataset, columns=list(record_type._fields), **kwargs)
+    return [record_type(*row) for row in zip(*(column.to_pylist() for column in table.columns))]
+
+
+def load_defect_cube(root: str, projects: Optional[Iterable[Any]] = None,
+                     months: Optional[Iterable[str]] = None, format: str = "parquet") -> DefectCube:
+    """
+    Build the RCA rollup cube from a defect snapshot without materialising defects.
+
+    Rows are counted per cell with an Arrow group-by and each distinct cell
+    is added once, so the cost follows the number of cells, not defects.
+    """
+    dimensions = ["root_cause", "severity", "priority", "state", "month", "project"]
+    table = load_snapshot(root, "defects", projects, months, columns=dimensions, format=format)
+    cube = DefectCube()
+    if table.num_rows:
+        cells = table.group_by(dimensions).aggregate([([], "count_all")])
+        for row in cells.to_pylist():
+            if row["month"] == UNDATED:
+                row["month"] = ""  # Defect.month of an undated defect
+            cube.add_cell(row, row.pop("count_all"))
+    return cube
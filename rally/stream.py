@@ -0,0 +1,214 @@
+"""
+Incremental parsing of Rally WSAPI query pages.
+
+``response.json()`` builds the whole ``QueryResult`` (every result with every
+nested reference object) before any of it can be used. ``QueryStream`` reads
+the body in chunks instead, decodes one element of ``Results`` at a time,
+keeps only the requested fields and drops the rest, so at most one raw result
+is alive at any moment. ``iter_query`` chains pages together for callers that
+aggregate as records arrive, optionally fetching the next page in the
+background. A page that fails raises ``QueryError`` rather than ending the
+results early, so a caller never mistakes a partial result for all of it.
+"""
+import codecs
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+
+_RESULTS_START = re.compile(r'"Results"\s*:\s*\[')
+_HEADER_KEYS = ("Errors", "Warnings", "TotalResultCount", "StartIndex", "PageSize")
+_decoder = json.JSONDecoder()
+
+
+class QueryError(Exception):
+    """A Rally query page failed (HTTP error or WSAPI ``Errors``); the results so far are incomplete"""
+
+
+def project(obj: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """Return only ``fields`` of ``obj`` (all of it if ``fields`` is None)"""
+    if fields is None:
+        return obj
+    return {field: obj[field] for field in fields if field in obj}
+
+
+def _read_header(text: str, header: Dict[str, Any]) -> None:
+    """Pick the scalar QueryResult keys out of the text around ``Results``"""
+    for key in _HEADER_KEYS:
+        if key in header:
+            continue
+        match = re.search(rf'"{key}"\s*:\s*', text)
+        if match:
+            try:
+                header[key] = _decoder.raw_decode(text, match.end())[0]
+            except json.JSONDecodeError:
+                pass
+
+
+class QueryStream:
+    """
+    Iterate over the ``Results`` of one Rally query page without loading it whole.
+
+    ``total_result_count`` and ``errors`` are available once iteration has
+    started (Rally writes them ahead of ``Results``) and are re-checked after
+    the array in case a server orders them differently.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], fields: Optional[Sequence[str]] = None):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder("utf-8")()
+        self.fields = fields
+        self.header: Dict[str, Any] = {}
+        self.count = 0
+
+    @classmethod
+    def from_response(cls, response: requests.Response, fields: Optional[Sequence[str]] = None,
+                      chunk_size: int = 64 * 1024) -> "QueryStream":
+        return cls(response.iter_content(chunk_size=chunk_size), fields)
+
+    @property
+    def total_result_count(self) -> int:
+        return self.header.get("TotalResultCount", 0)
+
+    @property
+    def errors(self) -> List[str]:
+        return self.header.get("Errors", [])
+
+    def _more(self) -> Optional[str]:
+        for chunk in self._chunks:
+            text = self._decode.decode(chunk)
+            if text:
+                return text
+        return None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        buffer = ""
+        # Header: everything up to the opening bracket of Results
+        while True:
+            match = _RESULTS_START.search(buffer)
+            if match:
+                break
+            more = self._more()
+            if more is None:
+                _read_header(buffer, self.header)
+                return
+            buffer += more
+        _read_header(buffer[:match.start()], self.header)
+        buffer = buffer[match.end():]
+        pos = 0
+
+        while True:
+            # Skip separators between elements
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                more = self._more()
+                if more is None:
+                    raise ValueError("Rally response ended inside Results")
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            if buffer[pos] == "]":
+                break
+            try:
+                obj, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = self._more()
+                if more is None:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            pos = end
+            if pos > 64 * 1024:
+                buffer, pos = buffer[pos:], 0
+            self.count += 1
+            yield project(obj, self.fields)
+
+        # Trailer, in case the header keys follow Results
+        rest = buffer[pos + 1:]
+        more = self._more()
+        while more is not None:
+            rest += more
+            more = self._more()
+        _read_header(rest, self.header)
+
+
+def _fetch_page(session: requests.Session, url: str, params: Dict[str, Any],
+                fields: Optional[Sequence[str]]) -> Tuple[Optional[List[Dict[str, Any]]], Dict[str, Any]]:
+    """One whole page as (results, header)"""
+    with session.get(url, params=params, stream=True) as response:
+        _check_status(url, response)
+        page = QueryStream.from_response(response, fields)
+        return list(page), page.header
+
+
+def _check_status(url: str, response: requests.Response) -> None:
+    if response.status_code != 200:
+        raise QueryError(f"Error fetching {url}: HTTP {response.status_code}: {response.text[:500]}")
+
+
+def _iter_prefetched(session: requests.Session, url: str, params: Dict[str, Any],
+                     fields: Optional[Sequence[str]], page_size: int, start: int,
+                     limit: Optional[int]) -> Iterator[Dict[str, Any]]:
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rally-prefetch")
+    try:
+        future = pool.submit(_fetch_page, session, url, dict(params, pagesize=page_size, start=start), fields)
+        yielded = 0
+        while future is not None:
+            results, header = future.result()
+            if header.get("Errors"):
+                raise QueryError(f"Rally returned errors for {url}: {header['Errors']}")
+            next_start = start + len(results)
+            more = results and next_start <= header.get("TotalResultCount", 0)
+            if more and (limit is None or yielded + len(results) < limit):
+                # Request the next page before handing out this one
+                future = pool.submit(_fetch_page, session, url,
+                                     dict(params, pagesize=page_size, start=next_start), fields)
+            else:
+                future = None
+            for obj in results:
+                yield obj
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+            start = next_start
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_query(session: requests.Session, url: str, params: Dict[str, Any],
+               fields: Optional[Sequence[str]] = None, page_size: int = 200,
+               start: int = 1, limit: Optional[int] = None,
+               prefetch: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Stream every result of a Rally query across pages.
+
+    Pages are requested with ``stream=True`` and parsed with ``QueryStream``.
+    Iteration stops at the end of the data or after ``limit`` results. A
+    failed page raises ``QueryError`` after the results of earlier pages
+    have been yielded.
+
+    With ``prefetch``, the next page is requested on a background thread as
+    soon as a page arrives, so the caller's work on one page overlaps the
+    round trip for the next. Pages are then held whole, one at a time.
+    """
+    if prefetch:
+        yield from _iter_prefetched(session, url, params, fields, page_size, start, limit)
+        return
+    yielded = 0
+    while True:
+        page_params = dict(params, pagesize=page_size, start=start)
+        with session.get(url, params=page_params, stream=True) as response:
+            _check_status(url, response)
+            page = QueryStream.from_response(response, fields)
+            for obj in page:
+                yield obj
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+            if page.errors:
+                raise QueryError(f"Rally returned errors for {url}: {page.errors}")
+        if page.count == 0 or start + page.count > page.total_result_count:
+            return
+        start += page.count
@@ -0,0 +1,345 @@
+"""
+Local stand-in for the Rally WSAPI, for load tests, benchmarks and CI.
+
+Serves deterministic synthetic workspaces, projects, stories, test cases,
+test case results and defects under ``/slm/webservice/v2.0/<type>`` with
+Rally's ``QueryResult`` envelope and ``start``/``pagesize`` paging. Queries
+made of ``(Field = value)`` clauses (also ``!=``, ``<``, ``>``, ``<=`` and
+``>=``) joined with AND, including dotted fields like
+``WorkProduct.FormattedID``, are applied, so count queries, story filters
+and incremental syncs behave as they do against Rally, and the ``project``
+parameter scopes results to that project. ``fetch`` is ignored and every
+field is returned. ``POST /<type>/create`` adds an object, and ``POST
+/batch`` runs several creates in one request, so uploads can be exercised
+too. GET responses carry an ETag and Last-Modified, answer
+conditional requests with 304, and are gzip- or deflate-compressed for
+clients that accept it.
+
+Usage:
+    python -m rally.stub --port 8700 [--latency 0.05]
+then set the Rally endpoint to ``http://localhost:8700``.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import operator
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+WSAPI = "/slm/webservice/v2.0"
+
+# Smaller responses are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+_CLAUSE = re.compile(r'\(\s*([\w.]+)\s*(=|!=|>=|<=|>|<)\s*("(?:[^"\\]|\\.)*"|[^()\s]+)\s*\)')
+
+_ORDER_OPS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le}
+
+TYPE_NAMES = {
+    "subscription": "Subscription", "workspace": "Workspace", "project": "Project",
+    "hierarchicalrequirement": "HierarchicalRequirement", "testcase": "TestCase",
+    "testcaseresult": "TestCaseResult", "defect": "Defect",
+}
+
+VERDICTS = ["Pass", "Fail", "Blocked", "Inconclusive", "Pass", "Fail"]
+SEVERITIES = ["Crash/Data Loss", "Major Problem", "Minor Problem", "Cosmetic"]
+PRIORITIES = ["Resolve Immediately", "High Attention", "Normal", "Low"]
+STATES = ["Submitted", "Open", "Fixed", "Closed"]
+ROOT_CAUSES = ["Code", "Requirements", "Environment", "Test Data", "Design"]
+
+
+def _ref(kind: str, object_id: int, name: str, **extra) -> Dict[str, Any]:
+    return dict({"_ref": f"{WSAPI}/{kind}/{object_id}", "_refObjectName": name,
+                 "_type": kind.title()}, **extra)
+
+
+class StubData:
+    """Deterministic synthetic Rally objects"""
+
+    def __init__(self, projects: int = 3, stories: int = 20, test_cases: int = 450,
+                 results_per_case: int = 4, defects: int = 450):
+        self.objects: Dict[str, List[Dict[str, Any]]] = {
+            "subscription": [{"ObjectID": 1, "Name": "Stub subscription"}],
+            "workspace": [{"ObjectID": 1, "Name": "Stub workspace"}],
+        }
+        self.objects["project"] = [
+            {"ObjectID": 100 + p, "Name": f"Project {p}", "Workspace": _ref("workspace", 1, "Stub workspace")}
+            for p in range(projects)
+        ]
+        self.objects["hierarchicalrequirement"] = [
+            {"ObjectID": 1000 + s, "FormattedID": f"US{s + 1}", "Name": f"Story {s + 1}",
+             "Description": f"As a user I want feature {s + 1}",
+             "Project": _ref("project", 100 + s % projects, f"Project {s % projects}"),
+             "CreationDate": f"2024-{1 + s % 12:02d}-01T00:00:00.000Z"}
+            for s in range(stories)
+        ]
+        self.objects["testcase"] = []
+        self.objects["testcaseresult"] = []
+        for t in range(test_cases):
+            story = self.objects["hierarchicalrequirement"][t % stories]
+            case = {
+                "ObjectID": 10_000 + t, "FormattedID": f"TC{t + 1}", "Name": f"Verify case {t + 1}",
+                "LastVerdict": VERDICTS[t % 3], "LastRun": f"2024-{1 + t % 12:02d}-{1 + t % 28:02d}T10:00:00.000Z",
+                "LastBuild": f"build-{t % 30}", "Duration": 1.5, "Priority": PRIORITIES[t % 4],
+                "Method": "Automated" if t % 2 else "Manual",
+                "Owner": _ref("user", 50 + t % 7, f"user{t % 7}@example.com"),
+                "Project": story["Project"],
+                "WorkProduct": _ref("hierarchicalrequirement", story["ObjectID"], story["Name"],
+                                    FormattedID=story["FormattedID"]),
+            }
+            self.objects["testcase"].append(case)
+            for r in range(results_per_case):
+                self.objects["testcaseresult"].append({
+                    "ObjectID": 100_000 + t * results_per_case + r, "Build": f"build-{r}",
+                    "Date": f"2024-{1 + (t + r) % 12:02d}-{1 + r % 28:02d}T10:00:00.000Z",
+                    "Verdict": VERDICTS[(t + r) % len(VERDICTS)],
+                    "TestCase": _ref("testcase", case["ObjectID"], case["Name"],
+                                     FormattedID=case["FormattedID"]),
+                    "WorkProduct": case["WorkProduct"], "Tester": case["Owner"],
+                })
+        self.objects["defect"] = [
+            {"ObjectID": 500_000 + d, "FormattedID": f"DE{d + 1}", "Name": f"Defect {d + 1}",
+             "State": STATES[d % 4], "Priority": PRIORITIES[d % 4], "Severity": SEVERITIES[d % 4],
+             "c_RCARootCauseUS": ROOT_CAUSES[d % 5],
+             "CreationDate": f"2024-{1 + d % 12:02d}-{1 + d % 28:02d}T00:00:00.000Z",
+             "Project": _ref("project", 100 + d % projects, f"Project {d % projects}")}
+            for d in range(defects)
+        ]
+        for kind in ("hierarchicalrequirement", "testcase", "defect"):
+            for obj in self.objects[kind]:
+                obj["LastUpdateDate"] = obj.get("CreationDate") or obj["LastRun"]
+        self._lock = threading.Lock()
+        # Last change to any object, sent as Last-Modified
+        self.modified = time.time()
+
+    def create(self, kind: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Add an object as a create request would, assigning ObjectID and FormattedID"""
+        prefixes = {"hierarchicalrequirement": "US", "testcase": "TC", "defect": "DE"}
+        with self._lock:
+            rows = self.objects.setdefault(kind, [])
+            obj = dict(fields, ObjectID=max((row["ObjectID"] for row in rows), default=0) + 1,
+                       LastUpdateDate=time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()))
+            if kind in prefixes:
+                obj["FormattedID"] = f"{prefixes[kind]}{len(rows) + 1}"
+            for name, value in fields.items():
+                # References are sent as "/project/100"; store them as Rally returns them
+                if isinstance(value, str) and re.fullmatch(r"/?\w+/\d+", value):
+                    ref_kind, ref_id = value.strip("/").split("/")
+                    target = next((row for row in self.objects.get(ref_kind, ())
+                                   if row["ObjectID"] == int(ref_id)), None)
+                    if target is None:
+                        obj[name] = _ref(ref_kind, int(ref_id), value)
+                    else:
+                        extra = {"FormattedID": target["FormattedID"]} if "FormattedID" in target else {}
+                        obj[name] = _ref(ref_kind, int(ref_id), target.get("Name", value), **extra)
+            rows.append(obj)
+            self.modified = time.time()
+            return obj
+
+
+def _resolve(obj: Any, path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(obj, dict):
+            return None
+        if part not in obj and part == "ObjectID" and "_ref" in obj:
+            return obj["_ref"].rsplit("/", 1)[-1]
+        obj = obj.get(part)
+    return obj
+
+
+def _parse_query(query: str) -> List[Tuple[str, str, Optional[str]]]:
+    clauses = []
+    for field, op, value in _CLAUSE.findall(query or ""):
+        if value.startswith('"'):
+            value = json.loads(value)
+        elif value == "null":
+            value = None
+        clauses.append((field, op, value))
+    return clauses
+
+
+def _matches(obj: Dict[str, Any], clauses: List[Tuple[str, str, Optional[str]]]) -> bool:
+    for field, op, value in clauses:
+        actual = _resolve(obj, field)
+        actual = None if actual in (None, "") else str(actual)
+        if op in ("=", "!="):
+            if (actual == value) != (op == "="):
+                return False
+        # Ordering compares as strings, which is right for Rally's ISO dates
+        elif actual is None or value is None or not _ORDER_OPS[op](actual, value):
+            return False
+    return True
+
+
+def _negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """gzip or deflate if the client accepts it (ignoring q-values other than 0)"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        accepted[name.strip().lower()] = params.replace(" ", "") not in ("q=0", "q=0.0")
+    for encoding in ("gzip", "deflate"):
+        if accepted.get(encoding):
+            return encoding
+    return None
+
+
+def make_handler(data: StubData, latency: float = 0.0,
+                 on_request: Optional[Callable[[str, Dict[str, str]], None]] = None):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: Dict[str, Any], conditional: bool = False) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            headers = {"Content-Type": "application/json"}
+            if conditional and status == 200:
+                # Weak, so the gzip and identity encodings share it
+                headers["ETag"] = f'W/"{hashlib.sha1(payload).hexdigest()[:20]}"'
+                headers["Last-Modified"] = formatdate(data.modified, usegmt=True)
+                if self._not_modified(headers["ETag"]):
+                    self.send_response(304)
+                    for name in ("ETag", "Last-Modified"):
+                        self.send_header(name, headers[name])
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            encoding = _negotiate_encoding(self.headers.get("Accept-Encoding", ""))
+            if encoding and len(payload) >= COMPRESS_MIN_BYTES:
+                payload = gzip.compress(payload, 6) if encoding == "gzip" else zlib.compress(payload, 6)
+                headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(payload))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _not_modified(self, etag: str) -> bool:
+            # If-None-Match takes precedence over If-Modified-Since, as in RFC 9110
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None:
+                return etag in (tag.strip() for tag in if_none_match.split(","))
+            if_modified_since = self.headers.get("If-Modified-Since")
+            if if_modified_since:
+                try:
+                    return int(data.modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            if on_request is not None:
+                on_request(url.path, params)
+            if latency:
+                time.sleep(latency)
+            path = url.path[len(WSAPI):].strip("/").lower() if url.path.startswith(WSAPI) else ""
+            kind, _, object_id = path.partition("/")
+            if kind not in data.objects:
+                self._send(404, {"QueryResult": {"Errors": [f"Unknown type {kind!r}"], "Results": []}})
+                return
+            rows = data.objects[kind]
+            if kind == "subscription" or object_id:
+                # Single object read: {"<Type>": {...}}
+                found = rows[0] if not object_id else next(
+                    (row for row in rows if str(row["ObjectID"]) == object_id), None)
+                if found is None:
+                    self._send(404, {"OperationResult": {"Errors": ["Object not found"]}})
+                else:
+                    self._send(200, {TYPE_NAMES[kind]: dict(found, _ref=f"{WSAPI}/{kind}/{found['ObjectID']}")},
+                               conditional=True)
+                return
+            clauses = _parse_query(params.get("query", ""))
+            if params.get("project") and kind != "project":
+                clauses.append(("Project.ObjectID", "=", params["project"].rsplit("/", 1)[-1]))
+            if clauses:
+                rows = [row for row in rows if _matches(row, clauses)]
+            start = max(1, int(params.get("start", 1)))
+            page_size = min(2000, max(1, int(params.get("pagesize", 20))))
+            self._send(200, {"QueryResult": {
+                "Errors": [], "Warnings": [], "TotalResultCount": len(rows),
+                "StartIndex": start, "PageSize": page_size,
+                "Results": rows[start - 1:start - 1 + page_size],
+            }}, conditional=True)
+
+        def do_POST(self):
+            # Creates: POST /<type>/create with {"<Type>": {fields}}, or several at once with
+            # POST /batch and {"Batch": [{"Entry": {"Path": "/<type>/create", "Method": "post", "Body": ...}}]}
+            url = urllib.parse.urlparse(self.path)
+            if on_request is not None:
+                on_request(url.path, {})
+            if latency:
+                time.sleep(latency)
+            path = url.path[len(WSAPI):].strip("/").lower() if url.path.startswith(WSAPI) else ""
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                body = None
+            if path == "batch":
+                entries = body.get("Batch") if isinstance(body, dict) else None
+                if not isinstance(entries, list):
+                    self._send(400, {"BatchResult": {"Errors": ["Body must be {Batch: [...]}"], "Results": []}})
+                    return
+                results = []
+                for entry in entries:
+                    entry = entry.get("Entry", {}) if isinstance(entry, dict) else {}
+                    if str(entry.get("Method", "")).lower() != "post":
+                        results.append({"Errors": ["Only creates are supported"], "Object": None})
+                        continue
+                    results.append(self._create(str(entry.get("Path", "")).strip("/").lower(), entry.get("Body"))[1])
+                self._send(200, {"BatchResult": {"Errors": [], "Warnings": [], "Results": results}})
+                return
+            status, result = self._create(path, body)
+            self._send(status, {"CreateResult": result})
+
+        def _create(self, path: str, body: Any) -> Tuple[int, Dict[str, Any]]:
+            """(HTTP status, CreateResult) of one create"""
+            kind, _, action = path.partition("/")
+            if kind not in TYPE_NAMES or action != "create" or not isinstance(body, dict):
+                return 400, {"Errors": ["Unsupported request"], "Object": None}
+            fields = next(iter(body.values()), None) if len(body) == 1 else None
+            if not isinstance(fields, dict):
+                return 200, {"Errors": ["Body must be {TypeName: {fields}}"], "Object": None}
+            obj = data.create(kind, fields)
+            return 200, {"Errors": [], "Warnings": [],
+                         "Object": dict(obj, _ref=f"{WSAPI}/{kind}/{obj['ObjectID']}")}
+
+    return Handler
+
+
+def serve(port: int = 0, host: str = "127.0.0.1", data: Optional[StubData] = None,
+          latency: float = 0.0, **kwargs) -> ThreadingHTTPServer:
+    """Start the stand-in on a daemon thread; ``server.server_port`` is the bound port"""
+    server = ThreadingHTTPServer((host, port), make_handler(data or StubData(), latency, **kwargs))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="rally-stub", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local Rally WSAPI stand-in")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--test-cases", type=int, default=450)
+    parser.add_argument("--defects", type=int, default=450)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(
+        StubData(test_cases=args.test_cases, defects=args.defects), args.latency))
+    print(f"Rally stand-in on http://{args.host}:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
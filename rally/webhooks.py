@@ -0,0 +1,224 @@
+"""
+Rally webhook receiver that invalidates cached Rally data on change.
+
+Rally posts a message per artifact change (create, update, delete). Each
+message is reduced to a ``ChangeEvent`` and mapped to cache tags (see
+``rally.cache``), so only the story, project or defect entries that the
+change can affect are dropped. Until something changes, dashboards keep
+serving ``get_user_story_test_data`` and ``get_project_rca_data`` from cache.
+
+The receiver must run in the same process as the Streamlit app to reach its
+caches. ``start_receiver`` serves it from a daemon thread, and ``app.py``
+starts it when ``RALLY_WEBHOOK_PORT`` is set. Point the Rally webhook at
+``http://<host>:<port>/rally/webhook?token=<RALLY_WEBHOOK_TOKEN>``.
+
+The receiver listens on 127.0.0.1 unless ``RALLY_WEBHOOK_HOST`` says
+otherwise, e.g. behind a reverse proxy. It refuses any other address
+without a token, since anyone who can reach it could otherwise drop the
+caches. With a token, ``/rally/webhook/stats`` needs it too.
+"""
+import hmac
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from rally import cache
+
+WEBHOOK_TOKEN = os.getenv("RALLY_WEBHOOK_TOKEN", "")
+WEBHOOK_HOST = os.getenv("RALLY_WEBHOOK_HOST", "127.0.0.1")
+
+_LOOPBACK = {"127.0.0.1", "localhost", "::1"}
+
+_OBJECT_ID = re.compile(r"/(\d+)(?:\.js)?/?$")
+_STORY_ID = re.compile(r"\b(US\d+)\b")
+
+
+class ChangeEvent(NamedTuple):
+    """The parts of a Rally webhook message that decide what to invalidate"""
+    object_type: str
+    action: str
+    object_id: Optional[str] = None
+    formatted_id: Optional[str] = None
+    project_id: Optional[str] = None
+    workspace_id: Optional[str] = None
+    story_id: Optional[str] = None
+
+
+def _ref_id(value: Any) -> Optional[str]:
+    """ObjectID from a Rally reference value (dict with ref/_ref, or a URL)"""
+    if isinstance(value, dict):
+        for key in ("_ref", "ref", "detail_link"):
+            found = _ref_id(value.get(key))
+            if found:
+                return found
+        return None
+    if isinstance(value, (int, str)) and str(value).isdigit():
+        return str(value)
+    match = _OBJECT_ID.search(str(value or ""))
+    return match.group(1) if match else None
+
+
+def _story_id(value: Any) -> Optional[str]:
+    """Story FormattedID from a WorkProduct reference value"""
+    if isinstance(value, dict):
+        value = value.get("formatted_id") or value.get("FormattedID") or value.get("name") \
+            or value.get("_refObjectName")
+    match = _STORY_ID.search(str(value or ""))
+    return match.group(1) if match else None
+
+
+def _attributes(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten the message's ``state`` to {attribute name: value}.
+
+    Rally keys ``state`` by attribute UUID with ``{"name", "value"}`` entries;
+    plain {name: value} dicts (as in recorded or hand-written payloads) are
+    accepted as well.
+    """
+    state = message.get("state") or {}
+    flat = {}
+    for key, entry in state.items():
+        if isinstance(entry, dict) and "name" in entry and "value" in entry:
+            flat[entry["name"]] = entry["value"]
+        else:
+            flat[key] = entry
+    return flat
+
+
+def parse_event(payload: Dict[str, Any]) -> ChangeEvent:
+    """Reduce a webhook payload (with or without the ``message`` envelope) to a ChangeEvent"""
+    message = payload.get("message", payload)
+    attributes = _attributes(message)
+    object_type = str(message.get("object_type") or attributes.get("_type") or "")
+    object_id = _ref_id(attributes.get("ObjectID") or message.get("object_id"))
+    formatted_id = attributes.get("FormattedID")
+
+    project_id = _ref_id(attributes.get("Project") or message.get("project_id"))
+    if object_type == "Project":
+        project_id = project_id or object_id
+
+    story_id = None
+    if object_type == "HierarchicalRequirement":
+        story_id = formatted_id
+    elif object_type in ("TestCase", "Defect"):
+        story_id = _story_id(attributes.get("WorkProduct") or attributes.get("Requirement"))
+
+    return ChangeEvent(
+        object_type=object_type,
+        action=str(message.get("action") or "Updated"),
+        object_id=object_id,
+        formatted_id=formatted_id,
+        project_id=project_id,
+        workspace_id=_ref_id(attributes.get("Workspace") or message.get("workspace_id")),
+        story_id=story_id,
+    )
+
+
+def tags_for(event: ChangeEvent) -> List[tuple]:
+    """
+    Cache tags affected by ``event``.
+
+    Tags are scoped to the owning project or story when the message names
+    it, and fall back to the kind-wide tag otherwise.
+    """
+    stories = ("stories", event.project_id) if event.project_id else ("stories",)
+    tests = ("tests", event.project_id) if event.project_id else ("tests",)
+    defects = ("defects", event.project_id) if event.project_id else ("defects",)
+
+    if event.object_type == "HierarchicalRequirement":
+        tags = [stories]
+        tags.append(("story", event.story_id) if event.story_id else tests)
+        return tags
+    if event.object_type == "TestCase":
+        return [("story", event.story_id)] if event.story_id else [tests]
+    if event.object_type == "TestCaseResult":
+        # Results reference their test case, not the story, so the whole project's tests go
+        return [tests]
+    if event.object_type == "Defect":
+        tags = [defects]
+        if event.story_id:
+            tags.append(("story", event.story_id))
+        return tags
+    if event.object_type == "Project":
+        return [("projects", event.workspace_id) if event.workspace_id else ("projects",)]
+    return []
+
+
+_events: Deque[Dict[str, Any]] = deque(maxlen=100)
+_events_lock = threading.Lock()
+_event_count = 0
+
+
+def apply_event(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Invalidate the caches for one webhook payload and return what was done"""
+    global _event_count
+    event = parse_event(payload)
+    tags = tags_for(event)
+    dropped = {name: n for name, n in cache.invalidate_tags(tags).items() if n}
+    record = {"received": time.time(), "event": event._asdict(), "tags": tags, "invalidated": dropped}
+    with _events_lock:
+        _events.append(record)
+        _event_count += 1
+    return record
+
+
+def webhook_stats() -> Dict[str, Any]:
+    """Number of events applied and the most recent ones, newest first"""
+    with _events_lock:
+        return {"events": _event_count, "recent": list(reversed(_events))}
+
+
+def create_app(token: Optional[str] = None) -> Flask:
+    """Flask app accepting Rally webhook POSTs at ``/rally/webhook``"""
+    token = WEBHOOK_TOKEN if token is None else token
+    app = Flask(__name__)
+
+    def authorised() -> bool:
+        return not token or hmac.compare_digest(request.args.get("token", ""), token)
+
+    @app.route("/rally/webhook", methods=["POST"])
+    def receive():
+        if not authorised():
+            return jsonify({"error": "invalid token"}), 403
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "expected a JSON object"}), 400
+        record = apply_event(payload)
+        return jsonify({"tags": [list(tag) for tag in record["tags"]],
+                        "invalidated": record["invalidated"]})
+
+    @app.route("/rally/webhook/stats", methods=["GET"])
+    def stats():
+        # Recent payloads name projects and stories, so they are no more public than the receiver
+        if not authorised():
+            return jsonify({"error": "invalid token"}), 403
+        return jsonify(webhook_stats())
+
+    return app
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_receiver(port: int, host: Optional[str] = None, token: Optional[str] = None):
+    """
+    Serve the receiver from a daemon thread, once per process; returns the server.
+
+    Raises ``ValueError`` for a non-loopback ``host`` without a token.
+    """
+    global _server
+    host = WEBHOOK_HOST if host is None else host
+    if host not in _LOOPBACK and not (WEBHOOK_TOKEN if token is None else token):
+        raise ValueError(f"Refusing to serve Rally webhooks on {host} without RALLY_WEBHOOK_TOKEN")
+    with _server_lock:
+        if _server is None:
+            _server = make_server(host, port, create_app(token), threaded=True)
+            threading.Thread(target=_server.serve_forever, name="rally-webhooks", daemon=True).start()
+        return _server
@@ -3,12 +3,15 @@ import json
 from typing import Dict, Any, List
 import urllib3
 import warnings
-import plotly.graph_objects as go
-from collections import defaultdict
 from datetime import datetime
 import pygwalker as pyg
-import pandas as pd
 import plotly.express as px
+from rally.aggregate import story_test_summary
+from rally.records import TestCaseResult
+from rally.query import TEST_CASE_HISTORY, TEST_CASE_LOOKUP, TEST_CASE_SUMMARY
+from rally.charts import failure_trend_figure, status_figure
+from rally.parallel import aggregate_results
+from rally.snapshot import SNAPSHOT_DIR, export_snapshot, load_frame, load_records
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -120,7 +123,7 @@ def get_test_case_details(workspace_id: str, test_case_id: str) -> Dict[str, Any
         test_case_params = {
             "workspace": f"/workspace/{workspace_id}",
             "query": f"(FormattedID = {test_case_id})",
-            "fetch": "ObjectID,FormattedID,Name"
+            "fetch": TEST_CASE_LOOKUP.fetch
         }
         
         test_case_response = requests.get(
@@ -145,7 +148,7 @@ def get_test_case_details(workspace_id: str, test_case_id: str) -> Dict[str, Any
         results_params = {
             "workspace": f"/workspace/{workspace_id}",
             "query": f"(TestCase.ObjectID = {test_case_oid})",
-            "fetch": "Build,Date,Verdict,TestCase,WorkProduct,Tester",
+            "fetch": TEST_CASE_HISTORY.fetch,
             "pagesize": 100,
             "order": "Date DESC"
         }
@@ -166,14 +169,7 @@ def get_test_case_details(workspace_id: str, test_case_id: str) -> Dict[str, Any
             }
             
             for result in results:
-                result_data = {
-                    "build": result.get('Build', 'N/A'),
-                    "date": result.get('Date', 'N/A'),
-                    "verdict": result.get('Verdict', 'N/A'),
-                    "work_product": (result.get('WorkProduct', {}) or {}).get('_refObjectName', 'N/A'),
-                    "tester": (result.get('Tester', {}) or {}).get('_refObjectName', 'N/A')
-                }
-                test_case_history["results"].append(result_data)
+                test_case_history["results"].append(TestCaseResult.from_rally(result, test_case_id))
             
             if not test_case_history["results"]:
                 print(f"No test results found for {test_case_id}")
@@ -185,175 +181,56 @@ def get_test_case_details(workspace_id: str, test_case_id: str) -> Dict[str, Any
         print(f"Full error details: {e.__class__.__name__}")
         return None
 
-def plot_test_failure_trend(test_cases_results: List[Dict]) -> None:
-    """Plot test case failures by date"""
-    # Initialize data structure for failures by date
-    failures_by_date = defaultdict(lambda: {"total": 0, "failed": 0})
+def plot_test_failure_trend(test_cases_results: List[TestCaseResult]) -> None:
+    """Plot test case failures over time at a resolution suited to the date range"""
+    fig = failure_trend_figure(test_cases_results)
     
-    # Process test case results
-    for result in test_cases_results:
-        date_str = result.get('date', 'N/A')
-        if date_str != 'N/A':
-            try:
-                # Convert to date only string (YYYY-MM-DD)
-                date = date_str.split('T')[0] if 'T' in date_str else date_str
-                failures_by_date[date]["total"] += 1
-                if result.get('verdict') == 'Fail':
-                    failures_by_date[date]["failed"] += 1
-            except Exception as e:
-                print(f"Error processing date {date_str}: {str(e)}")
-    
-    if failures_by_date:
-        # Sort dates
-        dates = sorted(failures_by_date.keys())
-        total_tests = [failures_by_date[date]["total"] for date in dates]
-        failed_tests = [failures_by_date[date]["failed"] for date in dates]
-        
-        # Create the figure
-        fig = go.Figure()
-        
-        # Add total tests line
-        fig.add_trace(go.Scatter(
-            x=dates,
-            y=total_tests,
-            name="Total Tests",
-            line=dict(color="#4CAF50", width=2),
-            mode='lines+markers'
-        ))
-        
-        # Add failed tests line
-        fig.add_trace(go.Scatter(
-            x=dates,
-            y=failed_tests,
-            name="Failed Tests",
-            line=dict(color="#FF6B6B", width=2),
-            mode='lines+markers'
-        ))
-        
-        # Update layout
-        fig.update_layout(
-            title="Test Case Execution History",
-            xaxis_title="Date",
-            yaxis_title="Number of Tests",
-            hovermode='x unified',
-            showlegend=True,
-            plot_bgcolor='white',
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            )
-        )
-        
-        # Update axes
-        fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
-        fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
-        
+    if fig is not None:
         # Show the plot
         fig.show()
     else:
         print("No trend data available")
 
-def plot_test_case_status(test_cases_results: List[Dict]) -> None:
-    """Plot test case status by name using Plotly"""
-    # Create DataFrame for test case status
-    status_data = []
-    
-    # Process results to get latest status for each test case
-    test_case_latest = {}
-    for result in test_cases_results:
-        test_case = result.get('test_case_id', 'Unknown')
-        date = result.get('date', 'N/A')
-        verdict = result.get('verdict', 'No Run')
-        
-        # Only update if this is a newer result
-        if test_case not in test_case_latest or date > test_case_latest[test_case]['date']:
-            test_case_latest[test_case] = {
-                'date': date,
-                'status': verdict,
-                'build': result.get('build', 'N/A')
-            }
-    
-    # Convert to list for DataFrame
-    for test_case, data in test_case_latest.items():
-        status_data.append({
-            'Test Case ID': test_case,
-            'Status': data['status'],
-            'Build': data['build'],
-            'Date': data['date'].split('T')[0] if 'T' in data['date'] else data['date']
-        })
-    
-    if status_data:
-        df = pd.DataFrame(status_data)
-        
-        # Create a bar chart
-        fig = go.Figure()
-        
-        # Calculate status counts for each test case
-        test_cases = sorted(df['Test Case ID'].unique())  # Sort Test Case IDs
-        statuses = ['Pass', 'Fail', 'No Run']
-        
-        for status in statuses:
-            x_data = test_cases
-            y_data = []
-            dates = []
-            for tc in test_cases:
-                tc_data = df[df['Test Case ID'] == tc]
-                count = len(tc_data[tc_data['Status'] == status])
-                y_data.append(count)
-                dates.append(tc_data['Date'].iloc[0] if not tc_data.empty else 'N/A')
-            
-            fig.add_trace(go.Bar(
-                name=status,
-                x=x_data,      # Test Case IDs on X-axis
-                y=y_data,      # Counts on Y-axis
-                marker_color='#4CAF50' if status == 'Pass' else '#FF6B6B' if status == 'Fail' else '#FFB74D',
-                customdata=dates,  # Add dates for hover
-                hovertemplate="<b>%{x}</b><br>" +
-                            "Status: %{data.name}<br>" +
-                            "Count: %{y}<br>" +
-                            "Date: %{customdata}<br>" +
-                            "<extra></extra>"
-            ))
-        
-        # Update layout
-        fig.update_layout(
-            title='Test Case Wise Fail Vs Pass History',
-            xaxis_title='Test Case ID',
-            yaxis_title='Count',
-            barmode='stack',
-            showlegend=True,
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            plot_bgcolor='white',
-            height=500  # Fixed height since bars are vertical now
-        )
-        
-        # Update axes
-        fig.update_xaxes(
-            tickangle=45,  # Angle the test case IDs for better readability
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='LightGray'
-        )
-        fig.update_yaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='LightGray'
-        )
+def plot_test_case_status(test_cases_results: List[TestCaseResult]) -> None:
+    """Plot the latest status of each test case using Plotly"""
+    if test_cases_results:
+        fig = status_figure(test_cases_results)
         
         # Show the plot
         fig.show()
     else:
         print("No test case status data available")
 
+def show_test_summary(workspace_id: str, project_id: str, story_id: str) -> Dict[str, Any]:
+    """Print a story's test case counts without downloading the test cases"""
+    session = requests.Session()
+    session.headers.update({
+        "zsessionid": RALLY_API_KEY,
+        "Accept": "application/json"
+    })
+    session.verify = False
+    summary = story_test_summary(session, RALLY_ENDPOINT, workspace_id, project_id, story_id)
+    print(f"\nTest Summary for User Story {story_id}:")
+    print(f"  Test Cases: {summary['total_tests']}")
+    print(f"  Passed:     {summary['passed']}")
+    print(f"  Failed:     {summary['failed']}")
+    print(f"  Other:      {summary['other']}")
+    print(f"  Pass Rate:  {summary['pass_percentage']:.1f}%")
+    if not summary["complete"]:
+        print("  (some counts couldn't be fetched and are shown as 0)")
+    return summary
+
+def summarize_test_case(test_case: Dict[str, Any]) -> Dict[str, Any]:
+    """The row shown for one test case fetched with ``TEST_CASE_SUMMARY``"""
+    return {
+        "test_case_id": test_case.get('FormattedID', 'N/A'),
+        "test_case_name": test_case.get('Name', 'Unnamed Test'),
+        "priority": test_case.get('Priority', 'N/A'),
+        "last_verdict": test_case.get('LastVerdict', 'No Run'),
+        "method": test_case.get('Method', 'Manual')
+    }
+
+
 def get_test_case_results(workspace_id: str, project_id: str, story_id: str) -> Dict[str, Any]:
     """Fetch test case results for a specific user story"""
     headers = {
@@ -372,7 +249,7 @@ def get_test_case_results(workspace_id: str, project_id: str, story_id: str) ->
             "workspace": f"/workspace/{workspace_id}",
             "project": f"/project/{project_id}",
             "query": f"(WorkProduct.FormattedID = {story_id})",
-            "fetch": "FormattedID,Name,LastVerdict,LastRun,ObjectID,Method,Priority",
+            "fetch": TEST_CASE_SUMMARY.fetch,
             "pagesize": page_size,
             "start": start,
             "order": "FormattedID ASC"
@@ -417,10 +294,12 @@ def get_test_case_results(workspace_id: str, project_id: str, story_id: str) ->
             tc_details = get_test_case_details(workspace_id, test_case_id)
             if tc_details and tc_details.get("results"):
                 # Add test case name to each result
-                for result in tc_details["results"]:
-                    result['test_case_name'] = test_case_name
-                    result['test_case_id'] = test_case_id
-                all_results.extend(tc_details["results"])
+                all_results.extend(result._replace(test_case_name=test_case_name)
+                                   for result in tc_details["results"])
+    
+    if SNAPSHOT_DIR:
+        saved = export_snapshot(SNAPSHOT_DIR, "results", all_results, project_id, scope=story_id)
+        print(f"Saved {saved} results to snapshot {SNAPSHOT_DIR}")
     
     # Plot both trends
     print("\nGenerating test execution trends...")
@@ -433,19 +312,19 @@ def get_test_case_results(workspace_id: str, project_id: str, story_id: str) ->
     print(f"{'Test Case ID':<15} {'Test Case Name':<50} {'Priority':<10} {'Last Verdict':<10}")
     print("-" * 100)
     
+    # Large histories are aggregated across worker processes
+    summary = aggregate_results(all_results)
     test_data = {
         "total_tests": len(all_test_cases),
-        "test_cases": []
+        "test_cases": [],
+        "total_results": len(all_results),
+        "verdict_totals": summary.verdict_totals(),
+        "latest_status": summary.latest_status(),
+        "failure_trend": summary.failure_trend()
     }
     
     for test_case in all_test_cases:
-        test_case_data = {
-            "test_case_id": test_case.get('FormattedID', 'N/A'),
-            "test_case_name": test_case.get('Name', 'Unnamed Test'),
-            "priority": test_case.get('Priority', 'N/A'),
-            "last_verdict": test_case.get('LastVerdict', 'No Run'),
-            "method": test_case.get('Method', 'Manual')
-        }
+        test_case_data = summarize_test_case(test_case)
         test_data["test_cases"].append(test_case_data)
         
         print(f"{test_case_data['test_case_id']:<15} {test_case_data['test_case_name'][:50]:<50} "
@@ -464,14 +343,27 @@ def get_test_case_results(workspace_id: str, project_id: str, story_id: str) ->
             print("-" * 120)
             
             for result in tc_details["results"]:
-                print(f"{result['build'][:20]:<20} {result['date'][:25]:<25} "
-                      f"{result['work_product'][:30]:<30} {result['verdict']:<10} "
-                      f"{result['tester'][:20]:<20}")
+                print(f"{result.build[:20]:<20} {result.date[:25]:<25} "
+                      f"{result.work_product[:30]:<30} {result.verdict:<10} "
+                      f"{result.tester[:20]:<20}")
             
             test_data["selected_test_case"] = tc_details
     
     return test_data
 
+def analyze_snapshot(snapshot_dir: str, project_id: str = None) -> None:
+    """Plot trends from a saved results snapshot instead of re-fetching from Rally"""
+    projects = [project_id] if project_id else None
+    results = load_records(snapshot_dir, "results", projects=projects)
+    print(f"Loaded {len(results)} results from snapshot {snapshot_dir}")
+    plot_test_failure_trend(results)
+    plot_test_case_status(results)
+
+def explore_snapshot(snapshot_dir: str, dataset: str = "results", project_id: str = None):
+    """Open a snapshot dataset in pygwalker for ad-hoc exploration (e.g. in a notebook)"""
+    projects = [project_id] if project_id else None
+    return pyg.walk(load_frame(snapshot_dir, dataset, projects=projects))
+
 def main():
     # Fetch workspaces
     workspaces = get_workspaces()
@@ -500,6 +392,11 @@ def main():
     # Get user story ID from user
     story_id = input("\nEnter User Story ID (e.g., US1234): ")
     
+    # Counts come from a few count queries; rows are only fetched for the detail view
+    show_test_summary(workspace_id, project_id, story_id)
+    if input("\nShow test cases and execution trends? [y/N]: ").strip().lower() != "y":
+        return
+    
     # Fetch and display test results
     test_data = get_test_case_results(workspace_id, project_id, story_id)
     
@@ -507,4 +404,9 @@ def main():
         print("Failed to fetch test case results")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    import sys
+    if len(sys.argv) > 2 and sys.argv[1] == "--snapshot":
+        # python rally_test.py --snapshot DIR [PROJECT_ID]
+        analyze_snapshot(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        main() 
\ No newline at end of file
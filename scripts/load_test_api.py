@@ -0,0 +1,133 @@
+"""
+Load test for the JSON API in ``api.py``.
+
+Runs ``--clients`` concurrent clients for ``--duration`` seconds. Each client
+has its own keep-alive session and cycles through the given paths, and the
+script reports throughput, latency percentiles, status codes and bytes
+received. With ``--etag`` each client revalidates with ``If-None-Match``,
+as a polling CI job would. Responses are requested gzip-encoded unless
+``--no-gzip`` is given.
+
+``--self-contained`` starts the Rally stand-in (``rally.stub``) and the API
+in this process on free ports, so no Rally account or running server is
+needed. This exercises the Rally aggregation endpoints; the agent endpoints
+call OpenAI and are not load-tested.
+
+Usage:
+    python scripts/load_test_api.py --self-contained --clients 16 --duration 10 --etag
+    python scripts/load_test_api.py --url http://ci-api:8800 --token $SDLC_API_TOKEN PATH...
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_PATHS = [
+    "/api/rally/workspaces/1/projects/100/stories/US1/test-data",
+    "/api/rally/workspaces/1/projects/100/stories/US1/test-summary",
+    "/api/rally/workspaces/1/projects/100/rca",
+    "/api/rally/workspaces/1/projects/101/rca-summary",
+]
+
+
+def start_self_contained() -> str:
+    """Start the Rally stand-in and the API on free ports; returns the API base URL"""
+    import logging
+
+    from werkzeug.serving import make_server
+
+    from rally import stub
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    rally = stub.serve()
+    os.environ["RALLY_ENDPOINT"] = f"http://127.0.0.1:{rally.server_port}"
+    os.environ["RALLY_API_KEY"] = "stub"
+    import api
+
+    api.configure()
+    server = make_server("127.0.0.1", 0, api.create_app(token=""), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def client(base_url: str, paths: List[str], deadline: float, headers: Dict[str, str],
+           use_etag: bool) -> Dict:
+    session = requests.Session()
+    session.headers.update(headers)
+    etags: Dict[str, str] = {}
+    latencies, statuses, received = [], Counter(), 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        extra = {"If-None-Match": etags[path]} if use_etag and path in etags else {}
+        started = time.perf_counter()
+        response = session.get(base_url + path, headers=extra, stream=True)
+        raw = response.raw.read(decode_content=False)
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+        received += len(raw)
+        if response.headers.get("ETag"):
+            etags[path] = response.headers["ETag"]
+    return {"latencies": latencies, "statuses": statuses, "bytes": received}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the SDLC agent JSON API")
+    parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="API base URL")
+    target.add_argument("--self-contained", action="store_true",
+                        help="start the Rally stand-in and the API in-process")
+    parser.add_argument("--token", default=os.getenv("SDLC_API_TOKEN", ""))
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--etag", action="store_true", help="revalidate with If-None-Match")
+    parser.add_argument("--no-gzip", action="store_true")
+    args = parser.parse_args()
+
+    base_url = start_self_contained() if args.self_contained else args.url.rstrip("/")
+    headers = {"Accept-Encoding": "identity" if args.no_gzip else "gzip"}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+
+    # One untimed pass so the caches are warm, as they are in steady state
+    for path in args.paths:
+        requests.get(base_url + path, headers=headers)
+
+    deadline = time.perf_counter() + args.duration
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        runs = list(pool.map(lambda _: client(base_url, args.paths, deadline, headers, args.etag),
+                             range(args.clients)))
+
+    latencies = sorted(l for run in runs for l in run["latencies"])
+    statuses = sum((run["statuses"] for run in runs), Counter())
+    received = sum(run["bytes"] for run in runs)
+    if not latencies:
+        print("No requests completed")
+        return 1
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    print(f"{len(latencies)} requests from {args.clients} clients in {args.duration:.0f}s "
+          f"({len(latencies) / args.duration:.0f} req/s)")
+    print(f"latency ms: p50 {pct(50):.1f}  p95 {pct(95):.1f}  p99 {pct(99):.1f}  "
+          f"mean {statistics.mean(latencies) * 1000:.1f}")
+    print(f"status: {dict(statuses)}  received: {received / 1024:.0f} KiB "
+          f"({received / len(latencies):.0f} B/request)")
+    return 0 if all(200 <= status < 400 for status in statuses) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
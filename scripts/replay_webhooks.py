@@ -0,0 +1,73 @@
+"""
+Replay recorded Rally webhook payloads.
+
+Payloads are read from a JSON array, a JSON Lines file or a directory of
+``.json`` files, in order. They are POSTed to a running receiver, or with
+``--local`` applied to this process's caches, which is useful to check which
+tags each payload invalidates. ``scripts/webhook_samples.jsonl`` holds one
+payload per artifact kind.
+
+Usage:
+    python scripts/replay_webhooks.py PAYLOADS --url http://localhost:8600/rally/webhook?token=...
+    python scripts/replay_webhooks.py PAYLOADS --local
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def read_payloads(path: str) -> Iterator[Dict[str, Any]]:
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                yield from read_payloads(os.path.join(path, name))
+        return
+    with open(path, "r") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSON Lines
+        for line in text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+        return
+    yield from (data if isinstance(data, list) else [data])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("payloads", help="JSON, JSON Lines file or directory of .json files")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="receiver URL to POST each payload to")
+    target.add_argument("--local", action="store_true", help="apply to this process's caches")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds between payloads")
+    args = parser.parse_args()
+
+    if args.local:
+        from rally.webhooks import apply_event
+    else:
+        import requests
+
+    failures = 0
+    for i, payload in enumerate(read_payloads(args.payloads), 1):
+        if args.local:
+            record = apply_event(payload)
+            print(f"{i}: {record['event']['object_type']} {record['event']['action']} "
+                  f"-> {record['tags']} {record['invalidated']}")
+        else:
+            response = requests.post(args.url, json=payload, timeout=10)
+            print(f"{i}: HTTP {response.status_code} {response.text.strip()}")
+            failures += response.status_code != 200
+        if args.delay:
+            time.sleep(args.delay)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""
+Named caches that can be shared across app replicas.
+
+Every cache is a ``ProcessCache``. By default it lives in the server
+process, like Streamlit's ``st.cache_data`` / ``st.cache_resource``. A cache
+created with ``shared=True`` instead stores its pickled values in the
+backend named by ``SHARED_CACHE_URL`` (see ``backends.backend_from_url``),
+so replicas behind a load balancer share hits, tags and invalidations. Only
+one replica refreshes a missing key while the others wait for its value.
+Without ``SHARED_CACHE_URL`` shared caches behave like local ones.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from shared_cache.backends import CacheBackend, backend_from_url
+
+_MISSING = object()
+
+_backend: Optional[CacheBackend] = None
+_backend_loaded = False
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> Optional[CacheBackend]:
+    """The shared backend from ``SHARED_CACHE_URL``, or None for process-local caching"""
+    global _backend, _backend_loaded
+    with _backend_lock:
+        if not _backend_loaded:
+            _backend = backend_from_url(os.getenv("SHARED_CACHE_URL", ""))
+            _backend_loaded = True
+        return _backend
+
+
+def set_backend(backend: Optional[CacheBackend]) -> None:
+    """Replace the shared backend for every ``shared=True`` cache, e.g. from configuration"""
+    global _backend, _backend_loaded
+    with _backend_lock:
+        _backend, _backend_loaded = backend, True
+
+
+def _deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """Approximate the memory held by ``obj`` and everything it references"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_sizeof(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_deep_sizeof(getattr(obj, slot), seen)
+                    for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+class ProcessCache:
+    """
+    Thread-safe LRU cache living for the lifetime of the server process.
+
+    With ``copy_on_read=True`` values are stored pickled and every read returns
+    a fresh copy, like ``st.cache_data``; callers may mutate what they get back.
+    With ``copy_on_read=False`` the same object is handed to every caller, like
+    ``st.cache_resource``, so only immutable or thread-safe values belong there.
+
+    Concurrent misses on the same key are collapsed: the first caller computes
+    the value while the others wait for it instead of issuing the same request.
+
+    Entries may carry tags (any hashable, e.g. ``("story", "US12")``) so that
+    ``invalidate_tags`` can drop everything derived from a changed artifact.
+
+    With ``shared=True`` and a configured backend, entries live in the backend
+    instead, expire after ``ttl`` there, and misses are collapsed across
+    replicas with a backend lock held for at most ``lock_timeout`` seconds.
+    ``max_entries`` then doesn't apply; size the backend instead.
+    """
+
+    def __init__(self, name: str, ttl: Optional[float] = None, max_entries: int = 256,
+                 copy_on_read: bool = True, shared: bool = False, lock_timeout: float = 60.0):
+        if shared and not copy_on_read:
+            raise ValueError("Shared caches hold pickled values and need copy_on_read=True")
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.copy_on_read = copy_on_read
+        self.shared = shared
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, int, frozenset]]" = OrderedDict()
+        self._tagged: Dict[Hashable, set] = {}
+        self._lock = threading.RLock()
+        # key -> [lock, callers holding or waiting for it]; dropped when the last one leaves
+        self._key_locks: Dict[Hashable, List[Any]] = {}
+        self._prefix = f"{name}:"
+
+    @property
+    def backend(self) -> Optional[CacheBackend]:
+        return get_backend() if self.shared else None
+
+    def _shared_key(self, key: Hashable) -> str:
+        return self._prefix + hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+
+    def _shared_tag(self, tag: Hashable) -> str:
+        return self._prefix + repr(tag)
+
+    def _load(self, stored: Any) -> Any:
+        return pickle.loads(stored) if self.copy_on_read else stored
+
+    def _drop(self, key: Hashable) -> None:
+        """Remove ``key`` and its tag index entries; caller holds ``_lock``"""
+        _, _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for ``key`` or ``default`` if missing or expired"""
+        backend = self.backend
+        if backend is not None:
+            stored = backend.get(self._shared_key(key))
+            return default if stored is None else pickle.loads(stored)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            stored_at, stored, _, _ = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                self._drop(key)
+                return default
+            self._entries.move_to_end(key)
+        return self._load(stored)
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[Hashable] = ()) -> None:
+        """Store ``value`` under ``key``, evicting the least recently used entry if full"""
+        backend = self.backend
+        if backend is not None:
+            backend.set(self._shared_key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                        self.ttl, [self._shared_tag(tag) for tag in tags])
+            return
+        if self.copy_on_read:
+            stored = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            size = len(stored)
+        else:
+            stored = value
+            size = _deep_sizeof(value)
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time(), stored, size, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any],
+                       should_cache: Callable[[Any], bool] = bool,
+                       tags: Iterable[Hashable] = ()) -> Any:
+        """Return the cached value for ``key``, computing and storing it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count(hit=True)
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                # Another session may have filled the entry while we waited
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    self._count(hit=True)
+                elif self.backend is not None:
+                    value = self._compute_shared(key, compute, should_cache, tags)
+                else:
+                    self._count(hit=False)
+                    value = compute()
+                    if should_cache(value):
+                        self.set(key, value, tags)
+        finally:
+            with self._lock:
+                # Only the last caller drops the lock, so a newcomer can't get a second one while others wait
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._key_locks[key]
+        return value
+
+    def _compute_shared(self, key: Hashable, compute: Callable[[], Any],
+                        should_cache: Callable[[Any], bool], tags: Iterable[Hashable]) -> Any:
+        """Compute on the replica holding the backend lock; the others wait for its value"""
+        backend = self.backend
+        lock_name = self._shared_key(key)
+        deadline = time.time() + self.lock_timeout
+        delay = 0.02
+        while True:
+            token = backend.acquire_lock(lock_name, self.lock_timeout)
+            if token is not None:
+                try:
+                    # The previous holder may have stored the value just before releasing
+                    value = self.get(key, _MISSING)
+                    if value is not _MISSING:
+                        self._count(hit=True)
+                        return value
+                    self._count(hit=False)
+                    value = compute()
+                    if should_cache(value):
+                        self.set(key, value, tags)
+                    return value
+                finally:
+                    backend.release_lock(lock_name, token)
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                self._count(hit=True)
+                return value
+            if time.time() > deadline:
+                # The holder is stuck or gone; don't wait forever
+                self._count(hit=False)
+                value = compute()
+                if should_cache(value):
+                    self.set(key, value, tags)
+                return value
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Drop entries whose key matches ``predicate`` (all entries if omitted)"""
+        backend = self.backend
+        if backend is not None:
+            if predicate is not None:
+                raise ValueError("Shared cache entries can only be invalidated by tag or all at once")
+            return backend.clear(self._prefix)
+        with self._lock:
+            keys = [k for k in self._entries if predicate is None or predicate(k)]
+            for k in keys:
+                self._drop(k)
+        return len(keys)
+
+    def invalidate_tags(self, tags: Iterable[Hashable]) -> int:
+        """Drop every entry carrying any of ``tags``"""
+        backend = self.backend
+        if backend is not None:
+            return backend.invalidate_tags([self._shared_tag(tag) for tag in tags])
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tagged.get(tag, ()))
+            for k in keys:
+                self._drop(k)
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return entry count, hit/miss counters and approximate memory use.
+
+        ``entries`` and ``bytes`` are None for shared caches whose backend
+        can't count them cheaply (Redis).
+        """
+        backend = self.backend
+        if backend is not None:
+            entries, size = backend.usage(self._prefix)
+        with self._lock:
+            if backend is None:
+                entries = len(self._entries)
+                size = sum(size for _, _, size, _ in self._entries.values())
+            return {
+                "name": self.name,
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes": size,
+                "ttl": self.ttl,
+                "backend": type(backend).__name__ if backend is not None else "process",
+            }
+
+
+_caches: Dict[str, ProcessCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, **kwargs) -> ProcessCache:
+    """Return the named cache, creating it on first use"""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = ProcessCache(name, **kwargs)
+        return _caches[name]
+
+
+def all_caches() -> List[ProcessCache]:
+    """Every registered cache"""
+    with _caches_lock:
+        return list(_caches.values())
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """Return ``ProcessCache.stats()`` for every registered cache"""
+    return [c.stats() for c in all_caches()]
+
+
+def invalidate_tags(tags: Iterable[Hashable]) -> Dict[str, int]:
+    """Drop entries carrying any of ``tags`` from every cache; returns counts per cache"""
+    tags = list(tags)
+    return {c.name: c.invalidate_tags(tags) for c in all_caches()}
@@ -0,0 +1,297 @@
+"""
+Stores that let several app replicas share cached values.
+
+A backend holds opaque byte values under string keys with an optional TTL,
+a tag index for targeted invalidation, and short-lived named locks. The
+locks let one replica refresh a hot key while the others wait for its
+result. ``SQLiteBackend`` shares a file between processes on one host, and
+``RedisBackend`` shares a Redis server between hosts. Pick one with
+``backend_from_url``.
+"""
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Iterable, List, Optional, Tuple
+
+
+class CacheBackend:
+    """Interface implemented by shared cache stores"""
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None, tags: Iterable[str] = ()) -> None:
+        raise NotImplementedError
+
+    def delete(self, keys: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Delete every key carrying any of ``tags``; returns the number deleted"""
+        raise NotImplementedError
+
+    def clear(self, prefix: str) -> int:
+        """Delete every key starting with ``prefix``"""
+        raise NotImplementedError
+
+    def acquire_lock(self, name: str, timeout: float) -> Optional[str]:
+        """Take the named lock for up to ``timeout`` seconds; returns a token, or None if held"""
+        raise NotImplementedError
+
+    def release_lock(self, name: str, token: str) -> None:
+        raise NotImplementedError
+
+    def lock_held(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def usage(self, prefix: str) -> Tuple[Optional[int], Optional[int]]:
+        """(entries, bytes) stored under ``prefix``, or None where the store can't tell cheaply"""
+        return None, None
+
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Backend on a SQLite file, shared by processes on the same host.
+
+    The database runs in WAL mode so readers don't block the writer. Each
+    thread gets its own connection. Expired rows are skipped on read and
+    purged every ``PURGE_EVERY`` writes.
+    """
+
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL);
+                CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key));
+                CREATE INDEX IF NOT EXISTS tags_by_key ON tags (key);
+                CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL);
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        return db
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT value FROM entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time())).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None, tags: Iterable[str] = ()) -> None:
+        expires = None if ttl is None else time.time() + ttl
+        db = self._transaction()
+        try:
+            db.execute("INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)",
+                       (key, sqlite3.Binary(value), expires))
+            db.execute("DELETE FROM tags WHERE key = ?", (key,))
+            db.executemany("INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)", [(t, key) for t in tags])
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(db)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _purge(self, db: sqlite3.Connection) -> None:
+        now = time.time()
+        db.execute("DELETE FROM tags WHERE key IN (SELECT key FROM entries WHERE expires <= ?)", (now,))
+        db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        db.execute("DELETE FROM locks WHERE expires <= ?", (now,))
+
+    def _delete_keys(self, db: sqlite3.Connection, keys: List[str]) -> int:
+        deleted = 0
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            deleted += db.execute(f"DELETE FROM entries WHERE key IN ({marks})", chunk).rowcount
+            db.execute(f"DELETE FROM tags WHERE key IN ({marks})", chunk)
+        return deleted
+
+    def delete(self, keys: Iterable[str]) -> int:
+        db = self._transaction()
+        try:
+            deleted = self._delete_keys(db, list(keys))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        tags = list(tags)
+        if not tags:
+            return 0
+        db = self._transaction()
+        try:
+            marks = ",".join("?" * len(tags))
+            keys = [row[0] for row in db.execute(f"SELECT DISTINCT key FROM tags WHERE tag IN ({marks})", tags)]
+            deleted = self._delete_keys(db, keys)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def clear(self, prefix: str) -> int:
+        low, high = _prefix_range(prefix)
+        db = self._transaction()
+        try:
+            db.execute("DELETE FROM tags WHERE key >= ? AND key < ?", (low, high))
+            deleted = db.execute("DELETE FROM entries WHERE key >= ? AND key < ?", (low, high)).rowcount
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def acquire_lock(self, name: str, timeout: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        now = time.time()
+        db = self._transaction()
+        try:
+            db.execute("DELETE FROM locks WHERE name = ? AND expires <= ?", (name, now))
+            taken = db.execute("INSERT OR IGNORE INTO locks (name, token, expires) VALUES (?, ?, ?)",
+                               (name, token, now + timeout)).rowcount
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return token if taken else None
+
+    def release_lock(self, name: str, token: str) -> None:
+        self._connect().execute("DELETE FROM locks WHERE name = ? AND token = ?", (name, token))
+
+    def lock_held(self, name: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM locks WHERE name = ? AND expires > ?",
+                                       (name, time.time())).fetchone() is not None
+
+    def usage(self, prefix: str) -> Tuple[Optional[int], Optional[int]]:
+        low, high = _prefix_range(prefix)
+        count, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries "
+            "WHERE key >= ? AND key < ? AND (expires IS NULL OR expires > ?)",
+            (low, high, time.time())).fetchone()
+        return count, size
+
+
+class RedisBackend(CacheBackend):
+    """
+    Backend on a Redis server (or anything speaking the Redis protocol).
+
+    ``client`` needs only ``execute_command(*args)``, which both redis-py
+    clients and ``shared_cache.resp.RespClient`` provide. Tags are Redis sets
+    of keys. Locks are ``SET NX PX`` keys holding a random token.
+    """
+
+    def __init__(self, client, namespace: str = "sdlc"):
+        self.client = client
+        self.namespace = namespace
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.namespace}:tag:{tag}"
+
+    def _lock_key(self, name: str) -> str:
+        return f"{self.namespace}:lock:{name}"
+
+    def _command(self, *args):
+        return self.client.execute_command(*args)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None, tags: Iterable[str] = ()) -> None:
+        ttl_ms = None if ttl is None else max(1, int(ttl * 1000))
+        self._command("SET", key, value, *(("PX", ttl_ms) if ttl_ms else ()))
+        for tag in tags:
+            self._command("SADD", self._tag_key(tag), key)
+            if ttl_ms:
+                # Tag sets outlive nothing they index; stale members are harmless
+                self._command("PEXPIRE", self._tag_key(tag), ttl_ms)
+
+    def delete(self, keys: Iterable[str]) -> int:
+        keys = list(keys)
+        return int(self._command("DEL", *keys)) if keys else 0
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        deleted = 0
+        for tag in tags:
+            members = [m.decode("utf-8") if isinstance(m, bytes) else m
+                       for m in self._command("SMEMBERS", self._tag_key(tag)) or []]
+            deleted += self.delete(members)
+            self._command("DEL", self._tag_key(tag))
+        return deleted
+
+    def clear(self, prefix: str) -> int:
+        deleted, cursor = 0, "0"
+        while True:
+            cursor, keys = self._command("SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 500)
+            cursor = cursor.decode("utf-8") if isinstance(cursor, bytes) else str(cursor)
+            deleted += self.delete(keys)
+            if cursor == "0":
+                return deleted
+
+    def acquire_lock(self, name: str, timeout: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        taken = self._command("SET", self._lock_key(name), token, "NX", "PX", max(1, int(timeout * 1000)))
+        return token if taken else None
+
+    def release_lock(self, name: str, token: str) -> None:
+        # Check-then-delete: a lock that expired in between may be released
+        # early, which only costs a duplicate refresh, never a wrong value
+        held = self._command("GET", self._lock_key(name))
+        if held is not None and (held.decode("utf-8") if isinstance(held, bytes) else held) == token:
+            self._command("DEL", self._lock_key(name))
+
+    def lock_held(self, name: str) -> bool:
+        return bool(self._command("EXISTS", self._lock_key(name)))
+
+
+def backend_from_url(url: str) -> Optional[CacheBackend]:
+    """
+    Build a backend from a URL, or return None for process-local caching.
+
+    ``sqlite:///abs/path.db`` and ``sqlite://relative/path.db`` use
+    ``SQLiteBackend``. ``redis://[:password@]host[:port][/db]`` uses redis-py
+    when it is installed and ``shared_cache.resp.RespClient`` otherwise. An
+    empty URL or ``memory://`` keeps caches local to each process.
+    """
+    if not url or url.startswith("memory:"):
+        return None
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteBackend(parsed.netloc + parsed.path)
+    if parsed.scheme in ("redis", "rediss"):
+        try:
+            import redis
+            client = redis.Redis.from_url(url)
+        except ImportError:
+            from shared_cache.resp import RespClient
+            client = RespClient(parsed.hostname or "localhost", parsed.port or 6379,
+                                db=int(parsed.path.strip("/") or 0), password=parsed.password)
+        return RedisBackend(client)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
@@ -0,0 +1,237 @@
+"""
+Minimal Redis protocol (RESP2) client and an in-memory stand-in server.
+
+``RespClient`` is enough for ``RedisBackend`` when redis-py isn't
+installed. ``RedisStandIn`` implements the handful of commands the backend
+uses, so the Redis adapter can be exercised locally and in CI without a
+Redis server:
+
+    server = RedisStandIn().start()
+    backend = RedisBackend(RespClient("127.0.0.1", server.port))
+"""
+import fnmatch
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+
+class RespError(Exception):
+    """Error reply from the server"""
+
+
+def _encode(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(stream) -> Any:
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        raise RespError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        return None if length < 0 else [_read_reply(stream) for _ in range(length)]
+    raise RespError(f"Unexpected reply: {line!r}")
+
+
+class RespClient:
+    """Blocking RESP2 client with one connection per thread"""
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, timeout: float = 5.0):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            if self.password:
+                self._send(conn, ("AUTH", self.password))
+            if self.db:
+                self._send(conn, ("SELECT", self.db))
+        return conn
+
+    @staticmethod
+    def _send(conn, args) -> Any:
+        sock, stream = conn
+        sock.sendall(_encode(args))
+        return _read_reply(stream)
+
+    def execute_command(self, *args) -> Any:
+        try:
+            return self._send(self._connection(), args)
+        except (ConnectionError, OSError):
+            # One reconnect, e.g. after the server closed an idle connection
+            self.close()
+            return self._send(self._connection(), args)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+
+class RedisStandIn:
+    """
+    In-memory server speaking enough of the Redis protocol for ``RedisBackend``.
+
+    Supports PING, SELECT, AUTH, GET, SET (NX, PX, EX), DEL, EXISTS, PEXPIRE,
+    SADD, SMEMBERS, SCAN (single pass) and FLUSHDB. Everything lives in one
+    keyspace guarded by one lock.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.address = (host, port)
+        self._values: Dict[bytes, bytes] = {}
+        self._sets: Dict[bytes, Set[bytes]] = {}
+        self._expires: Dict[bytes, float] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.ThreadingTCPServer] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "RedisStandIn":
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        args = _read_reply(self.rfile)
+                    except (ConnectionError, OSError):
+                        return
+                    self.wfile.write(stand_in._reply(args))
+
+        self._server = socketserver.ThreadingTCPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="redis-stand-in", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # -- command handling -------------------------------------------------
+
+    def _expired(self, key: bytes) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._values.pop(key, None)
+            self._sets.pop(key, None)
+            del self._expires[key]
+            return True
+        return False
+
+    def _exists(self, key: bytes) -> bool:
+        return not self._expired(key) and (key in self._values or key in self._sets)
+
+    def _delete(self, key: bytes) -> bool:
+        existed = self._exists(key)
+        self._values.pop(key, None)
+        self._sets.pop(key, None)
+        self._expires.pop(key, None)
+        return existed
+
+    def _reply(self, args: List[bytes]) -> bytes:
+        try:
+            with self._lock:
+                return self._encode_reply(self._execute(args[0].upper().decode("utf-8"), args[1:]))
+        except Exception as e:
+            return b"-ERR %s\r\n" % str(e).encode("utf-8")
+
+    def _encode_reply(self, value: Any) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode("utf-8")
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(self._encode_reply(v) for v in value)
+
+    def _execute(self, command: str, args: List[bytes]) -> Any:
+        if command in ("PING",):
+            return "PONG"
+        if command in ("SELECT", "AUTH"):
+            return "OK"
+        if command == "GET":
+            return None if not self._exists(args[0]) else self._values.get(args[0])
+        if command == "SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            if b"NX" in options and self._exists(key):
+                return None
+            self._delete(key)
+            self._values[key] = value
+            for unit, scale in ((b"PX", 0.001), (b"EX", 1.0)):
+                if unit in options:
+                    self._expires[key] = time.time() + int(args[2 + options.index(unit) + 1]) * scale
+            return "OK"
+        if command == "DEL":
+            return sum(self._delete(key) for key in args)
+        if command == "EXISTS":
+            return sum(self._exists(key) for key in args)
+        if command == "PEXPIRE":
+            if not self._exists(args[0]):
+                return 0
+            self._expires[args[0]] = time.time() + int(args[1]) / 1000
+            return 1
+        if command == "SADD":
+            self._expired(args[0])
+            members = self._sets.setdefault(args[0], set())
+            before = len(members)
+            members.update(args[1:])
+            return len(members) - before
+        if command == "SMEMBERS":
+            return sorted(self._sets.get(args[0], ())) if self._exists(args[0]) else []
+        if command == "SCAN":
+            options = [a.upper() for a in args[1:]]
+            pattern = args[1 + options.index(b"MATCH") + 1].decode("utf-8") if b"MATCH" in options else "*"
+            keys = [k for k in list(self._values) + list(self._sets)
+                    if self._exists(k) and fnmatch.fnmatchcase(k.decode("utf-8"), pattern)]
+            return [b"0", keys]
+        if command == "FLUSHDB":
+            self._values.clear()
+            self._sets.clear()
+            self._expires.clear()
+            return "OK"
+        raise ValueError(f"unknown command '{command}'")
+
+    def __enter__(self) -> "RedisStandIn":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from rally import charts, records
+
+
+def daily_results(days, start="2024-01-01"):
+    dates = pd.date_range(start, periods=days, freq="D").strftime("%Y-%m-%dT10:00:00.000Z")
+    return [records.TestCaseResult("TC1", "1.0", date, "Fail" if i % 3 == 0 else "Pass", "US1", "Dana")
+            for i, date in enumerate(dates)]
+
+
+def test_weekly_trend_is_indexed_by_week_start():
+    df = pd.DataFrame({"date": ["2024-01-03T10:00:00.000Z", "2024-01-07T10:00:00.000Z",
+                                "2024-01-08T10:00:00.000Z"],
+                       "verdict": ["Fail", "Pass", "Pass"]})
+    trend = charts.failure_trend(df, resolution="week")
+    assert list(trend.index.strftime("%Y-%m-%d")) == ["2024-01-01", "2024-01-08"]
+    assert list(trend["total"]) == [2, 1] and list(trend["failed"]) == [1, 0]
+
+
+def test_long_daily_range_switches_to_webgl_lines():
+    days = charts.WEBGL_THRESHOLD + 50
+    assert days <= charts.MAX_TREND_POINTS
+    fig = charts.failure_trend_figure(daily_results(days))
+    assert fig.data[0].type == "scattergl" and fig.data[0].mode == "lines"
+    assert len(fig.data[0].x) == days
+
+
+def test_short_range_keeps_svg_markers():
+    fig = charts.failure_trend_figure(daily_results(30))
+    assert fig.data[0].type == "scatter" and fig.data[0].mode == "lines+markers"
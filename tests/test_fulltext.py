@@ -0,0 +1,82 @@
+import sqlite3
+
+import pytest
+
+import utils
+from index import fulltext
+from rally import stream, stub
+
+STORY = {"ObjectID": 101, "FormattedID": "US1", "Name": "Reset password", "Description": "",
+         "LastUpdateDate": "2024-05-01T10:00:00.000Z"}
+
+
+@pytest.fixture
+def rally():
+    server = stub.serve(data=stub.StubData(projects=1, stories=5, test_cases=10))
+    saved = dict(utils.config)
+    utils.config.update(rally_endpoint=f"http://127.0.0.1:{server.server_port}", rally_api_key="first")
+    yield
+    utils.config.clear()
+    utils.config.update(saved)
+    server.shutdown()
+
+
+def test_search_only_sees_its_own_credentials_artifacts():
+    index = fulltext.SearchIndex(":memory:")
+    index.upsert("1", "100", "story", [STORY], credential="alice")
+    assert [r["formatted_id"] for r in index.search("reset", credential="alice")] == ["US1"]
+    assert index.search("reset", credential="bob") == []
+    assert index.search("US1", credential="bob") == []
+    assert index.stats(credential="bob") == {}
+    # The same object synced under another credential is a separate row
+    index.upsert("1", "100", "story", [dict(STORY, Name="Reset password (other)")], credential="bob")
+    assert index.search("reset", credential="alice")[0]["name"] == "Reset password"
+
+
+def test_each_credential_syncs_on_its_own(rally):
+    index = fulltext.SearchIndex(":memory:")
+    assert fulltext.sync_workspace("1", ["100"], index=index)["100"]["story"] == 5
+    assert fulltext.sync_workspace("1", ["100"], max_age=300, index=index) == {}
+    utils.config["rally_api_key"] = "second"
+    assert index.search("Story") == []
+    # Not synced yet for this key, so it is fetched in full rather than skipped
+    assert fulltext.sync_workspace("1", ["100"], max_age=300, index=index)["100"]["story"] == 5
+    assert len(index.search("Story", kinds=["story"])) == 5
+
+
+def test_index_file_from_an_older_schema_is_rebuilt(tmp_path):
+    path = str(tmp_path / "search.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE artifacts (id INTEGER PRIMARY KEY, kind TEXT, object_id TEXT)")
+    old.execute("INSERT INTO artifacts (kind, object_id) VALUES ('story', '101')")
+    old.commit()
+    old.close()
+    index = fulltext.SearchIndex(path)
+    index.upsert("1", "100", "story", [STORY], credential="alice")
+    assert index.stats(credential="alice") == {"story": 1}
+    # Reopening the current schema keeps its rows
+    assert fulltext.SearchIndex(path).stats(credential="alice") == {"story": 1}
+
+
+def test_full_resync_keeps_the_index_when_a_page_fails(rally, monkeypatch):
+    index = fulltext.SearchIndex(":memory:")
+    fulltext.sync_workspace("1", ["100"], index=index)
+    synced = index.stats()
+    before = index.sync_state("1", "100", "story")
+
+    def failing(*args, **kwargs):
+        yield {"ObjectID": 1000, "FormattedID": "US1", "Name": "Story 1", "LastUpdateDate": "2030-01-01"}
+        raise stream.QueryError("HTTP 503")
+
+    monkeypatch.setattr(fulltext, "iter_query", failing)
+    assert fulltext.sync_workspace("1", ["100"], full=True, index=index) == {}
+    assert index.stats() == synced
+    assert index.sync_state("1", "100", "story") == before
+
+
+def test_failed_page_raises_instead_of_ending_the_results(rally):
+    base = f"{utils.rally_base_endpoint()}/nosuchtype"
+    with pytest.raises(stream.QueryError):
+        list(stream.iter_query(utils.rally_session(), base, {}))
+    with pytest.raises(stream.QueryError):
+        list(stream.iter_query(utils.rally_session(), base, {}, prefetch=True))
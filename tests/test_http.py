@@ -0,0 +1,44 @@
+import pytest
+import requests
+
+from rally import http, stub
+
+
+@pytest.fixture
+def rally():
+    server = stub.serve(data=stub.StubData(projects=400))
+    session = requests.Session()
+    session.headers.update({"zsessionid": "key", "Accept-Encoding": http.ACCEPT_ENCODING})
+    adapter = http.ConditionalAdapter()
+    session.mount("http://", adapter)
+    http._bodies.clear()
+    yield session, f"http://127.0.0.1:{server.server_port}{stub.WSAPI}"
+    server.shutdown()
+
+
+def test_body_read_to_the_end_is_revalidated_and_replayed(rally):
+    session, base = rally
+    first = session.get(f"{base}/project", params={"pagesize": 200})
+    before = http.transfer_stats()["not_modified"]
+    second = session.get(f"{base}/project", params={"pagesize": 200})
+    assert http.transfer_stats()["not_modified"] == before + 1
+    assert second.status_code == 200 and second.json() == first.json()
+
+
+def test_streamed_body_is_not_read_by_the_adapter(rally):
+    session, base = rally
+    with session.get(f"{base}/project", params={"pagesize": 200}, stream=True) as response:
+        assert not response._content_consumed
+        next(response.iter_content(64))
+    # Abandoned part way, so nothing is remembered and the next GET is unconditional
+    assert len(http._bodies) == 0
+    with session.get(f"{base}/project", params={"pagesize": 200}, stream=True) as response:
+        body = b"".join(response.iter_content(1024))
+    assert len(http._bodies) == 1 and http._bodies.bytes == len(body)
+
+
+def test_store_is_bounded_by_total_bytes():
+    store = http._BodyStore(max_bytes=10)
+    for i in range(4):
+        store.set(i, http._Remembered("e", "", b"x" * 4, 4, {}, "utf-8"))
+    assert len(store) == 2 and store.bytes == 8 and store.get(0) is None and store.get(3) is not None
@@ -0,0 +1,46 @@
+import pytest
+
+import utils
+from rally import cache, paging, stream
+
+
+@pytest.fixture
+def rally_config():
+    saved = dict(utils.config)
+    utils.config.update(rally_endpoint="http://rally.invalid", rally_api_key="paging")
+    yield
+    cache.clear_caches()
+    utils.config.clear()
+    utils.config.update(saved)
+
+
+def failing_stories(count):
+    def stories(workspace_id, project_id):
+        for n in range(count):
+            yield {"formatted_id": f"US{n}"}
+        raise stream.QueryError("HTTP 503")
+    return stories
+
+
+def test_partial_pager_is_not_cached(rally_config, monkeypatch):
+    monkeypatch.setattr(utils, "iter_rally_user_stories", failing_stories(3))
+    pager = paging.lazy_user_stories("1", "100")
+    assert len(pager.window(0, 2)) == 2
+    with pytest.raises(stream.QueryError):
+        pager.all()
+    # Asking again doesn't restart the iterator or end the list early
+    with pytest.raises(stream.QueryError):
+        pager.has_more(3)
+    assert pager.failed and not pager.exhausted
+
+    monkeypatch.setattr(utils, "iter_rally_user_stories", failing_stories(5))
+    retry = paging.lazy_user_stories("1", "100")
+    assert retry is not pager
+    assert len(retry.window(0, 5)) == 5
+
+
+def test_pager_is_shared_while_loading(rally_config, monkeypatch):
+    monkeypatch.setattr(utils, "iter_rally_user_stories", failing_stories(10))
+    pager = paging.lazy_user_stories("1", "100")
+    assert len(pager.window(0, 4)) == 4
+    assert paging.lazy_user_stories("1", "100") is pager
@@ -0,0 +1,52 @@
+import pytest
+
+import utils
+from rally import cache, portfolio, stub
+
+
+@pytest.fixture
+def rally():
+    server = stub.serve(data=stub.StubData(projects=3, stories=6, test_cases=24))
+    saved = dict(utils.config)
+    utils.config.update(rally_endpoint=f"http://127.0.0.1:{server.server_port}", rally_api_key="portfolio")
+    yield
+    cache.clear_caches()
+    utils.config.clear()
+    utils.config.update(saved)
+    server.shutdown()
+
+
+def test_portfolio_rca_matches_pairwise_merges(rally):
+    parts = [cache.get_project_rca_data("1", str(100 + p)) for p in range(3)]
+    pairwise = portfolio.empty_rca()
+    for part in parts:
+        pairwise = portfolio.merge_rca(pairwise, part)
+
+    seen = []
+    merged = portfolio.get_portfolio_rca_data("1", on_result=lambda pid, data, so_far: seen.append(
+        len(so_far["defects"])))
+    assert seen == sorted(seen) and seen[-1] == len(pairwise["defects"])
+    assert merged["failed_projects"] == []
+    for key in ("rca_summary", "severity_distribution", "priority_distribution", "state_distribution"):
+        assert merged[key] == pairwise[key]
+    # Folding in place never touches the cached per-project results
+    assert [len(part["defects"]) for part in parts] == [150, 150, 150]
+
+
+def test_portfolio_test_data_matches_pairwise_merges(rally):
+    stories = [("100", "US1"), ("101", "US2"), ("100", "US4")]
+    parts = [cache.get_user_story_test_data("1", *story) for story in stories]
+    pairwise = portfolio.empty_test_data()
+    for part in parts:
+        pairwise = portfolio.merge_test_data(pairwise, part)
+
+    merged = portfolio.get_portfolio_test_data("1", stories)
+    for key in ("total_tests", "passed", "failed", "other", "pass_percentage"):
+        assert merged[key] == pairwise[key]
+    assert {date: (day["total"], day["failed"], len(day["failure_details"]))
+            for date, day in merged["failure_trend"].items()} == \
+        {date: (day["total"], day["failed"], len(day["failure_details"]))
+         for date, day in pairwise["failure_trend"].items()}
+    assert merged["failed_stories"] == [] and merged["total_tests"] == 12
+    # Folding in place never touches the cached per-story results
+    assert [part["total_tests"] for part in parts] == [4, 4, 4]
@@ -0,0 +1,31 @@
+import pytest
+
+import utils
+from rally import cache, prefetch, stub
+
+
+@pytest.fixture
+def rally():
+    requests = []
+    server = stub.serve(data=stub.StubData(projects=1, stories=4, test_cases=20),
+                        on_request=lambda path, params: requests.append((path, params)))
+    saved = dict(utils.config)
+    utils.config.update(rally_endpoint=f"http://127.0.0.1:{server.server_port}", rally_api_key="prefetch")
+    yield requests
+    cache.clear_caches()
+    utils.config.clear()
+    utils.config.update(saved)
+    server.shutdown()
+
+
+def test_selection_warms_summaries_without_downloading_rows(rally):
+    prefetcher = prefetch.Prefetcher(stories=3)
+    assert prefetcher.select("1", "100")
+    assert prefetcher.wait(30)
+    # Only the story list is paged; test cases and defects are counted, never listed
+    listed = [path for path, params in rally if params.get("pagesize") != "1"]
+    assert listed and all(path.endswith("/hierarchicalrequirement") for path in listed)
+    assert cache.get_project_rca_summary.cache.stats()["entries"] == 1
+    assert cache.get_user_story_test_summary.cache.stats()["entries"] == 3
+    assert cache.get_user_story_test_data.cache.stats()["entries"] == 0
+    assert cache.get_project_rca_data.cache.stats()["entries"] == 0
@@ -0,0 +1,29 @@
+import importlib
+
+import pytest
+
+from llm import prompts
+
+
+def template(instructions="Do the thing."):
+    return prompts.PromptTemplate("tests.sample", 1, system="You help.", instructions=instructions,
+                                  slots=[("user_story", "User story")])
+
+
+def test_identical_template_can_be_registered_again():
+    first = prompts.register(template())
+    assert prompts.register(template()) is not None
+    assert prompts.get_template("tests.sample", 1).instructions == first.instructions
+
+
+def test_conflicting_template_under_the_same_version_raises():
+    prompts.register(template())
+    with pytest.raises(ValueError, match="different content"):
+        prompts.register(template("Do another thing."))
+
+
+def test_agent_modules_can_be_reloaded():
+    import agents.developer
+    import agents.test_manager
+    importlib.reload(agents.test_manager)
+    importlib.reload(agents.developer)
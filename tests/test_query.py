@@ -0,0 +1,68 @@
+import pytest
+
+import rally_test
+import utils
+from index.fulltext import KINDS, SearchIndex
+from rally import query, records
+
+STORY = {"ObjectID": 101, "FormattedID": "US1", "Name": "Login", "Description": "<p>As a user</p>",
+         "LastUpdateDate": "2024-05-01T10:00:00.000Z"}
+TEST_CASE = {"ObjectID": 201, "FormattedID": "TC1", "Name": "Valid login", "LastRun": "2024-05-02T10:00:00.000Z",
+             "LastVerdict": "Pass", "LastBuild": "1.0.3", "Duration": 4.5,
+             "Owner": {"_refObjectName": "Dana"}, "Description": "", "LastUpdateDate": "2024-05-02T10:00:00.000Z"}
+TEST_CASE_ROW = {"FormattedID": "TC1", "Name": "Valid login", "Priority": "Important", "LastVerdict": "Pass",
+                 "Method": "Automated"}
+RESULT = {"Build": "1.0.3", "Date": "2024-05-02T10:00:00.000Z", "Verdict": "Fail",
+          "WorkProduct": {"_refObjectName": "US1"}, "Tester": {"_refObjectName": "Dana"}}
+DEFECT = {"ObjectID": 301, "FormattedID": "DE1", "Name": "Crash on login", "State": "Open", "Priority": "High",
+          "Severity": "Major Problem", "c_RCARootCauseUS": "Code", "CreationDate": "2024-05-03T10:00:00.000Z",
+          "Description": "", "LastUpdateDate": "2024-05-03T10:00:00.000Z"}
+
+
+def story_options(story):
+    # iter_rally_user_stories maps each story from its query; feed it the sample instead
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(utils, "iter_query", lambda *args, **kwargs: iter([story]))
+        return list(utils.iter_rally_user_stories("1", "1"))
+
+
+def search_upsert(kind):
+    index = SearchIndex(":memory:")
+    return lambda obj: index.upsert("1", "1", kind, [obj])
+
+
+CONSUMERS = [
+    (query.STORY_LIST, story_options, STORY),
+    (query.STORY_TEST_CASES, records.TestCase.from_rally, TEST_CASE),
+    (query.TEST_CASE_SUMMARY, rally_test.summarize_test_case, TEST_CASE_ROW),
+    (query.TEST_CASE_HISTORY, lambda obj: records.TestCaseResult.from_rally(obj, "TC1"), RESULT),
+    (query.PROJECT_DEFECTS, records.Defect.from_rally, DEFECT),
+    (query.STORY_SEARCH, search_upsert("story"), STORY),
+    (query.TEST_CASE_SEARCH, search_upsert("test_case"), TEST_CASE),
+    (query.DEFECT_SEARCH, search_upsert("defect"), DEFECT),
+]
+
+
+@pytest.mark.parametrize("projection, consume, sample", CONSUMERS, ids=lambda v: getattr(v, "name", None))
+def test_projection_fetches_only_what_its_consumer_reads(projection, consume, sample):
+    assert set(projection.fields) <= set(sample), "the sample must carry every requested field"
+    projection.assert_minimal(consume, [sample])
+
+
+@pytest.mark.parametrize("projection", [p for p, _, _ in CONSUMERS] + [query.STORY_REF],
+                         ids=lambda p: p.name)
+def test_fetch_has_no_duplicate_fields(projection):
+    fetched = projection.fetch.split(",")
+    assert len(fetched) == len(set(fetched))
+
+
+def test_search_sync_uses_the_declared_projections():
+    assert KINDS == {"story": query.STORY_SEARCH, "test_case": query.TEST_CASE_SEARCH,
+                     "defect": query.DEFECT_SEARCH}
+
+
+def test_audit_reports_unread_fields():
+    padded = query.Projection("hierarchicalrequirement", query.STORY_LIST.fields + ("Owner",), "padded")
+    assert padded.audit(story_options, [dict(STORY, Owner=None)]) == ["Owner"]
+    with pytest.raises(AssertionError, match="Owner"):
+        padded.assert_minimal(story_options, [dict(STORY, Owner=None)])
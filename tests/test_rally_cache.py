@@ -0,0 +1,66 @@
+import socket
+
+import pytest
+
+import utils
+from rally import aggregate, cache, records, stub
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def rally_config():
+    saved = dict(utils.config)
+    yield utils.config
+    cache.clear_caches()
+    utils.config.clear()
+    utils.config.update(saved)
+
+
+@pytest.fixture
+def rally(rally_config):
+    server = stub.serve(data=stub.StubData(projects=1, stories=3, test_cases=12))
+    rally_config.update(rally_endpoint=f"http://127.0.0.1:{server.server_port}", rally_api_key="key")
+    yield server
+    server.shutdown()
+
+
+def test_failed_test_data_fetch_is_not_cached(rally_config):
+    rally_config.update(rally_endpoint=f"http://127.0.0.1:{closed_port()}", rally_api_key="down")
+    assert cache.get_user_story_test_data("1", "100", "US1") is None
+    assert cache.get_user_story_test_data.cache.stats()["entries"] == 0
+
+
+def test_test_data_is_cached(rally):
+    data = cache.get_user_story_test_data("1", "100", "US1")
+    assert data["total_tests"] == 4
+    assert cache.get_user_story_test_data.cache.stats()["entries"] == 1
+
+
+def test_incomplete_summary_is_not_cached(rally_config):
+    rally_config.update(rally_endpoint=f"http://127.0.0.1:{closed_port()}", rally_api_key="down")
+    assert cache.get_user_story_test_summary("1", "100", "US1")["complete"] is False
+    assert cache.get_project_rca_summary("1", "100")["complete"] is False
+    assert cache.get_user_story_test_summary.cache.stats()["entries"] == 0
+    assert cache.get_project_rca_summary.cache.stats()["entries"] == 0
+
+
+def test_summary_is_cached(rally):
+    assert cache.get_user_story_test_summary("1", "100", "US1")["total_tests"] == 4
+    assert cache.get_user_story_test_summary.cache.stats()["entries"] == 1
+
+
+def test_rca_buckets_do_not_grow_with_parsed_defects(rally, monkeypatch):
+    asked = []
+    monkeypatch.setattr(aggregate, "count_buckets",
+                        lambda session, url, params, buckets: asked.append(sorted(buckets)) or
+                        dict.fromkeys(buckets, 0))
+    aggregate.get_project_rca_summary("1", "100")
+    records.SEVERITY.code("Custom Severity")
+    aggregate.get_project_rca_summary("1", "100")
+    assert asked[0] == asked[1]
+    assert "severity:Custom Severity" not in asked[1]
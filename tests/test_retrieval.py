@@ -0,0 +1,42 @@
+import pytest
+
+import utils
+from index import retrieval
+from rally import cache, stub
+
+
+@pytest.fixture
+def rally():
+    paths = []
+    server = stub.serve(data=stub.StubData(projects=1, stories=6, test_cases=30),
+                        on_request=lambda path, params: paths.append(path))
+    saved = dict(utils.config)
+    utils.config.update(rally_endpoint=f"http://127.0.0.1:{server.server_port}", rally_api_key=f"key-{id(paths)}")
+    yield paths
+    cache.clear_caches()
+    utils.config.clear()
+    utils.config.update(saved)
+    server.shutdown()
+
+
+def test_story_is_kept_out_of_its_own_history():
+    index = retrieval.BM25Index()
+    index.add(retrieval.Snippet("story", "US1", "Reset password by email"))
+    index.add(retrieval.Snippet("story", "US2", "Reset password from the profile page"))
+    assert "US1" in retrieval.retrieve_context(index, "reset password")
+    context = retrieval.retrieve_context(index, "reset password", exclude=["US1"])
+    assert "US1" not in context and "US2" in context
+    # A story typed in rather than picked from Rally has no ID to exclude
+    assert retrieval.retrieve_context(index, "reset password", exclude=[None]).count("Story") == 2
+
+
+def test_history_fetches_test_cases_only_when_asked(rally):
+    index = retrieval.project_history_index("1", "100")
+    assert {snippet.kind for snippet in index._snippets} == {"story", "defect"}
+    assert not any(path.endswith("/testcase") for path in rally)
+
+    with_tests = retrieval.project_history_index("1", "100", include_tests=True)
+    assert any(snippet.kind == "test_case" for snippet in with_tests._snippets)
+    assert sum(path.endswith("/testcase") for path in rally) == 6
+    # Cached separately, so asking again without tests reuses the first index
+    assert retrieval.project_history_index("1", "100") is index
@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+
+from shared_cache import ProcessCache
+
+
+def test_one_caller_computes_a_key_at_a_time():
+    cache = ProcessCache("test_key_locks")
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    start = threading.Barrier(8)
+
+    def compute():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return "value"
+
+    def call():
+        start.wait()
+        for _ in range(5):
+            # Never cached, so every caller computes; they must take turns
+            cache.get_or_compute("key", compute, should_cache=lambda value: False)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 1
+    assert cache._key_locks == {}
+
+
+def test_key_lock_is_released_when_compute_fails():
+    cache = ProcessCache("test_key_locks_error")
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("key", fail)
+    assert cache._key_locks == {}
+    assert cache.get_or_compute("key", lambda: 42) == 42
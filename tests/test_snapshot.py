@@ -0,0 +1,28 @@
+from rally import records
+from rally.snapshot import export_snapshot, export_test_data, load_snapshot
+
+
+def _case(test_case_id, date="2024-05-03T10:00:00.000Z"):
+    return records.TestCase(test_case_id, f"Verify {test_case_id}", 1, date, "Pass", "build-1", 1.5, "user")
+
+
+def test_story_exports_keep_other_stories_rows(tmp_path):
+    export_test_data(str(tmp_path), {"test_cases": [_case("TC1")]}, "P1", "US1")
+    export_test_data(str(tmp_path), {"test_cases": [_case("TC2")]}, "P1", "US2")
+    table = load_snapshot(str(tmp_path), "test_cases", projects=["P1"], months=["2024-05"])
+    assert sorted(table.column("test_case_id").to_pylist()) == ["TC1", "TC2"]
+
+
+def test_story_export_replaces_its_own_rows_in_every_month(tmp_path):
+    export_test_data(str(tmp_path), {"test_cases": [_case("TC1"), _case("TC9", "2024-04-01")]}, "P1", "US1")
+    export_test_data(str(tmp_path), {"test_cases": [_case("TC2")]}, "P1", "US2")
+    export_test_data(str(tmp_path), {"test_cases": [_case("TC3")]}, "P1", "US1")
+    table = load_snapshot(str(tmp_path), "test_cases", projects=["P1"])
+    assert sorted(table.column("test_case_id").to_pylist()) == ["TC2", "TC3"]
+
+
+def test_unscoped_export_replaces_the_months_it_contains(tmp_path):
+    export_snapshot(str(tmp_path), "test_cases", [_case("TC1"), _case("TC9", "2024-04-01")], "P1")
+    export_snapshot(str(tmp_path), "test_cases", [_case("TC2")], "P1")
+    table = load_snapshot(str(tmp_path), "test_cases", projects=["P1"])
+    assert sorted(table.column("test_case_id").to_pylist()) == ["TC2", "TC9"]
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from llm.structured import ItemScanner
+
+
+def scan(text, key="test_cases", chunk=1):
+    scanner = ItemScanner(key)
+    items = []
+    for i in range(0, len(text), chunk):
+        items += scanner.feed(text[i:i + chunk])
+    return scanner, items
+
+
+CASES = [{"name": "Login", "steps": ["open", "submit"], "expected_result": "signed in"},
+         {"name": "Logout", "steps": ["click"], "expected_result": "signed out"}]
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 10_000])
+def test_elements_of_the_keyed_array_not_an_earlier_one(chunk):
+    text = json.dumps({"tags": ["smoke"], "summary": {"ids": [1, 2]}, "test_cases": CASES})
+    scanner, items = scan(text, chunk=chunk)
+    assert [item.value for item in items] == CASES
+    assert scanner.done and not scanner.partial
+
+
+def test_first_array_inside_the_object_without_a_key():
+    _, items = scan(json.dumps({"cases": CASES, "more": [{"x": 1}]}), key=None)
+    assert [item.value for item in items] == CASES
+
+
+def test_keys_match_ignoring_case_and_punctuation():
+    _, items = scan(json.dumps({"testCases": CASES}))
+    assert [item.value for item in items] == CASES
+
+
+def test_single_object_reply_is_one_element():
+    _, items = scan(json.dumps(CASES[0]))
+    assert [item.value for item in items] == [CASES[0]]
+
+
+def test_top_level_array():
+    _, items = scan(json.dumps(CASES))
+    assert [item.value for item in items] == CASES
+
+
+def test_repairs_fences_trailing_commas_and_raw_newlines():
+    text = 'Here you go:\n```json\n{"test_cases": [{"name": "a\nb", "steps": ["x",],},]}\n```'
+    _, items = scan(text)
+    assert [item.value for item in items] == [{"name": "a\nb", "steps": ["x"]}]
+
+
+def test_truncated_element_is_reported_not_guessed():
+    text = json.dumps({"test_cases": CASES})[:-30]
+    scanner, items = scan(text)
+    assert [item.value for item in items] == CASES[:1]
+    assert scanner.partial
+
+
+def test_invalid_element_carries_its_error():
+    _, items = scan('{"test_cases": [{"name": tru}, {"name": "ok"}]}')
+    assert items[0].value is None and items[0].error
+    assert items[1].value == {"name": "ok"}
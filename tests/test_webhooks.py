@@ -0,0 +1,70 @@
+import importlib.util
+import os
+
+import pytest
+
+from rally import cache, webhooks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location("replay_webhooks",
+                                               os.path.join(ROOT, "scripts", "replay_webhooks.py"))
+replay_webhooks = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(replay_webhooks)
+
+SAMPLES = os.path.join(ROOT, "scripts", "webhook_samples.jsonl")
+
+
+def _sample(object_type):
+    return next(p for p in replay_webhooks.read_payloads(SAMPLES) if p["message"]["object_type"] == object_type)
+
+
+@pytest.fixture
+def entries():
+    # Cached data for two stories of project 77, one of project 88, and project 77's lists
+    store = cache.get_cache("test_webhook_entries")
+    store.invalidate()
+    store.set("US1", 1, tags=cache.story_test_tags("1", "77", "US1"))
+    store.set("US2", 2, tags=cache.story_test_tags("1", "77", "US2"))
+    store.set("US5", 5, tags=cache.story_test_tags("1", "88", "US5"))
+    store.set("stories 77", [], tags=cache.story_list_tags("1", "77"))
+    store.set("defects 77", [], tags=cache.project_defect_tags("1", "77"))
+    yield store
+    store.invalidate()
+
+
+def _left(store):
+    return sorted(key for key in ("US1", "US2", "US5", "stories 77", "defects 77") if store.get(key) is not None)
+
+
+def test_replayed_test_case_drops_only_its_story(entries):
+    record = webhooks.apply_event(_sample("TestCase"))
+    assert record["tags"] == [("story", "US1")]
+    assert _left(entries) == ["US2", "US5", "defects 77", "stories 77"]
+
+
+def test_replayed_test_case_result_drops_only_its_projects_tests(entries):
+    webhooks.apply_event(_sample("TestCaseResult"))
+    assert _left(entries) == ["US5", "defects 77", "stories 77"]
+
+
+def test_receiver_needs_the_token_for_events_and_stats(entries):
+    client = webhooks.create_app(token="secret").test_client()
+    assert client.post("/rally/webhook", json=_sample("TestCase")).status_code == 403
+    assert client.get("/rally/webhook/stats").status_code == 403
+    assert _left(entries) == ["US1", "US2", "US5", "defects 77", "stories 77"]
+    assert client.post("/rally/webhook?token=secret", json=_sample("TestCase")).status_code == 200
+    assert client.get("/rally/webhook/stats?token=secret").status_code == 200
+    assert _left(entries) == ["US2", "US5", "defects 77", "stories 77"]
+
+
+def test_receiver_refuses_a_public_address_without_a_token():
+    with pytest.raises(ValueError):
+        webhooks.start_receiver(0, host="0.0.0.0", token="")
+
+
+def test_api_exempts_only_the_receiver_post():
+    import api
+    client = api.create_app(token="api-token").test_client()
+    assert client.get("/rally/webhook/stats").status_code == 401
+    assert client.get("/rally/webhook/stats", headers={"Authorization": "Bearer api-token"}).status_code == 200
+    assert client.post("/rally/webhook", json={"message": {"object_type": "Other"}}).status_code == 200